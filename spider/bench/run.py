@@ -0,0 +1,180 @@
+"""Offline crawl and pipeline benchmarks.
+
+Each scenario runs in a fresh interpreter against a local synthetic site,
+with MongoDB, Qdrant and the conversion service replaced by in-process
+stand-ins, so peak RSS and round-trip counts belong to that scenario alone.
+
+    cd spider && python -m bench --scenarios crawl-async,pipeline --depth 3 --fanout 6
+"""
+import argparse
+import contextlib
+import io
+import json
+import logging
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+from bench.site import SiteConfig, SyntheticSite
+from bench.standins import CallCounter, ConversionService, install
+
+SCENARIOS = ('crawl-threaded', 'crawl-async', 'pipeline')
+RESULT_MARKER = 'BENCH_RESULT '
+
+def percentile(values, fraction: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(fraction * (len(ordered) - 1)))))
+    return ordered[index]
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is in KiB on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+def run_scenario(scenario: str, config: SiteConfig, options: dict) -> dict:
+    """Run one scenario in this process and return its measurements"""
+    os.chdir(tempfile.mkdtemp(prefix='spider-bench-'))
+    os.environ.setdefault('CRAWLER_HOST_RATE', str(options['host_rate']))
+    os.environ.setdefault('CRAWLER_HOST_BURST', str(int(options['host_rate'])))
+    os.environ.setdefault('CRAWLER_HOST_MAX_CONCURRENCY', str(options['host_concurrency']))
+    os.environ.setdefault('EMBEDDER', options['embedder'])
+    os.environ.setdefault('HTML_CONVERTER', options['html_converter'])
+    # Keep log output from being part of what is measured
+    logging.basicConfig(level=logging.WARNING)
+
+    site = SyntheticSite(config).start()
+    service = ConversionService(options['service_latency_ms']).start()
+    os.environ['PAGE_PROCESSOR_URL'] = service.url
+
+    counter = CallCounter()
+    recorded = install(counter)
+
+    from crawler import WebScraper
+    from pipeline import CrawlPipeline
+
+    result = {}
+    start_time = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        if scenario == 'crawl-threaded':
+            links = WebScraper(site.url).scrape()
+        elif scenario == 'crawl-async':
+            links = WebScraper(site.url).scrape_async()
+        else:
+            outcome = CrawlPipeline(site.url).run()
+            links = outcome['links']
+            result['stored'] = outcome['stored']
+            result['failed'] = len(outcome['failed'])
+    elapsed = time.perf_counter() - start_time
+
+    latencies = recorded['latencies']
+    counts = counter.snapshot()
+    result.update({
+        'scenario': scenario,
+        'seconds': round(elapsed, 3),
+        'links': len(links),
+        'pages_fetched': site.stats['pages'],
+        'pdfs_fetched': site.stats['pdfs'],
+        'pages_per_sec': round(site.stats['pages'] / elapsed, 1) if elapsed else 0.0,
+        'fetch_p50_ms': round(percentile(latencies, 0.50) * 1000, 2),
+        'fetch_p99_ms': round(percentile(latencies, 0.99) * 1000, 2),
+        'peak_rss_mb': round(peak_rss_mb(), 1),
+        'mongo_round_trips': counter.total('mongo.'),
+        'qdrant_round_trips': counter.total('qdrant.'),
+        'conversion_service_calls': service.calls,
+        'round_trips': counts
+    })
+    site.stop()
+    return result
+
+def run_in_subprocess(scenario: str, config: SiteConfig, options: dict) -> dict:
+    spider_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    payload = json.dumps({'scenario': scenario, 'config': config.to_dict(), 'options': options})
+    completed = subprocess.run(
+        [sys.executable, '-m', 'bench', '--child', payload],
+        cwd=spider_dir, capture_output=True, text=True, timeout=options['timeout']
+    )
+    for line in reversed(completed.stdout.splitlines()):
+        if line.startswith(RESULT_MARKER):
+            return json.loads(line[len(RESULT_MARKER):])
+    raise RuntimeError(f"{scenario} failed:\n{completed.stderr[-4000:]}")
+
+def format_table(results) -> str:
+    columns = [
+        ('scenario', 'scenario'), ('seconds', 's'), ('pages_fetched', 'pages'),
+        ('pages_per_sec', 'pages/s'), ('fetch_p50_ms', 'p50 ms'), ('fetch_p99_ms', 'p99 ms'),
+        ('peak_rss_mb', 'RSS MB'), ('mongo_round_trips', 'mongo'), ('qdrant_round_trips', 'qdrant'),
+        ('conversion_service_calls', 'service')
+    ]
+    rows = [[title for _, title in columns]]
+    rows += [[str(result.get(key, '')) for key, _ in columns] for result in results]
+    widths = [max(len(row[i]) for row in rows) for i in range(len(columns))]
+    return '\n'.join('  '.join(cell.rjust(width) for cell, width in zip(row, widths)) for row in rows)
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m bench', description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS),
+                        help=f"comma separated, from {', '.join(SCENARIOS)}")
+    parser.add_argument('--depth', type=int, default=3)
+    parser.add_argument('--fanout', type=int, default=5)
+    parser.add_argument('--page-kb', type=float, default=20.0, help='HTML page size')
+    parser.add_argument('--pdf-ratio', type=float, default=0.1, help='share of links pointing at PDFs')
+    parser.add_argument('--latency-ms', type=float, default=5.0, help='mean injected response latency')
+    parser.add_argument('--error-rate', type=float, default=0.02,
+                        help='share of pages failing with 503 on their first request')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=1, help='runs per scenario, the median is reported')
+    parser.add_argument('--host-rate', type=float, default=1000.0, help='politeness requests/sec per host')
+    parser.add_argument('--host-concurrency', type=int, default=32)
+    parser.add_argument('--service-latency-ms', type=float, default=50.0)
+    parser.add_argument('--html-converter', default='inprocess', choices=('inprocess', 'service'))
+    parser.add_argument('--embedder', default='hashing', help='embedder for the pipeline scenario')
+    parser.add_argument('--timeout', type=float, default=900.0, help='seconds per run')
+    parser.add_argument('--json', help='also write all results to this file')
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.child:
+        request = json.loads(args.child)
+        result = run_scenario(request['scenario'], SiteConfig(**request['config']), request['options'])
+        print(RESULT_MARKER + json.dumps(result))
+        return
+
+    config = SiteConfig(depth=args.depth, fanout=args.fanout, page_bytes=int(args.page_kb * 1024),
+                        pdf_ratio=args.pdf_ratio, latency_ms=args.latency_ms,
+                        error_rate=args.error_rate, seed=args.seed)
+    options = {
+        'host_rate': args.host_rate,
+        'host_concurrency': args.host_concurrency,
+        'service_latency_ms': args.service_latency_ms,
+        'html_converter': args.html_converter,
+        'embedder': args.embedder,
+        'timeout': args.timeout
+    }
+    expected = SyntheticSite(config).expected_pages()
+    print(f"Site: {expected['pages']} pages, {expected['pdfs']} PDFs, {json.dumps(config.to_dict())}")
+
+    results = []
+    for scenario in args.scenarios.split(','):
+        scenario = scenario.strip()
+        if scenario not in SCENARIOS:
+            raise SystemExit(f"Unknown scenario {scenario}, choose from {', '.join(SCENARIOS)}")
+        runs = [run_in_subprocess(scenario, config, options) for _ in range(args.repeat)]
+        runs.sort(key=lambda run: run['seconds'])
+        result = runs[len(runs) // 2]
+        result['runs'] = [run['seconds'] for run in runs]
+        results.append(result)
+        print(f"{scenario}: {result['seconds']}s, {result['links']} links", flush=True)
+
+    print()
+    print(format_table(results))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'site': config.to_dict(), 'expected': expected, 'results': results}, f, indent=2)
@@ -0,0 +1,179 @@
+import hashlib
+import http.server
+import random
+import threading
+import time
+from collections import Counter
+
+FILLER_WORDS = (
+    "admission application undergraduate graduate deadline tuition scholarship "
+    "transcript recommendation interview department program faculty semester "
+    "requirement document international student quota examination portfolio"
+).split()
+
+def make_pdf(text: str) -> bytes:
+    """A minimal single-page PDF showing text, valid enough for pdfminer"""
+    escaped = text.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+    lines = [escaped[i:i + 80] for i in range(0, len(escaped), 80)][:40] or ['']
+    stream = 'BT /F1 10 Tf 50 780 Td 12 TL ' + ' '.join(f'({line}) Tj T*' for line in lines) + ' ET'
+    objects = [
+        '<< /Type /Catalog /Pages 2 0 R >>',
+        '<< /Type /Pages /Kids [3 0 R] /Count 1 >>',
+        '<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 842] '
+        '/Resources << /Font << /F1 5 0 R >> >> /Contents 4 0 R >>',
+        f'<< /Length {len(stream)} >>\nstream\n{stream}\nendstream',
+        '<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>',
+    ]
+    out = bytearray(b'%PDF-1.4\n')
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += f'{number} 0 obj\n{body}\nendobj\n'.encode('latin-1')
+    xref = len(out)
+    out += f'xref\n0 {len(objects) + 1}\n0000000000 65535 f \n'.encode()
+    for offset in offsets:
+        out += f'{offset:010d} 00000 n \n'.encode()
+    out += f'trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n'.encode()
+    return bytes(out)
+
+class SiteConfig:
+    """Shape of the synthetic university site"""
+
+    def __init__(self, depth=3, fanout=5, page_bytes=20000, pdf_ratio=0.1,
+                 latency_ms=0.0, error_rate=0.0, seed=0):
+        self.depth = depth
+        self.fanout = fanout
+        self.page_bytes = page_bytes
+        self.pdf_ratio = pdf_ratio
+        self.latency_ms = latency_ms
+        self.error_rate = error_rate
+        self.seed = seed
+
+    def to_dict(self) -> dict:
+        return dict(self.__dict__)
+
+class SyntheticSite:
+    """Deterministic local admission site served over HTTP.
+
+    Every page at depth < config.depth links to config.fanout children; a
+    pdf_ratio share of those links point at PDFs instead. Pages also carry
+    navigation links (home, parent, tracking-parameter variants) and an
+    off-site link, as real university pages do. Responses are delayed by
+    about latency_ms, and an error_rate share of pages fail with a 503 on
+    their first request.
+    """
+
+    def __init__(self, config: SiteConfig):
+        self.config = config
+        self.stats = Counter()
+        self._lock = threading.Lock()
+        self._failed_once = set()
+        self._server = None
+        rng = random.Random(config.seed)
+        words = [rng.choice(FILLER_WORDS) for _ in range(config.page_bytes // 6 + 16)]
+        self._filler = ' '.join(words)
+
+    def _score(self, key: str) -> float:
+        digest = hashlib.md5(f"{self.config.seed}:{key}".encode()).digest()
+        return int.from_bytes(digest[:4], 'big') / 2 ** 32
+
+    def expected_pages(self) -> dict:
+        """Number of HTML pages and PDFs reachable from the root"""
+        pages, pdfs = 0, 0
+        frontier = ['/']
+        while frontier:
+            path = frontier.pop()
+            pages += 1
+            level = path.count('/') - 1
+            if level >= self.config.depth:
+                continue
+            for i in range(self.config.fanout):
+                if self._score(f"{path}{i}") < self.config.pdf_ratio:
+                    pdfs += 1
+                else:
+                    frontier.append(f"{path}p{i}/")
+        return {'pages': pages, 'pdfs': pdfs}
+
+    def render_page(self, path: str) -> bytes:
+        level = path.count('/') - 1
+        links = ['<a href="/">Home</a>', '<a href="../">Up</a>',
+                 f'<a href="{path}?utm_source=newsletter">Share</a>',
+                 '<a href="https://www.example.org/">Partner</a>']
+        if level < self.config.depth:
+            for i in range(self.config.fanout):
+                if self._score(f"{path}{i}") < self.config.pdf_ratio:
+                    links.append(f'<a href="{path}doc{i}.pdf">Brochure {i}</a>')
+                else:
+                    links.append(f'<a href="{path}p{i}/">Section {i}</a>')
+        header = (f'<html><head><title>Admissions {path}</title></head><body>'
+                  f'<nav>{"".join(links)}</nav><h1>Admissions {path}</h1>')
+        filler_len = max(0, self.config.page_bytes - len(header) - 30)
+        return f'{header}<p>{self._filler[:filler_len]}</p></body></html>'.encode()
+
+    def _handler(self):
+        site = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def _send(self, status, body=b'', content_type='text/html', headers=None):
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                if self.command != 'HEAD':
+                    self.wfile.write(body)
+                with site._lock:
+                    site.stats[f'status_{status}'] += 1
+                    site.stats['bytes'] += len(body)
+
+            def do_HEAD(self):
+                self.do_GET()
+
+            def do_GET(self):
+                path = self.path.split('?', 1)[0]
+                if path == '/robots.txt':
+                    return self._send(404)
+
+                latency = site.config.latency_ms / 1000.0
+                if latency:
+                    time.sleep(random.uniform(0.5 * latency, 1.5 * latency))
+
+                if path.endswith('.pdf'):
+                    with site._lock:
+                        site.stats['pdfs'] += 1
+                    text = f"Admission brochure {path}. " + site._filler[:1500]
+                    return self._send(200, make_pdf(text), 'application/pdf')
+
+                if site._score(f"error:{path}") < site.config.error_rate:
+                    with site._lock:
+                        first = path not in site._failed_once
+                        site._failed_once.add(path)
+                    if first:
+                        return self._send(503, headers={'Retry-After': '0'})
+
+                with site._lock:
+                    site.stats['pages'] += 1
+                self._send(200, site.render_page(path))
+
+        return Handler
+
+    def start(self) -> 'SyntheticSite':
+        self._server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self._server.server_port}/"
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
@@ -0,0 +1,165 @@
+"""Local stand-ins for MongoDB, Qdrant and the conversion service, with round-trip counters.
+
+install() must run before any spider module is imported, the stand-ins are
+patched into the modules the crawler uses.
+"""
+import functools
+import http.server
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src')
+
+MONGO_METHODS = (
+    'find', 'find_one', 'insert_one', 'insert_many', 'update_one', 'update_many',
+    'replace_one', 'delete_one', 'delete_many', 'bulk_write', 'count_documents',
+    'create_index', 'find_one_and_update', 'aggregate'
+)
+
+class CallCounter:
+    """Thread-safe call counts, keyed like 'mongo.find' or 'qdrant.upsert'"""
+
+    def __init__(self):
+        self.counts = Counter()
+        self._lock = threading.Lock()
+
+    def add(self, key: str, n: int = 1):
+        with self._lock:
+            self.counts[key] += n
+
+    def total(self, prefix: str) -> int:
+        with self._lock:
+            return sum(n for key, n in self.counts.items() if key.startswith(prefix))
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return dict(self.counts)
+
+class CountingProxy:
+    """Forwards attribute access to an object, counting every method call"""
+
+    def __init__(self, target, counter: CallCounter, prefix: str):
+        self._target = target
+        self._counter = counter
+        self._prefix = prefix
+
+    def __getattr__(self, name):
+        attribute = getattr(self._target, name)
+        if not callable(attribute):
+            return attribute
+
+        @functools.wraps(attribute)
+        def counted(*args, **kwargs):
+            self._counter.add(f"{self._prefix}.{name}")
+            return attribute(*args, **kwargs)
+        return counted
+
+def _count_class_methods(cls, names, counter: CallCounter, prefix: str):
+    for name in names:
+        original = getattr(cls, name, None)
+        if original is None:
+            continue
+
+        def counted(*args, _original=original, _name=name, **kwargs):
+            counter.add(f"{prefix}.{_name}")
+            return _original(*args, **kwargs)
+        setattr(cls, name, counted)
+
+class ConversionService:
+    """Stand-in for the html-to-markdown rendering service (POST /convert)"""
+
+    def __init__(self, latency_ms: float = 0.0):
+        self.latency_ms = latency_ms
+        self.calls = 0
+        self._lock = threading.Lock()
+        self._server = None
+
+    def start(self) -> 'ConversionService':
+        service = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length', 0))
+                url = json.loads(self.rfile.read(length) or b'{}').get('url', '')
+                if service.latency_ms:
+                    time.sleep(service.latency_ms / 1000.0)
+                with service._lock:
+                    service.calls += 1
+                body = json.dumps({'markdown': f"# Rendered {url}\n\nRendered admission content."}).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        self._server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self._server.server_port}/convert"
+
+def install(counter: CallCounter) -> dict:
+    """Patch MongoDB, Qdrant and the school name lookup with local stand-ins.
+
+    Returns the recorded fetch latencies list, filled by the politeness
+    scheduler as requests complete.
+    """
+    if SRC_DIR not in sys.path:
+        sys.path.insert(0, SRC_DIR)
+
+    # MongoDB: one shared in-memory client, since every manager would
+    # otherwise get its own empty mongomock instance
+    import mongomock
+    import mongomock.collection
+    import pymongo
+
+    shared_client = mongomock.MongoClient()
+    mongomock.MongoClient.close = lambda self: None
+
+    def client_factory(*args, **kwargs):
+        return shared_client
+    pymongo.MongoClient = client_factory
+    _count_class_methods(mongomock.collection.Collection, MONGO_METHODS, counter, 'mongo')
+
+    # Older mongomock bulk builders don't accept the sort argument newer pymongo passes
+    add_update = mongomock.collection.BulkOperationBuilder.add_update
+
+    def add_update_without_sort(self, selector, doc, multi=False, upsert=False, sort=None, **kwargs):
+        return add_update(self, selector, doc, multi, upsert, **kwargs)
+    mongomock.collection.BulkOperationBuilder.add_update = add_update_without_sort
+
+    import mongoDB_manager
+    mongoDB_manager.MongoClient = client_factory
+
+    # Qdrant: one local in-memory client behind a counting proxy
+    import qdrant_client
+    import Qdrant_manager
+    qdrant = CountingProxy(qdrant_client.QdrantClient(':memory:'), counter, 'qdrant')
+    Qdrant_manager.QdrantClient = lambda *args, **kwargs: qdrant
+
+    # No language model for school names
+    import utils.helper
+    utils.helper.get_school_abbreviation = lambda url: 'bench'
+
+    # Fetch latencies as seen by the crawler, recorded where both engines
+    # report every completed request
+    import scheduler
+    latencies = []
+    release = scheduler.PolitenessScheduler.release
+
+    def recording_release(self, host, status=None, elapsed=None, retry_after=None):
+        if elapsed is not None:
+            latencies.append(elapsed)
+        return release(self, host, status, elapsed, retry_after)
+    scheduler.PolitenessScheduler.release = recording_release
+    return {'latencies': latencies}
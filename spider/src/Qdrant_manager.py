@@ -1,18 +1,108 @@
 from qdrant_client import QdrantClient
-from qdrant_client.models import PointStruct, Distance, VectorParams
+from qdrant_client.models import (
+    PointStruct, Distance, VectorParams, Filter, FieldCondition, MatchValue,
+    PayloadSchemaType, HnswConfigDiff, SearchParams
+)
+from collections import OrderedDict, deque
+from concurrent.futures import Future
 from datetime import datetime
+import base64
 import hashlib
+import os
 import threading
+import time
+
+from content_store import (CONTENT_BLOB_DIR, CONTENT_COMPRESSION, CONTENT_INLINE_MAX_BYTES, PAYLOAD_FIELDS,
+                           BlobStore, ContentCodec, decode_payload, encode_payload, zstandard)
+from embeddings import chunk_markdown, get_embedder
+from metrics import InstrumentedClient, stage
+
+# Chunk embeddings for semantic search; set to 0 to store documents only
+DOCUMENT_EMBEDDINGS = os.getenv('DOCUMENT_EMBEDDINGS', '1') not in ('0', 'false', 'off')
+HNSW_M = int(os.getenv('QDRANT_HNSW_M', 16))
+HNSW_EF_CONSTRUCT = int(os.getenv('QDRANT_HNSW_EF_CONSTRUCT', 128))
+SEARCH_HNSW_EF = int(os.getenv('QDRANT_SEARCH_EF', 128))
+
+# Payload fields that decide whether a stored point is up to date; content
+# points are addressed by their hash, so for them the hash alone does
+_IDENTITY_FIELDS = ['type', 'content_hash', 'url', 'school', 'raw_hash']
+
+def hash_content(content) -> str:
+    """Content hash used to address converted documents (str or raw bytes)"""
+    if isinstance(content, str):
+        content = content.encode()
+    return hashlib.md5(content).hexdigest()
 
 class DocumentStore:
-    def __init__(self, host="qdrant", port=6333, collection_name="documents"):
-        self.client = QdrantClient(host, port=port)
+    """Qdrant-backed document store, content addressed.
+
+    Converted markdown is stored once per distinct body in a 'content' point
+    keyed by its hash. Document (per URL) and merged (per school and URL)
+    points only reference that hash, so URLs and schools sharing a page
+    share its storage. 'raw' points map the hash of a fetched body to the
+    hash of its converted content, letting callers skip conversion of a body
+    that was already converted under another URL.
+
+    Content is stored compressed (see content_store): zstd, with a shared
+    dictionary once train_dictionary() has been run, or zlib. Large bodies
+    go to a local blob store and the content point keeps their key.
+    Content is only decompressed when it is read with get_content().
+
+    With embeddings enabled, stored documents are also split into chunks,
+    embedded in batches and written to a '<collection>_chunks' collection
+    with real vectors and an HNSW index, which search() queries.
+    """
+
+    def __init__(self, host="qdrant", port=6333, collection_name="documents",
+                 buffered=False, batch_size=64, batch_bytes=8 * 1024 * 1024,
+                 flush_interval=1.0, max_pending=1024, cache_size=65536,
+                 embeddings=DOCUMENT_EMBEDDINGS, embedder=None, compression=CONTENT_COMPRESSION,
+                 blob_dir=CONTENT_BLOB_DIR, inline_max=CONTENT_INLINE_MAX_BYTES):
+        self.client = InstrumentedClient(QdrantClient(host, port=port), 'qdrant')
         self.collection_name = collection_name
         self._print_lock = threading.Lock()
         
+        self.codec = ContentCodec(compression, load_dictionary=self._load_dictionary)
+        self.blobs = BlobStore(blob_dir) if blob_dir else None
+        self.inline_max = inline_max
+        
+        self.chunks_collection = None
+        self.embedder = None
+        if embeddings:
+            self.embedder = embedder or get_embedder()
+            self.chunks_collection = f"{collection_name}_chunks"
+        
+        # Buffered mode: points are collected and upserted in batches bounded
+        # by count and payload bytes, from a background flusher thread.
+        # Submitters block once max_pending documents are waiting (backpressure)
+        self.buffered = buffered
+        self.max_pending = max_pending
+        self.batch_size = batch_size
+        self.batch_bytes = batch_bytes
+        self.flush_interval = flush_interval
+        self._buffer = deque()
+        self._buffer_bytes = 0
+        self._buffer_cond = threading.Condition()
+        self._closed = False
+        self._flush_requested = False
+        self._flusher = None
+        
+        # Recently seen content hashes and raw -> content mappings, so repeated
+        # bodies cost no Qdrant round trip
+        self.cache_size = cache_size
+        self._cache_lock = threading.Lock()
+        self._stored_content = OrderedDict()
+        self._raw_index = OrderedDict()
+        self._indexed = OrderedDict()
+        
         # Initialize collection
         self._init_collection()
-    
+        self._activate_stored_dictionary()
+        
+        if self.buffered:
+            self._flusher = threading.Thread(target=self._flush_loop, daemon=True)
+            self._flusher.start()
+
     def _init_collection(self):
         """Initialize Qdrant collection if it doesn't exist"""
         try:
@@ -23,80 +113,804 @@ class DocumentStore:
             )
         except Exception:
             pass
-    
+        
+        # Keyword indexes so school/type/hash filters are resolved server side
+        for field_name in ('school', 'type', 'content_hash'):
+            try:
+                self.client.create_payload_index(
+                    collection_name=self.collection_name,
+                    field_name=field_name,
+                    field_schema=PayloadSchemaType.KEYWORD
+                )
+            except Exception:
+                pass
+        
+        if self.chunks_collection:
+            self._init_chunks_collection()
+
+    def _init_chunks_collection(self):
+        """Create the chunk collection sized for the embedder, with HNSW settings and payload indexes"""
+        try:
+            self.client.create_collection(
+                collection_name=self.chunks_collection,
+                vectors_config=VectorParams(size=self.embedder.dimension, distance=Distance.COSINE),
+                hnsw_config=HnswConfigDiff(m=HNSW_M, ef_construct=HNSW_EF_CONSTRUCT),
+                on_disk_payload=True
+            )
+        except Exception:
+            pass
+        
+        try:
+            size = self.client.get_collection(self.chunks_collection).config.params.vectors.size
+        except Exception as e:
+            self._safe_print(f"Could not read chunk collection {self.chunks_collection}, embeddings disabled: {e}")
+            self.chunks_collection = None
+            return
+        if size != self.embedder.dimension:
+            self._safe_print(f"Chunk collection {self.chunks_collection} has {size}-dimensional vectors but "
+                             f"{self.embedder.name} produces {self.embedder.dimension}, embeddings disabled")
+            self.chunks_collection = None
+            return
+        if not self._check_embedder():
+            self.chunks_collection = None
+            return
+        
+        for field_name in ('school', 'type', 'content_hash'):
+            try:
+                self.client.create_payload_index(
+                    collection_name=self.chunks_collection,
+                    field_name=field_name,
+                    field_schema=PayloadSchemaType.KEYWORD
+                )
+            except Exception:
+                pass
+
+    def _check_embedder(self) -> bool:
+        """Whether the chunk collection's vectors come from this store's embedder.
+
+        Models of the same dimension cannot be told apart by the collection
+        alone, so the embedder that writes the chunks is recorded in the
+        document collection the first time.
+        """
+        marker_id = self._point_id(f"embedder:{self.chunks_collection}")
+        try:
+            markers = self.client.retrieve(
+                collection_name=self.collection_name,
+                ids=[marker_id],
+                with_payload=['name'],
+                with_vectors=False
+            )
+            if not markers:
+                self.client.upsert(
+                    collection_name=self.collection_name,
+                    points=[PointStruct(
+                        id=marker_id,
+                        vector=[1.0],  # Placeholder vector
+                        payload={'type': 'embedder', 'collection': self.chunks_collection,
+                                 'name': self.embedder.name}
+                    )]
+                )
+                return True
+        except Exception as e:
+            self._safe_print(f"Could not check the embedder of {self.chunks_collection}: {e}")
+            return True
+        name = markers[0].payload.get('name')
+        if name != self.embedder.name:
+            self._safe_print(f"Chunk collection {self.chunks_collection} was embedded with {name}, not "
+                             f"{self.embedder.name}, embeddings disabled; delete the collection to re-embed")
+            return False
+        return True
+
     def _safe_print(self, message):
         """Thread-safe print function"""
         with self._print_lock:
             print(message)
-    
-    def store_document(self, url: str, content: str, doc_type: str) -> bool:
-        """Store a single document in Qdrant"""
+
+    def _point_id(self, url: str) -> int:
+        doc_id = hashlib.md5(url.encode()).hexdigest()
+        return int(doc_id[:16], 16)
+
+    def _content_point_id(self, content_hash: str) -> int:
+        return self._point_id(f"content:{content_hash}")
+
+    def _raw_point_id(self, raw_hash: str) -> int:
+        return self._point_id(f"raw:{raw_hash}")
+
+    def _dictionary_point_id(self, dict_id) -> int:
+        return self._point_id(f"zdict:{dict_id}")
+
+    def _remember(self, cache: OrderedDict, key: str, value=True):
+        with self._cache_lock:
+            cache[key] = value
+            cache.move_to_end(key)
+            while len(cache) > self.cache_size:
+                cache.popitem(last=False)
+
+    def _forget(self, cache: OrderedDict, key: str):
+        with self._cache_lock:
+            cache.pop(key, None)
+
+    def _cached(self, cache: OrderedDict, key: str):
+        with self._cache_lock:
+            return cache.get(key)
+
+    def get_content_hash(self, url: str):
+        """Return the content hash stored for a URL, or None if it is not stored"""
+        points = self.client.retrieve(
+            collection_name=self.collection_name,
+            ids=[self._point_id(url)],
+            with_payload=['content_hash'],
+            with_vectors=False
+        )
+        if not points:
+            return None
+        return points[0].payload.get('content_hash')
+
+    def has_document(self, url: str) -> bool:
+        """Check whether a document for the URL is already stored"""
+        return self.get_content_hash(url) is not None
+
+    def get_content(self, content_hash: str):
+        """Return the converted content stored under a content hash, or None"""
+        points = self.client.retrieve(
+            collection_name=self.collection_name,
+            ids=[self._content_point_id(content_hash)],
+            with_payload=PAYLOAD_FIELDS,
+            with_vectors=False
+        )
+        if not points:
+            return None
+        return self._decode_content(points[0].payload)
+
+    def _decode_content(self, payload: dict):
+        content = decode_payload(self.codec, self.blobs, payload)
+        if content is None and 'blob' in payload:
+            self._safe_print(f"Content blob {payload['blob']} is missing from "
+                             f"{self.blobs.directory if self.blobs else 'the (disabled) blob store'}")
+        return content
+
+    def _load_dictionary(self, dict_id: int):
+        """Bytes of a stored zstd dictionary, or None"""
+        points = self.client.retrieve(
+            collection_name=self.collection_name,
+            ids=[self._dictionary_point_id(dict_id)],
+            with_payload=['data'],
+            with_vectors=False
+        )
+        if not points:
+            return None
+        return base64.b64decode(points[0].payload['data'])
+
+    def _activate_stored_dictionary(self):
+        """Compress with the dictionary train_dictionary() last activated, if any"""
+        if self.codec.encoding != 'zstd':
+            return
         try:
-            doc_id = hashlib.md5(url.encode()).hexdigest()
-            
-            point = PointStruct(
-                id=int(doc_id[:16], 16),
-                vector=[1.0],  # Placeholder vector
+            points = self.client.retrieve(
+                collection_name=self.collection_name,
+                ids=[self._dictionary_point_id('active')],
+                with_payload=['dict_id'],
+                with_vectors=False
+            )
+            if points:
+                data = self._load_dictionary(points[0].payload['dict_id'])
+                if data:
+                    self.codec.use_dictionary(data)
+        except Exception as e:
+            self._safe_print(f"Could not load the content dictionary, compressing without one: {e}")
+
+    def get_document(self, url: str):
+        """Return the payload stored for a URL with its content resolved, or None"""
+        points = self.client.retrieve(
+            collection_name=self.collection_name,
+            ids=[self._point_id(url)],
+            with_payload=True,
+            with_vectors=False
+        )
+        if not points:
+            return None
+        document = dict(points[0].payload)
+        document['content'] = self.get_content(document['content_hash'])
+        return document
+
+    def lookup_raw(self, raw_hash: str):
+        """Return the content hash a fetched body with this hash was converted to, or None"""
+        content_hash = self._cached(self._raw_index, raw_hash)
+        if content_hash:
+            return content_hash
+        points = self.client.retrieve(
+            collection_name=self.collection_name,
+            ids=[self._raw_point_id(raw_hash)],
+            with_payload=['content_hash'],
+            with_vectors=False
+        )
+        if not points:
+            return None
+        content_hash = points[0].payload.get('content_hash')
+        self._remember(self._raw_index, raw_hash, content_hash)
+        return content_hash
+
+    def _build_content_point(self, content: str, content_hash: str) -> PointStruct:
+        payload = {
+            'type': 'content',
+            'content_hash': content_hash,
+            'timestamp': datetime.now().isoformat()
+        }
+        payload.update(encode_payload(self.codec, self.blobs, content, self.inline_max))
+        return PointStruct(
+            id=self._content_point_id(content_hash),
+            vector=[1.0],  # Placeholder vector
+            payload=payload
+        )
+
+    def _build_raw_point(self, raw_hash: str, content_hash: str) -> PointStruct:
+        return PointStruct(
+            id=self._raw_point_id(raw_hash),
+            vector=[1.0],  # Placeholder vector
+            payload={
+                'type': 'raw',
+                'raw_hash': raw_hash,
+                'content_hash': content_hash
+            }
+        )
+
+    def _build_point(self, url: str, content_hash: str, doc_type: str, school: str = None) -> PointStruct:
+        payload = {
+            'url': url,
+            'type': doc_type,
+            'timestamp': datetime.now().isoformat(),
+            'content_hash': content_hash
+        }
+        if school:
+            payload['school'] = school
+        return PointStruct(
+            id=self._point_id(url),
+            vector=[1.0],  # Placeholder vector
+            payload=payload
+        )
+
+    def store_document(self, url: str, content: str, doc_type: str, school: str = None,
+                       raw_hash: str = None) -> bool:
+        """Store a single document in Qdrant, skipping the upsert if its content is unchanged"""
+        return self.submit_document(url, content, doc_type, school, raw_hash).result()
+
+    def submit_document(self, url: str, content: str, doc_type: str, school: str = None,
+                        raw_hash: str = None) -> Future:
+        """Queue a document for a batched upsert.
+        
+        The content is written once per distinct hash and the URL's point
+        references it. raw_hash (the hash of the fetched body) is recorded so
+        later copies of the same body can skip conversion, see lookup_raw().
+        Returns a Future that resolves to True once the document's batch is
+        written (or skipped as unchanged) and False if it could not be stored.
+        Without buffering the document is stored immediately.
+        """
+        content_hash = hash_content(content)
+        points = []
+        payload_bytes = 0
+        if not self._cached(self._stored_content, content_hash):
+            point = self._build_content_point(content, content_hash)
+            payload_bytes = len(point.payload.get('data') or point.payload.get('content') or '')
+            points.append(point)
+        points.append(self._build_point(url, content_hash, doc_type, school))
+        if raw_hash:
+            points.append(self._build_raw_point(raw_hash, content_hash))
+            # Visible to lookups right away; dropped again if the write fails
+            self._remember(self._raw_index, raw_hash, content_hash)
+        return self._submit_points(points, Future(), payload_bytes)
+
+    def submit_reference(self, url: str, content_hash: str, doc_type: str, school: str = None) -> Future:
+        """Queue a document whose content is already stored (or queued) under content_hash"""
+        return self._submit_points([self._build_point(url, content_hash, doc_type, school)], Future())
+
+    def submit_merged_document(self, school_name: str, url: str, content_hash: str) -> Future:
+        """Queue the merged (school-level) reference to a document, as store_school_documents writes it"""
+        point = self._build_merged_point(school_name, url, content_hash, datetime.now().isoformat())
+        return self._submit_points([point], Future())
+
+    def _submit_points(self, points, future: Future, content_bytes: int = 0) -> Future:
+        if not self.buffered:
+            self._write_batch([(points, future)])
+            return future
+        
+        size = content_bytes + 256 * len(points)
+        with self._buffer_cond:
+            while not self._closed and len(self._buffer) >= self.max_pending:
+                self._buffer_cond.wait()
+            if self._closed:
+                raise RuntimeError("DocumentStore is closed")
+            self._buffer.append((points, future, size))
+            self._buffer_bytes += size
+            if len(self._buffer) >= self.batch_size or self._buffer_bytes >= self.batch_bytes:
+                self._buffer_cond.notify_all()
+        return future
+
+    def _take_batch(self):
+        batch = []
+        batch_bytes = 0
+        while self._buffer and len(batch) < self.batch_size:
+            points, future, size = self._buffer[0]
+            if batch and batch_bytes + size > self.batch_bytes:
+                break
+            self._buffer.popleft()
+            batch.append((points, future))
+            batch_bytes += size
+        self._buffer_bytes -= batch_bytes
+        if not self._buffer:
+            self._flush_requested = False
+        # Wake submitters blocked on max_pending
+        self._buffer_cond.notify_all()
+        return batch
+
+    def _flush_loop(self):
+        while True:
+            with self._buffer_cond:
+                deadline = time.monotonic() + self.flush_interval
+                while (not self._closed and
+                       not self._flush_requested and
+                       len(self._buffer) < self.batch_size and
+                       self._buffer_bytes < self.batch_bytes):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._buffer_cond.wait(remaining)
+                if self._closed and not self._buffer:
+                    return
+                batch = self._take_batch()
+            if batch:
+                self._write_batch(batch)
+
+    @staticmethod
+    def _identity(payload: dict) -> dict:
+        if payload.get('type') == 'content':
+            return {'content_hash': payload.get('content_hash')}
+        return {field: payload[field] for field in _IDENTITY_FIELDS if field in payload}
+
+    def _stored_identities(self, points):
+        """Map point id -> identity fields (see _IDENTITY_FIELDS) for the points that already exist"""
+        try:
+            existing = self.client.retrieve(
+                collection_name=self.collection_name,
+                ids=list({point.id for point in points}),
+                with_payload=_IDENTITY_FIELDS,
+                with_vectors=False
+            )
+            return {point.id: self._identity(point.payload) for point in existing}
+        except Exception as e:
+            self._safe_print(f"Could not check stored documents, writing all: {e}")
+            return {}
+
+    def _written(self, points):
+        for point in points:
+            if point.payload['type'] == 'content':
+                self._remember(self._stored_content, point.payload['content_hash'])
+
+    def _write_batch(self, batch):
+        """Upsert one batch of documents, then embed the chunks of newly seen content"""
+        with stage('store'):
+            stored = self._upsert_batch(batch)
+        if not self.chunks_collection:
+            return
+        try:
+            with stage('embed'):
+                self._index_chunks(stored)
+        except Exception as e:
+            # Documents are stored either way; their chunks are retried on the next write
+            self._safe_print(f"Failed to index document chunks: {e}")
+
+    def _upsert_batch(self, batch):
+        """Upsert one batch of documents, skipping unchanged points and resolving each future.
+
+        Returns the batch's points that are now stored.
+        """
+        # Only the last point submitted for an id is written, so a URL submitted
+        # again with new content keeps the new content, and content shared by
+        # several documents in the batch is written once
+        latest = {}
+        for points, _ in batch:
+            for point in points:
+                latest[point.id] = point
+        stored_identities = self._stored_identities(list(latest.values()))
+        
+        # Point id -> whether it is stored; points stored with the same hash
+        # and metadata (school, type, url) are unchanged
+        stored = {}
+        to_write = []
+        for points, _ in batch:
+            pending = []
+            for point in points:
+                if latest[point.id] is not point:
+                    continue
+                if stored_identities.get(point.id) == self._identity(point.payload):
+                    self._written([point])
+                    stored[point.id] = True
+                else:
+                    pending.append(point)
+            if pending:
+                to_write.append(pending)
+        
+        if to_write:
+            try:
+                self.client.upsert(
+                    collection_name=self.collection_name,
+                    points=[point for points in to_write for point in points]
+                )
+                for points in to_write:
+                    self._written(points)
+                    stored.update((point.id, True) for point in points)
+                self._safe_print(f"Stored batch of {len(to_write)} documents in Qdrant")
+            except Exception as e:
+                # Fall back to per-document upserts so one bad point doesn't fail the batch
+                self._safe_print(f"Batch upsert failed ({e}), retrying documents individually")
+                for points in to_write:
+                    try:
+                        self.client.upsert(collection_name=self.collection_name, points=points)
+                        self._written(points)
+                        stored.update((point.id, True) for point in points)
+                    except Exception as point_error:
+                        url = next((p.payload['url'] for p in points if 'url' in p.payload), 'content')
+                        self._safe_print(f"Failed to store document {url}: {point_error}")
+                        for point in points:
+                            stored[point.id] = False
+                            if point.payload['type'] == 'raw':
+                                self._forget(self._raw_index, point.payload['raw_hash'])
+        
+        # A document is stored once every one of its ids holds what was written
+        # for it, its own point or a later one that replaced it
+        for points, future in batch:
+            future.set_result(all(stored[point.id] for point in points))
+        return [latest[point_id] for point_id, ok in stored.items() if ok]
+
+    def _chunk_id(self, school: str, content_hash: str, index: int) -> int:
+        return self._point_id(f"chunk:{school}:{content_hash}:{index}")
+
+    def _index_chunks(self, points):
+        """Chunk and embed the documents among points whose (school, content) pair has no chunks yet"""
+        # Content points of this batch, decompressed only for pairs that need chunks
+        contents = {point.payload['content_hash']: point.payload
+                    for point in points if point.payload['type'] == 'content'}
+        wanted = {}
+        for point in points:
+            payload = point.payload
+            if payload['type'] in ('content', 'raw', 'merged') or not payload.get('school'):
+                continue
+            key = (payload['school'], payload['content_hash'])
+            if key not in wanted and not self._cached(self._indexed, key):
+                wanted[key] = payload['type']
+        if not wanted:
+            return
+        
+        # Chunk 0 exists once a pair has been indexed
+        existing = self.client.retrieve(
+            collection_name=self.chunks_collection,
+            ids=[self._chunk_id(school, content_hash, 0) for school, content_hash in wanted],
+            with_payload=False,
+            with_vectors=False
+        )
+        existing_ids = {point.id for point in existing}
+        
+        pending = []
+        for (school, content_hash), doc_type in wanted.items():
+            if self._chunk_id(school, content_hash, 0) in existing_ids:
+                self._remember(self._indexed, (school, content_hash))
+                continue
+            if content_hash in contents:
+                content = self._decode_content(contents[content_hash])
+            else:
+                content = self.get_content(content_hash)
+            if not content:
+                continue
+            for index, (heading, text) in enumerate(chunk_markdown(content)):
+                pending.append((school, content_hash, doc_type, index, heading, text))
+        if not pending:
+            return
+        
+        # Headings give short chunks the context they were written in
+        vectors = self.embedder.embed(
+            f"{heading}\n{text}" if heading else text for _, _, _, _, heading, text in pending
+        )
+        chunk_points = [
+            PointStruct(
+                id=self._chunk_id(school, content_hash, index),
+                vector=vector,
                 payload={
-                    'url': url,
-                    'content': content,
+                    'school': school,
+                    'content_hash': content_hash,
                     'type': doc_type,
-                    'timestamp': datetime.now().isoformat(),
-                    'content_hash': hashlib.md5(content.encode()).hexdigest()
+                    'chunk_index': index,
+                    'heading': heading,
+                    'text': text
                 }
             )
-            
+            for (school, content_hash, doc_type, index, heading, text), vector in zip(pending, vectors)
+        ]
+        for start in range(0, len(chunk_points), 256):
+            self.client.upsert(collection_name=self.chunks_collection,
+                               points=chunk_points[start:start + 256])
+        for school, content_hash, _, _, _, _ in pending:
+            self._remember(self._indexed, (school, content_hash))
+        self._safe_print(f"Indexed {len(chunk_points)} chunks for {len(wanted) - len(existing_ids)} documents")
+
+    def pending(self) -> int:
+        """Number of documents waiting in the write buffer"""
+        return len(self._buffer)
+
+    def flush(self):
+        """Write everything buffered so far and wait for it to complete"""
+        if not self.buffered:
+            return
+        with self._buffer_cond:
+            pending = [future for _, future, _ in self._buffer]
+            self._flush_requested = True
+            self._buffer_cond.notify_all()
+        for future in pending:
+            future.result()
+
+    def close(self):
+        """Flush buffered documents and stop the background flusher"""
+        if not self.buffered:
+            return
+        with self._buffer_cond:
+            self._closed = True
+            self._buffer_cond.notify_all()
+        self._flusher.join()
+
+    def _merged_point_id(self, school_name: str, url: str) -> int:
+        doc_id = hashlib.md5(f"{school_name}_{url}".encode()).hexdigest()
+        return int(doc_id[:16], 16)
+
+    def _build_merged_point(self, school_name: str, url: str, content_hash: str,
+                            timestamp: str) -> PointStruct:
+        return PointStruct(
+            id=self._merged_point_id(school_name, url),
+            vector=[1.0],  # Placeholder vector
+            payload={
+                'school': school_name,
+                'url': url,
+                'type': 'merged',
+                'timestamp': timestamp,
+                'content_hash': content_hash
+            }
+        )
+
+    def _merge_batch(self, school_name: str, points, timestamp: str) -> int:
+        """Write merged references for one scroll page, skipping those already up to date"""
+        merged_ids = {point.id: self._merged_point_id(school_name, point.payload['url'])
+                      for point in points}
+        existing = self.client.retrieve(
+            collection_name=self.collection_name,
+            ids=list(merged_ids.values()),
+            with_payload=['content_hash'],
+            with_vectors=False
+        )
+        merged_hashes = {point.id: point.payload.get('content_hash') for point in existing}
+        
+        # Merged points reference the shared content, nothing is copied
+        new_points = [
+            self._build_merged_point(school_name, point.payload['url'],
+                                     point.payload['content_hash'], timestamp)
+            for point in points
+            if merged_hashes.get(merged_ids[point.id]) != point.payload['content_hash']
+        ]
+        if new_points:
             self.client.upsert(
                 collection_name=self.collection_name,
-                points=[point]
+                points=new_points
             )
-            
-            self._safe_print(f"Stored {doc_type.upper()} in Qdrant: {url}")
-            return True
-            
-        except Exception as e:
-            self._safe_print(f"Failed to store document {url}: {e}")
-            return False
-    
-    def store_school_documents(self, school_name: str) -> int:
+        return len(new_points)
+
+    def store_school_documents(self, school_name: str, batch_size: int = 256) -> int:
+        """Write merged references to a school's documents.
+        
+        Pages through the collection with scroll offsets, filtering by school
+        on the server and reading only url/content_hash, so memory stays
+        bounded by batch_size. Documents whose merged reference is already up
+        to date are skipped. Returns the number of merged points written.
+        """
         try:
-            scroll_result = self.client.scroll(
-                collection_name=self.collection_name,
-                with_payload=True,
-                with_vectors=True
+            scroll_filter = Filter(
+                must=[FieldCondition(key='school', match=MatchValue(value=school_name))],
+                must_not=[FieldCondition(key='type', match=MatchValue(value='merged'))]
             )
-            points = scroll_result[0]
-            
             timestamp = datetime.now().isoformat()
-            new_points = []
-            
-            for point in points:
-                payload = point.payload
-                doc_id = hashlib.md5(f"{school_name}_{payload['url']}".encode()).hexdigest()
-                
-                new_point = PointStruct(
-                    id=int(doc_id[:16], 16),
-                    vector=[1.0],  # Placeholder vector
-                    payload={
-                        'school': school_name,
-                        'url': payload['url'],
-                        'content': payload['content'],
-                        'type': 'merged',
-                        'timestamp': timestamp,
-                        'content_hash': payload['content_hash']
-                    }
-                )
-                new_points.append(new_point)
+            written = 0
+            offset = None
             
-            if new_points:
-                self.client.upsert(
+            while True:
+                points, offset = self.client.scroll(
                     collection_name=self.collection_name,
-                    points=new_points
+                    scroll_filter=scroll_filter,
+                    limit=batch_size,
+                    offset=offset,
+                    with_payload=['url', 'content_hash'],
+                    with_vectors=False
                 )
+                if points:
+                    written += self._merge_batch(school_name, points, timestamp)
+                if offset is None:
+                    break
             
-            self._safe_print(f"Stored school documents in Qdrant for: {school_name}")
-            return len(new_points)
-            
+            self._safe_print(f"Stored school documents in Qdrant for: {school_name} ({written} updated)")
+            return written
+        
         except Exception as e:
             self._safe_print(f"Failed to store school documents: {e}")
-            return 0 
\ No newline at end of file
+            return 0
+
+    def _content_points(self, with_payload, batch_size: int = 256):
+        """Yield every content point, a scroll page at a time"""
+        offset = None
+        while True:
+            points, offset = self.client.scroll(
+                collection_name=self.collection_name,
+                scroll_filter=Filter(must=[FieldCondition(key='type', match=MatchValue(value='content'))]),
+                limit=batch_size,
+                offset=offset,
+                with_payload=with_payload,
+                with_vectors=False
+            )
+            yield from points
+            if offset is None:
+                return
+
+    def train_dictionary(self, samples: int = 2000, dict_size: int = 112 * 1024) -> int:
+        """Train a zstd dictionary on stored content and compress new content with it.
+
+        The dictionary is stored in the collection, so every DocumentStore
+        opened afterwards uses it, and content compressed with it can be
+        read anywhere. Returns the dictionary id.
+        """
+        if zstandard is None or self.codec.encoding != 'zstd':
+            raise RuntimeError("Dictionary training needs zstd content compression")
+        texts = []
+        for point in self._content_points(PAYLOAD_FIELDS):
+            content = self._decode_content(point.payload)
+            if content:
+                # The start of a page (navigation, headers) is what pages share most
+                texts.append(content.encode('utf-8')[:64 * 1024])
+            if len(texts) >= samples:
+                break
+        if len(texts) < 10:
+            raise ValueError(f"Only {len(texts)} documents stored, too few to train a dictionary")
+        
+        dictionary = zstandard.train_dictionary(dict_size, texts)
+        dict_id = dictionary.dict_id()
+        self.client.upsert(
+            collection_name=self.collection_name,
+            points=[
+                PointStruct(
+                    id=self._dictionary_point_id(dict_id),
+                    vector=[1.0],  # Placeholder vector
+                    payload={
+                        'type': 'zdict',
+                        'dict_id': dict_id,
+                        'data': base64.b64encode(dictionary.as_bytes()).decode('ascii'),
+                        'samples': len(texts),
+                        'timestamp': datetime.now().isoformat()
+                    }
+                ),
+                PointStruct(
+                    id=self._dictionary_point_id('active'),
+                    vector=[1.0],  # Placeholder vector
+                    payload={'type': 'zdict_active', 'dict_id': dict_id}
+                )
+            ]
+        )
+        self.codec.use_dictionary(dictionary.as_bytes())
+        self._safe_print(f"Trained zstd dictionary {dict_id} on {len(texts)} documents")
+        return dict_id
+
+    def recompress(self, batch_size: int = 256) -> int:
+        """Rewrite content stored uncompressed, or not with the current encoding and
+        dictionary, in the current format. Returns the number of points rewritten"""
+        dictionary = self.codec.dictionary
+        dict_id = dictionary.dict_id() if dictionary is not None else None
+        rewritten = 0
+        pending = []
+        for point in self._content_points(PAYLOAD_FIELDS + ['content_hash'], batch_size):
+            payload = point.payload
+            if payload.get('encoding') == self.codec.encoding and payload.get('dict_id') == dict_id:
+                continue
+            content = self._decode_content(payload)
+            if content is None:
+                continue
+            pending.append(self._build_content_point(content, payload['content_hash']))
+            if len(pending) >= batch_size:
+                self.client.upsert(collection_name=self.collection_name, points=pending)
+                rewritten += len(pending)
+                pending = []
+        if pending:
+            self.client.upsert(collection_name=self.collection_name, points=pending)
+            rewritten += len(pending)
+        self._safe_print(f"Recompressed {rewritten} content points")
+        return rewritten
+
+    def content_stats(self) -> dict:
+        """Stored content per encoding: documents, uncompressed size and stored size"""
+        totals = {}
+        for point in self._content_points(['encoding', 'size', 'stored_size', 'content', 'blob']):
+            payload = point.payload
+            if 'encoding' in payload:
+                encoding = payload['encoding'] + (' (blob)' if 'blob' in payload else '')
+                size, stored_size = payload['size'], payload['stored_size']
+            else:
+                encoding = 'uncompressed'
+                size = stored_size = len(payload.get('content', '').encode('utf-8'))
+            entry = totals.setdefault(encoding, {'documents': 0, 'size': 0, 'stored_size': 0})
+            entry['documents'] += 1
+            entry['size'] += size
+            entry['stored_size'] += stored_size
+        return totals
+
+    def _document_urls(self, school: str, content_hash: str) -> list:
+        """URLs of a school's documents that currently have this content"""
+        must = [FieldCondition(key='content_hash', match=MatchValue(value=content_hash))]
+        if school:
+            must.append(FieldCondition(key='school', match=MatchValue(value=school)))
+        points, _ = self.client.scroll(
+            collection_name=self.collection_name,
+            scroll_filter=Filter(
+                must=must,
+                must_not=[FieldCondition(key='type', match=MatchValue(value='merged'))]
+            ),
+            limit=100,
+            with_payload=['url'],
+            with_vectors=False
+        )
+        return sorted(point.payload['url'] for point in points if 'url' in point.payload)
+
+    def search(self, query: str, school: str = None, top_k: int = 5, doc_type: str = None) -> list:
+        """
+        Semantic search over document chunks
+
+        Args:
+            query (str): Natural language query
+            school (str): Only search this school's documents
+            top_k (int): Number of chunks to return
+            doc_type (str): Only search 'html' or 'pdf' documents
+
+        Returns:
+            list: Best matches first, as dicts with score, text, heading,
+            school, type, content_hash and the urls currently holding that content
+        """
+        if not self.chunks_collection:
+            raise RuntimeError("Embeddings are disabled for this DocumentStore")
+        
+        must = []
+        if school:
+            must.append(FieldCondition(key='school', match=MatchValue(value=school)))
+        if doc_type:
+            must.append(FieldCondition(key='type', match=MatchValue(value=doc_type)))
+        
+        # Over-fetch: chunks of content no URL holds any more are dropped below
+        hits = self.client.query_points(
+            collection_name=self.chunks_collection,
+            query=self.embedder.embed([query])[0],
+            query_filter=Filter(must=must) if must else None,
+            limit=top_k * 2,
+            with_payload=True,
+            search_params=SearchParams(hnsw_ef=max(SEARCH_HNSW_EF, top_k * 2))
+        ).points
+        
+        results = []
+        urls_by_document = {}
+        for hit in hits:
+            payload = hit.payload
+            key = (payload['school'], payload['content_hash'])
+            if key not in urls_by_document:
+                urls_by_document[key] = self._document_urls(*key)
+            if not urls_by_document[key]:
+                continue
+            results.append({
+                'score': hit.score,
+                'text': payload['text'],
+                'heading': payload.get('heading', ''),
+                'school': payload['school'],
+                'type': payload.get('type'),
+                'content_hash': payload['content_hash'],
+                'chunk_index': payload.get('chunk_index'),
+                'urls': urls_by_document[key]
+            })
+            if len(results) >= top_k:
+                break
+        return results
@@ -1,42 +1,108 @@
-import asyncio
-import aiohttp
-from threading import Thread
-from flask import Flask, request, jsonify
-from admission_info_spider import WebScraper
+import atexit
+import logging
+import threading
+from flask import Flask, Response, request, jsonify
+from crawler import WebScraper
+from crawl_budget import CrawlBudget
+from distributed import crawl_distributed
+from jobs import JobManager, QueueFullError
+from mongoDB_manager import MongoDBManager
+from pipeline import CrawlPipeline
+from Qdrant_manager import DocumentStore
+from metrics import CONTENT_TYPE, QUEUE_DEPTH, REGISTRY, SamplingProfiler, Tracer
+from webhooks import PAYLOAD_MODES, WebhookDispatcher
 from dotenv import load_dotenv
 import os
 
 load_dotenv()
+logging.basicConfig(level=os.getenv('LOG_LEVEL', 'INFO').upper(),
+                    format='%(asctime)s %(levelname)s %(name)s: %(message)s')
 
 app = Flask(__name__)
+atexit.register(MongoDBManager.close_all)
 
-async def send_webhook(url: str, data: dict):
-    webhook_url = os.getenv('WEBHOOK_URL')
-    if not webhook_url:
-        raise ValueError("WEBHOOK_URL environment variable is not set")
-    async with aiohttp.ClientSession() as session:
-        async with session.post(webhook_url, json=data) as response:
-            return await response.json()
+# Background services are created on first use, not at import: the PDF pool
+# and the distributed crawl workers are spawned processes, which import this
+# module again as __mp_main__
+_services_lock = threading.Lock()
+_webhook_dispatcher = None
+_job_manager = None
+_document_store = None
 
-def process_scraping_and_notify(url: str):
+def get_webhook_dispatcher():
+    # Notifications are queued and delivered in the background, so a slow or
+    # unreachable webhook never holds up a scrape worker
+    global _webhook_dispatcher
+    with _services_lock:
+        if _webhook_dispatcher is None:
+            _webhook_dispatcher = WebhookDispatcher().start()
+            atexit.register(_webhook_dispatcher.stop)
+        return _webhook_dispatcher
+
+def get_job_manager():
+    global _job_manager
+    with _services_lock:
+        if _job_manager is None:
+            _job_manager = JobManager(
+                process_scraping_and_notify,
+                max_workers=int(os.getenv('SCRAPE_WORKERS', 2)),
+                max_queue=int(os.getenv('SCRAPE_QUEUE_SIZE', 20))
+            )
+        return _job_manager
+
+def get_document_store():
+    # Created on first search so the embedding model is only loaded when needed
+    global _document_store
+    with _services_lock:
+        if _document_store is None:
+            _document_store = DocumentStore()
+        return _document_store
+
+def process_scraping_and_notify(job):
+    if job.options.get('trace'):
+        job.tracer = Tracer()
+    if job.options.get('profile'):
+        job.profiler = SamplingProfiler().start()
     try:
-        scraper = WebScraper(url)
-        links = scraper.scrape()
+        incremental = job.options.get('incremental', False)
+        if job.options.get('pipeline'):
+            pipeline = CrawlPipeline(job.url, incremental=incremental, tracer=job.tracer,
+                                     budget=job.options.get('budget'))
+            job.scraper = pipeline.scraper
+            job.pipeline = pipeline
+            links = pipeline.run()['links']
+        elif job.options.get('processes', 1) > 1:
+            links = crawl_distributed(job.url, processes=job.options['processes'], incremental=incremental)
+        else:
+            scraper = WebScraper(job.url, incremental=incremental, tracer=job.tracer,
+                                 budget=job.options.get('budget'))
+            job.scraper = scraper
+            links = scraper.scrape_async()
         
-        webhook_data = {
-            'status': 'success',
-            'url': url,
-            'links': links
-        }
+        get_webhook_dispatcher().notify(job.url, links, mode=job.options.get('webhook_payload'), job_id=job.id)
         
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        loop.run_until_complete(send_webhook(url, webhook_data))
-        loop.close()
+        return {'links_found': len(links)}
         
     except Exception as e:
         print(f"Error during scraping and notification: {str(e)}")
-        return jsonify({'error': 'Server error'}), 500
+        raise
+    finally:
+        if job.profiler:
+            job.profiler.stop()
+
+def _queue_depths():
+    job_manager = _job_manager
+    if job_manager is None:
+        return {}
+    depths = {'jobs': job_manager.stats()['queued'], 'frontier': 0, 'convert': 0, 'store': 0}
+    for job in job_manager.running_jobs():
+        progress = job.progress()
+        depths['frontier'] += progress.get('queued', 0)
+        depths['convert'] += progress.get('convert_queue', 0)
+        depths['store'] += progress.get('store_buffer', 0)
+    return {(queue,): depth for queue, depth in depths.items()}
+
+QUEUE_DEPTH.set_function(_queue_depths)
 
 @app.route('/ok', methods=['GET'])
 def health_check():
@@ -49,13 +115,114 @@ def scrape_endpoint():
         return jsonify({'error': 'URL is required'}), 400
     
     url = data['url'].strip()
+    try:
+        processes = int(data.get('processes', 1))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'processes must be an integer'}), 400
+    options = {
+        'incremental': bool(data.get('incremental', False)),
+        'pipeline': bool(data.get('pipeline', False)),
+        'trace': bool(data.get('trace', False)),
+        'profile': bool(data.get('profile', False)),
+        'webhook_payload': data.get('webhook_payload'),
+        # Worker processes for a distributed crawl, see distributed.py
+        'processes': max(1, min(processes, os.cpu_count() or 1))
+    }
+    if options['webhook_payload'] not in (None,) + PAYLOAD_MODES:
+        return jsonify({'error': f"webhook_payload must be one of {', '.join(PAYLOAD_MODES)}"}), 400
+    if data.get('budget'):
+        # e.g. {"max_pages": 500, "max_depth": 4, "max_bytes": 50000000, "max_seconds": 600}
+        try:
+            options['budget'] = CrawlBudget.from_dict(data['budget'])
+        except ValueError as e:
+            return jsonify({'error': f"Invalid budget: {e}"}), 400
+        # Workers of a distributed crawl cannot share a budget, see crawl_distributed
+        if options['processes'] > 1 and not options['pipeline']:
+            return jsonify({'error': 'budget is not supported with processes > 1'}), 400
     
-    Thread(target=process_scraping_and_notify, args=(url,)).start()
+    try:
+        job, created = get_job_manager().submit(url, options)
+    except QueueFullError as e:
+        response = jsonify({'error': str(e)})
+        response.headers['Retry-After'] = '30'
+        return response, 429
     
     return jsonify({
         'status': 'processing',
-        'message': 'Request accepted'
+        'message': 'Request accepted' if created else 'Request already in progress',
+        'job_id': job.id
     }), 200
 
+@app.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    job = get_job_manager().get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job.to_dict()), 200
+
+@app.route('/jobs/<job_id>/trace', methods=['GET'])
+def job_trace(job_id):
+    job = get_job_manager().get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    if job.tracer is None:
+        return jsonify({'error': 'Tracing was not enabled for this job'}), 404
+    return jsonify({'job_id': job.id, 'spans': job.tracer.to_list()}), 200
+
+@app.route('/jobs/<job_id>/profile', methods=['GET'])
+def job_profile(job_id):
+    job = get_job_manager().get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    if job.profiler is None:
+        return jsonify({'error': 'Profiling was not enabled for this job'}), 404
+    if request.args.get('format') == 'collapsed':
+        # Collapsed stacks, for flamegraph tools
+        return Response(job.profiler.collapsed(), mimetype='text/plain')
+    try:
+        limit = int(request.args.get('limit', 20))
+    except ValueError:
+        return jsonify({'error': 'limit must be an integer'}), 400
+    if limit <= 0:
+        return jsonify({'error': 'limit must be positive'}), 400
+    return jsonify({
+        'job_id': job.id,
+        'samples': job.profiler.samples,
+        'top': job.profiler.top(limit)
+    }), 200
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    return Response(REGISTRY.render(), content_type=CONTENT_TYPE)
+
+@app.route('/search', methods=['GET'])
+def search_endpoint():
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({'error': 'q is required'}), 400
+    try:
+        top_k = min(int(request.args.get('top_k', 5)), 50)
+    except ValueError:
+        return jsonify({'error': 'top_k must be an integer'}), 400
+    if top_k <= 0:
+        return jsonify({'error': 'top_k must be positive'}), 400
+    
+    store = get_document_store()
+    if not store.chunks_collection:
+        # DOCUMENT_EMBEDDINGS=0, or the chunks were embedded with another model
+        return jsonify({'error': 'Search is unavailable, document embeddings are disabled'}), 503
+    results = store.search(
+        query,
+        school=request.args.get('school'),
+        top_k=top_k,
+        doc_type=request.args.get('type')
+    )
+    return jsonify({'query': query, 'results': results}), 200
+
 if __name__ == "__main__":
+    # The debug reloader serves from a child process, so the dispatcher is
+    # started there, sending what is left in the outbox without waiting for
+    # the first notification
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        get_webhook_dispatcher()
     app.run(debug=True, host='0.0.0.0', port=5000) 
\ No newline at end of file
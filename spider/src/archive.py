@@ -0,0 +1,317 @@
+"""Append-only archive of fetched responses, for reprocessing a crawl without the network.
+
+Responses are written as WARC response records to segment files, each record
+its own gzip member (or zstd frame), so any record can be decompressed on its
+own. An SQLite index maps URLs to (segment, offset, length); reads go through
+memory-mapped segments. The .warc.gz segments can be read by standard WARC
+tools.
+
+    python archive.py crawl_archive                                  # statistics
+    python archive.py crawl_archive --replay https://www.example.edu/ [--pipeline]
+"""
+import argparse
+import gzip
+import mmap
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+
+from requests.structures import CaseInsensitiveDict
+
+from crawl_state import url_fingerprint
+from utils.urls import canonicalize_url
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+CRAWL_ARCHIVE_DIR = os.getenv('CRAWL_ARCHIVE_DIR')
+# 'auto' uses zstd when the zstandard package is installed, gzip otherwise
+CRAWL_ARCHIVE_CODEC = os.getenv('CRAWL_ARCHIVE_CODEC', 'auto')
+CRAWL_ARCHIVE_SEGMENT_MB = int(os.getenv('CRAWL_ARCHIVE_SEGMENT_MB', 256))
+
+_EXTENSIONS = {'gzip': '.warc.gz', 'zstd': '.warc.zst'}
+
+def _header_value(value) -> str:
+    return str(value).replace('\r', ' ').replace('\n', ' ')
+
+class ArchivedResponse:
+    """A response read back from the archive"""
+
+    def __init__(self, url: str, status: int, headers: CaseInsensitiveDict, body: bytes,
+                 fetched_at: float):
+        self.url = url
+        self.status = status
+        self.headers = headers
+        self.body = body
+        self.fetched_at = fetched_at
+
+    @property
+    def content_type(self) -> str:
+        return self.headers.get('Content-Type', '')
+
+    @property
+    def text(self) -> str:
+        charset = 'utf-8'
+        for part in self.content_type.split(';')[1:]:
+            name, _, value = part.strip().partition('=')
+            if name.lower() == 'charset' and value:
+                charset = value.strip('"\'')
+        try:
+            return self.body.decode(charset, errors='replace')
+        except LookupError:
+            return self.body.decode('utf-8', errors='replace')
+
+class CrawlArchive:
+    """Compressed, segmented response archive with an offset index.
+
+    append() is safe from any thread, and from several processes sharing the
+    directory: each writer has its own segment files and the index is an
+    SQLite database in WAL mode.
+    """
+
+    def __init__(self, directory: str, codec: str = CRAWL_ARCHIVE_CODEC,
+                 segment_bytes: int = CRAWL_ARCHIVE_SEGMENT_MB * 1024 * 1024,
+                 commit_every: int = 200):
+        if codec == 'auto':
+            codec = 'zstd' if zstandard is not None else 'gzip'
+        if codec == 'zstd' and zstandard is None:
+            raise ImportError("The zstd archive codec needs the zstandard package")
+        if codec not in _EXTENSIONS:
+            raise ValueError(f"Unknown archive codec {codec}, choose from auto, gzip, zstd")
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.codec = codec
+        self.segment_bytes = segment_bytes
+        self.commit_every = commit_every
+        self._writer_id = f"{datetime.now():%Y%m%d%H%M%S}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        self._segment_number = 0
+        self._segment_name = None
+        self._segment_file = None
+        self._pending_writes = 0
+        self._maps = {}
+        self._lock = threading.RLock()
+        # zstd (de)compressor objects must not be shared between threads
+        self._local = threading.local()
+
+        self._conn = sqlite3.connect(os.path.join(directory, 'index.sqlite'),
+                                     check_same_thread=False, timeout=30)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.executescript('''
+            CREATE TABLE IF NOT EXISTS records (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                fp INTEGER NOT NULL,
+                url TEXT NOT NULL,
+                school TEXT,
+                status INTEGER NOT NULL,
+                content_type TEXT,
+                segment TEXT NOT NULL,
+                offset INTEGER NOT NULL,
+                length INTEGER NOT NULL,
+                raw_length INTEGER NOT NULL,
+                fetched_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS records_fp ON records (fp, id);
+            CREATE INDEX IF NOT EXISTS records_school ON records (school, id);
+        ''')
+        self._conn.commit()
+
+    def _compress(self, data: bytes) -> bytes:
+        if self.codec == 'zstd':
+            if not hasattr(self._local, 'compressor'):
+                self._local.compressor = zstandard.ZstdCompressor(level=3)
+            return self._local.compressor.compress(data)
+        return gzip.compress(data, compresslevel=6)
+
+    def _decompress(self, segment: str, data: bytes) -> bytes:
+        if segment.endswith(_EXTENSIONS['zstd']):
+            if zstandard is None:
+                raise ImportError(f"Reading {segment} needs the zstandard package")
+            if not hasattr(self._local, 'decompressor'):
+                self._local.decompressor = zstandard.ZstdDecompressor()
+            return self._local.decompressor.decompress(data)
+        return gzip.decompress(data)
+
+    def _open_segment(self):
+        if self._segment_file is not None:
+            self._segment_file.close()
+        self._segment_number += 1
+        self._segment_name = f"crawl-{self._writer_id}-{self._segment_number:05d}{_EXTENSIONS[self.codec]}"
+        # Unbuffered, so a record is readable as soon as it is indexed
+        self._segment_file = open(os.path.join(self.directory, self._segment_name), 'ab', buffering=0)
+
+    @staticmethod
+    def _record(url: str, status: int, headers, body: bytes, fetched_at: float) -> bytes:
+        http_head = [f"HTTP/1.1 {status}"]
+        for name, value in headers.items():
+            # Bodies are stored decoded, so these no longer describe them
+            if name.lower() in ('content-encoding', 'transfer-encoding', 'content-length'):
+                continue
+            http_head.append(f"{_header_value(name)}: {_header_value(value)}")
+        http_head.append(f"Content-Length: {len(body)}")
+        block = ('\r\n'.join(http_head) + '\r\n\r\n').encode('utf-8') + body
+        date = datetime.fromtimestamp(fetched_at, timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+        warc_head = (
+            'WARC/1.1\r\n'
+            'WARC-Type: response\r\n'
+            f'WARC-Record-ID: <urn:uuid:{uuid.uuid4()}>\r\n'
+            f'WARC-Date: {date}\r\n'
+            f'WARC-Target-URI: {_header_value(url)}\r\n'
+            'Content-Type: application/http; msgtype=response\r\n'
+            f'Content-Length: {len(block)}\r\n\r\n'
+        ).encode('utf-8')
+        return warc_head + block + b'\r\n\r\n'
+
+    def append(self, url: str, status: int, headers, body: bytes, school: str = None,
+               fetched_at: float = None):
+        """Archive one response. headers is any mapping, body the decoded response bytes"""
+        url = canonicalize_url(url)
+        fetched_at = fetched_at or time.time()
+        raw = self._record(url, status, headers, body, fetched_at)
+        # Compress outside the lock, it is most of the cost
+        data = self._compress(raw)
+        with self._lock:
+            if self._segment_file is None or self._segment_file.tell() + len(data) > self.segment_bytes:
+                self._open_segment()
+            offset = self._segment_file.tell()
+            self._segment_file.write(data)
+            self._conn.execute(
+                'INSERT INTO records (fp, url, school, status, content_type, segment, offset, length, '
+                'raw_length, fetched_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (url_fingerprint(url), url, school, status, headers.get('Content-Type', ''),
+                 self._segment_name, offset, len(data), len(raw), fetched_at)
+            )
+            self._pending_writes += 1
+            if self._pending_writes >= self.commit_every:
+                self._conn.commit()
+                self._pending_writes = 0
+
+    def _view(self, segment: str, end: int):
+        """Memory map of a segment covering at least end bytes"""
+        view = self._maps.get(segment)
+        if view is None or len(view) < end:
+            if view is not None:
+                view.close()
+            with open(os.path.join(self.directory, segment), 'rb') as f:
+                view = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self._maps[segment] = view
+        return view
+
+    def _read(self, url, segment, offset, length, fetched_at) -> ArchivedResponse:
+        with self._lock:
+            data = self._view(segment, offset + length)[offset:offset + length]
+        raw = self._decompress(segment, data)
+        _, _, rest = raw.partition(b'\r\n\r\n')
+        head, _, body = rest.partition(b'\r\n\r\n')
+        lines = head.decode('utf-8', errors='replace').split('\r\n')
+        status = int(lines[0].split()[1])
+        headers = CaseInsensitiveDict()
+        for line in lines[1:]:
+            name, _, value = line.partition(':')
+            headers[name.strip()] = value.strip()
+        # Every record ends with the two CRLFs WARC puts after the block
+        return ArchivedResponse(url, status, headers, body[:-4], fetched_at)
+
+    def get(self, url: str):
+        """The latest archived response for url, or None"""
+        url = canonicalize_url(url)
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT url, segment, offset, length, fetched_at FROM records '
+                'WHERE fp = ? ORDER BY id DESC LIMIT 1', (url_fingerprint(url),)
+            ).fetchone()
+        return self._read(*row) if row else None
+
+    def __contains__(self, url: str) -> bool:
+        with self._lock:
+            return bool(self._conn.execute('SELECT 1 FROM records WHERE fp = ? LIMIT 1',
+                                           (url_fingerprint(canonicalize_url(url)),)).fetchone())
+
+    def responses(self, school: str = None):
+        """Archived responses in file order (latest per URL), optionally only one school's"""
+        query = ('SELECT url, segment, offset, length, fetched_at FROM records '
+                 'WHERE id IN (SELECT MAX(id) FROM records {} GROUP BY fp) ORDER BY segment, offset')
+        params = ()
+        if school is not None:
+            query = query.format('WHERE school = ?')
+            params = (school,)
+        else:
+            query = query.format('')
+        with self._lock:
+            rows = self._conn.execute(query, params).fetchall()
+        for row in rows:
+            yield self._read(*row)
+
+    def stats(self) -> dict:
+        with self._lock:
+            records, urls, stored, raw = self._conn.execute(
+                'SELECT COUNT(*), COUNT(DISTINCT fp), COALESCE(SUM(length), 0), '
+                'COALESCE(SUM(raw_length), 0) FROM records'
+            ).fetchone()
+            segments = self._conn.execute('SELECT COUNT(DISTINCT segment) FROM records').fetchone()[0]
+        return {
+            'records': records,
+            'urls': urls,
+            'segments': segments,
+            'stored_bytes': stored,
+            'raw_bytes': raw,
+            'ratio': round(raw / stored, 2) if stored else None
+        }
+
+    def flush(self):
+        with self._lock:
+            self._conn.commit()
+            self._pending_writes = 0
+
+    def close(self):
+        with self._lock:
+            self._conn.commit()
+            self._conn.close()
+            if self._segment_file is not None:
+                self._segment_file.close()
+            for view in self._maps.values():
+                view.close()
+            self._maps.clear()
+
+_shared_archive = None
+_shared_lock = threading.Lock()
+
+def get_archive():
+    """Process-wide archive in CRAWL_ARCHIVE_DIR, or None when archiving is off"""
+    global _shared_archive
+    if not CRAWL_ARCHIVE_DIR:
+        return None
+    with _shared_lock:
+        if _shared_archive is None:
+            _shared_archive = CrawlArchive(CRAWL_ARCHIVE_DIR)
+        return _shared_archive
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('directory')
+    parser.add_argument('--replay', metavar='URL', help='re-crawl this start URL from the archive')
+    parser.add_argument('--pipeline', action='store_true',
+                        help='also convert and store the replayed pages')
+    args = parser.parse_args(argv)
+
+    archive = CrawlArchive(args.directory)
+    if not args.replay:
+        print(archive.stats())
+        return
+    if args.pipeline:
+        from pipeline import CrawlPipeline
+        result = CrawlPipeline(args.replay, archive=archive, replay=True).run()
+        print(f"{len(result['links'])} links, {result['stored']} stored, {len(result['failed'])} failed")
+    else:
+        from crawler import WebScraper
+        links = WebScraper(args.replay, archive=archive).scrape_archived()
+        print(f"{len(links)} links")
+
+if __name__ == '__main__':
+    main()
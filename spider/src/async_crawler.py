@@ -0,0 +1,207 @@
+import asyncio
+import logging
+import time
+from urllib.parse import urlparse
+
+import aiohttp
+
+from content_types import CRAWL_MAX_HTML_BYTES, HTML, decode_body, document_type, head_first
+from metrics import BODIES_SKIPPED, IN_FLIGHT, PAGES_FETCHED, stage
+from scheduler import RETRYABLE_STATUS, parse_crawl_delay, parse_retry_after
+from utils.urls import canonicalize_url
+
+DEFAULT_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36"
+}
+
+class AsyncCrawlEngine:
+    """Continuously scheduled crawl over a single pooled HTTP session.
+
+    Requests are started as soon as any in-flight request finishes, as in
+    WebScraper.scrape, but without holding a thread per request. Claiming,
+    budgets, link scoping and result bookkeeping are delegated to the
+    WebScraper instance, and per-host politeness (rate limits, AIMD
+    concurrency, retries) to its PolitenessScheduler.
+    """
+
+    def __init__(self, scraper, max_in_flight=32, limit_per_host=0,
+                 connect_timeout=5, read_timeout=10):
+        self.scraper = scraper
+        self.max_in_flight = max_in_flight
+        self.limit_per_host = limit_per_host
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.session = None
+        self.scheduler = scraper.scheduler
+        self.retrying = set()
+        self.logger = logging.getLogger('crawler.AsyncCrawlEngine')
+
+    async def run(self):
+        """Crawl until the queue is drained and no requests are in flight"""
+        connector = aiohttp.TCPConnector(
+            limit=self.max_in_flight,
+            limit_per_host=self.limit_per_host,
+            ssl=False,
+            keepalive_timeout=30,
+            ttl_dns_cache=300
+        )
+        timeout = aiohttp.ClientTimeout(
+            sock_connect=self.connect_timeout,
+            sock_read=self.read_timeout
+        )
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout,
+                                         headers=DEFAULT_HEADERS) as session:
+            self.session = session
+            tasks = set()
+            while True:
+                while len(tasks) < self.max_in_flight:
+                    claimed = self.scraper.claim_next()
+                    if claimed is None:
+                        break
+                    tasks.add(asyncio.ensure_future(self.process_url(*claimed)))
+
+                if not tasks and not self.retrying:
+                    break
+
+                done, _ = await asyncio.wait(tasks | self.retrying,
+                                             return_when=asyncio.FIRST_COMPLETED)
+                # Finished tasks may have scheduled new retries, so only drop what completed
+                tasks -= done
+                self.retrying -= done
+            self.session = None
+
+    async def _acquire(self, url):
+        """Wait for a politeness slot on the URL's host"""
+        parsed = urlparse(url)
+        host = parsed.netloc
+        if self.scheduler.needs_robots(host):
+            await self._load_robots(f"{parsed.scheme}://{host}", host)
+        while True:
+            wait = self.scheduler.try_acquire(host)
+            if wait <= 0:
+                return host
+            await asyncio.sleep(wait)
+
+    async def _load_robots(self, origin, host):
+        try:
+            async with self.session.get(f"{origin}/robots.txt") as response:
+                if response.status != 200:
+                    return
+                robots_txt = await response.text(errors='replace')
+            delay = parse_crawl_delay(robots_txt, DEFAULT_HEADERS["User-Agent"])
+            if delay:
+                self.logger.debug("Applying robots.txt Crawl-delay %ss for %s", delay, host)
+                self.scheduler.set_crawl_delay(host, delay)
+        except Exception as e:
+            self.logger.debug("Could not load robots.txt for %s: %s", host, e)
+
+    async def _read_limited(self, response):
+        """Read a body up to CRAWL_MAX_HTML_BYTES. Returns (body, truncated)"""
+        chunks = []
+        size = 0
+        while size <= CRAWL_MAX_HTML_BYTES:
+            chunk = await response.content.read(CRAWL_MAX_HTML_BYTES + 1 - size)
+            if not chunk:
+                return b''.join(chunks), False
+            chunks.append(chunk)
+            size += len(chunk)
+        BODIES_SKIPPED.inc(reason='truncated')
+        return b''.join(chunks)[:CRAWL_MAX_HTML_BYTES], True
+
+    def _schedule_retry(self, url, depth, attempt, status=None, retry_after=None):
+        """Retry the URL later with jittered backoff instead of dropping it. Returns False when giving up"""
+        if not self.scheduler.should_retry(attempt, status):
+            self.logger.warning("Giving up on %s after %d attempts", url, attempt + 1)
+            return False
+        delay = self.scheduler.backoff(attempt, retry_after)
+        self.logger.debug("Retrying %s in %.1fs (attempt %d)", url, delay, attempt + 2)
+        self.retrying.add(asyncio.ensure_future(self._retry_later(url, depth, attempt + 1, delay)))
+        return True
+
+    async def _retry_later(self, url, depth, attempt, delay):
+        await asyncio.sleep(delay)
+        await self.process_url(url, depth, attempt)
+
+    async def process_url(self, url, depth=0, attempt=0):
+        base_url = canonicalize_url(url)
+        loop = asyncio.get_running_loop()
+        host = await self._acquire(url)
+        status = None
+        retry_after = None
+        network_error = False
+        start_time = time.monotonic()
+        IN_FLIGHT.inc(engine='async')
+
+        try:
+            self.logger.debug("Starting to process URL: %s", base_url)
+            extra_headers, record = {}, None
+            if self.scraper.incremental:
+                if await loop.run_in_executor(None, self.scraper.skip_unchanged, url, depth):
+                    return
+                extra_headers, record = await loop.run_in_executor(
+                    None, self.scraper.conditional_headers, url
+                )
+            body = None
+            truncated = False
+            with stage('fetch', self.scraper.tracer, url, attempt=attempt):
+                # Binary-looking URLs are checked with HEAD; other responses
+                # are only read when their headers say they are HTML
+                answered_by_head = False
+                if head_first(url):
+                    async with self.session.head(url, headers=extra_headers, allow_redirects=True) as response:
+                        status = response.status
+                        headers = response.headers
+                    PAGES_FETCHED.inc(engine='async', status=status)
+                    answered_by_head = (status in (304, 404, 410) or
+                                        status == 200 and document_type(url, headers.get('Content-Type')) != HTML)
+                if not answered_by_head:
+                    async with self.session.get(url, headers=extra_headers) as response:
+                        status = response.status
+                        headers = response.headers
+                        PAGES_FETCHED.inc(engine='async', status=status)
+                        if status == 200 and document_type(url, headers.get('Content-Type')) == HTML:
+                            body, truncated = await self._read_limited(response)
+                            charset = response.charset
+                if status == 200 and body is None:
+                    BODIES_SKIPPED.inc(reason='binary')
+                retry_after = parse_retry_after(headers.get('Retry-After'))
+                self.logger.debug("Response status code: %d for %s", status, base_url)
+                if status not in (200, 304):
+                    return
+
+            html = None
+            if body is not None:
+                self.scraper.budget.add_bytes(len(body))
+                if truncated:
+                    self.logger.info("Truncated %s at %d bytes", url, CRAWL_MAX_HTML_BYTES)
+                elif self.scraper.archive is not None:
+                    await loop.run_in_executor(None, self.scraper.archive_response, url, status,
+                                               headers, body)
+                html = decode_body(body, charset)
+            # Parsing is CPU bound, keep it off the event loop
+            new_links = await loop.run_in_executor(
+                None, self.scraper.handle_response, url, status, headers, html, record
+            )
+            self.scraper.enqueue(new_links, depth + 1)
+
+        except asyncio.TimeoutError:
+            network_error = True
+            self.logger.warning("Timeout while processing %s (timeout=(%s, %s))",
+                                url, self.connect_timeout, self.read_timeout)
+        except aiohttp.ClientSSLError:
+            self.logger.warning("SSL Error while processing %s", url)
+        except aiohttp.ClientConnectionError:
+            network_error = True
+            self.logger.warning("Connection Error while processing %s", url)
+        except Exception as e:
+            self.logger.warning("Unexpected error processing %s: %s (%s)", url, e, type(e).__name__)
+        finally:
+            IN_FLIGHT.dec(engine='async')
+            # A network error is reported as status None so the host backs off
+            reported_status = None if network_error else (status or 0)
+            self.scheduler.release(host, reported_status, time.monotonic() - start_time, retry_after)
+            retrying = False
+            if network_error or status in RETRYABLE_STATUS:
+                retrying = self._schedule_retry(url, depth, attempt, reported_status, retry_after)
+            if not retrying:
+                self.scraper.finish_url(url)
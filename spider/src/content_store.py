@@ -0,0 +1,213 @@
+"""Compressed storage for converted document content.
+
+Content is compressed with zstd (with a shared dictionary once one is
+trained, see DocumentStore.train_dictionary) or zlib when the zstandard
+package is not installed. Small bodies stay in the Qdrant payload as
+base64; bodies over CONTENT_INLINE_MAX_BYTES compressed go to a local
+content-addressed blob store and the payload keeps only the key.
+
+The blob store must persist as long as the Qdrant collection does, or the
+large bodies are lost: CONTENT_BLOB_DIR defaults to data/content_blobs, on
+the data volume of docker-compose. Set it to an empty string to keep all
+content in Qdrant instead, e.g. when writers do not share a disk.
+
+    python content_store.py stats                 # stored sizes by encoding
+    python content_store.py train [--samples N]   # train and activate a dictionary
+    python content_store.py recompress            # rewrite content in the current format
+"""
+import argparse
+import base64
+import hashlib
+import os
+import threading
+import uuid
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# 'auto' uses zstd when the zstandard package is installed, zlib otherwise
+CONTENT_COMPRESSION = os.getenv('CONTENT_COMPRESSION', 'auto')
+CONTENT_ZSTD_LEVEL = int(os.getenv('CONTENT_ZSTD_LEVEL', 9))
+# Compressed bodies larger than this are kept in the blob store, not the payload
+CONTENT_INLINE_MAX_BYTES = int(os.getenv('CONTENT_INLINE_MAX_BYTES', 32 * 1024))
+# Must be persistent storage, see above
+CONTENT_BLOB_DIR = os.getenv('CONTENT_BLOB_DIR', os.path.join('data', 'content_blobs'))
+
+ENCODINGS = ('zstd', 'zlib', 'none')
+
+class ContentCodec:
+    """Compresses content to (encoding, data, dict_id) and back.
+
+    Dictionaries are looked up by id when decoding, through load_dictionary
+    for ids not seen yet, so content written with an older dictionary stays
+    readable after a new one is activated.
+    """
+
+    def __init__(self, encoding: str = CONTENT_COMPRESSION, level: int = CONTENT_ZSTD_LEVEL,
+                 load_dictionary=None):
+        if encoding == 'auto':
+            encoding = 'zstd' if zstandard is not None else 'zlib'
+        if encoding == 'zstd' and zstandard is None:
+            raise ImportError("zstd content compression needs the zstandard package")
+        if encoding not in ENCODINGS:
+            raise ValueError(f"Unknown content compression {encoding}, choose from auto, {', '.join(ENCODINGS)}")
+        self.encoding = encoding
+        self.level = level
+        self.load_dictionary = load_dictionary
+        self.dictionary = None
+        self._dictionaries = {}
+        self._lock = threading.Lock()
+        # zstd (de)compressor objects must not be shared between threads
+        self._local = threading.local()
+
+    def use_dictionary(self, data: bytes) -> int:
+        """Compress with this zstd dictionary from now on. Returns its id"""
+        if self.encoding != 'zstd':
+            return None
+        dictionary = zstandard.ZstdCompressionDict(data)
+        with self._lock:
+            self._dictionaries[dictionary.dict_id()] = dictionary
+            self.dictionary = dictionary
+        return dictionary.dict_id()
+
+    def _dictionary(self, dict_id: int):
+        with self._lock:
+            dictionary = self._dictionaries.get(dict_id)
+        if dictionary is None:
+            data = self.load_dictionary(dict_id) if self.load_dictionary else None
+            if data is None:
+                raise LookupError(f"zstd dictionary {dict_id} is not available")
+            dictionary = zstandard.ZstdCompressionDict(data)
+            with self._lock:
+                self._dictionaries[dict_id] = dictionary
+        return dictionary
+
+    def encode(self, text: str) -> tuple:
+        """Compress text. Returns (encoding, data, dict_id)"""
+        raw = text.encode('utf-8')
+        if self.encoding == 'none':
+            return 'none', raw, None
+        if self.encoding == 'zlib':
+            return 'zlib', zlib.compress(raw, 9), None
+        dictionary = self.dictionary
+        # A thread's compressor is rebuilt when another dictionary is activated
+        compressor_dictionary, compressor = getattr(self._local, 'compressor', (None, None))
+        if compressor is None or compressor_dictionary is not dictionary:
+            compressor = zstandard.ZstdCompressor(level=self.level, dict_data=dictionary)
+            self._local.compressor = (dictionary, compressor)
+        dict_id = dictionary.dict_id() if dictionary is not None else None
+        return 'zstd', compressor.compress(raw), dict_id
+
+    def decode(self, encoding: str, data: bytes, dict_id: int = None) -> str:
+        if encoding == 'none':
+            raw = data
+        elif encoding == 'zlib':
+            raw = zlib.decompress(data)
+        elif encoding == 'zstd':
+            if zstandard is None:
+                raise ImportError("Reading zstd content needs the zstandard package")
+            decompressors = self._local.__dict__.setdefault('decompressors', {})
+            decompressor = decompressors.get(dict_id)
+            if decompressor is None:
+                dictionary = self._dictionary(dict_id) if dict_id else None
+                decompressor = decompressors[dict_id] = zstandard.ZstdDecompressor(dict_data=dictionary)
+            raw = decompressor.decompress(data)
+        else:
+            raise ValueError(f"Unknown content encoding {encoding}")
+        return raw.decode('utf-8')
+
+class BlobStore:
+    """Content-addressed files under a directory, two levels of fan-out deep"""
+
+    def __init__(self, directory: str):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], key[2:4], key)
+
+    def __contains__(self, key: str) -> bool:
+        return os.path.exists(self._path(key))
+
+    def put(self, key: str, data: bytes):
+        """Store data under key. Keys address their content, so an existing blob is kept"""
+        path = self._path(key)
+        if os.path.exists(path):
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, path)
+
+    def get(self, key: str):
+        try:
+            with open(self._path(key), 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+def encode_payload(codec: ContentCodec, blobs: BlobStore, content: str,
+                   inline_max: int = CONTENT_INLINE_MAX_BYTES) -> dict:
+    """Payload fields storing content, compressed, inline or in the blob store"""
+    encoding, data, dict_id = codec.encode(content)
+    fields = {'encoding': encoding, 'size': len(content.encode('utf-8')), 'stored_size': len(data)}
+    if dict_id:
+        fields['dict_id'] = dict_id
+    if blobs is not None and len(data) > inline_max:
+        # Blobs are keyed by the stored bytes, so recompressed content gets a new blob
+        key = hashlib.blake2b(data, digest_size=16).hexdigest()
+        blobs.put(key, data)
+        fields['blob'] = key
+    elif encoding == 'none':
+        fields['content'] = content
+    else:
+        fields['data'] = base64.b64encode(data).decode('ascii')
+    return fields
+
+# Payload fields to retrieve for decode_payload
+PAYLOAD_FIELDS = ['content', 'data', 'blob', 'encoding', 'dict_id']
+
+def decode_payload(codec: ContentCodec, blobs: BlobStore, payload: dict):
+    """The content stored in a payload, or None when it is missing"""
+    if 'content' in payload:
+        # Uncompressed, as written before content was compressed
+        return payload['content']
+    if 'blob' in payload:
+        data = blobs.get(payload['blob']) if blobs is not None else None
+        if data is None:
+            return None
+    elif 'data' in payload:
+        data = base64.b64decode(payload['data'])
+    else:
+        return None
+    return codec.decode(payload['encoding'], data, payload.get('dict_id'))
+
+def main(argv=None):
+    from Qdrant_manager import DocumentStore
+
+    parser = argparse.ArgumentParser(description="Inspect compressed document content or train a dictionary")
+    parser.add_argument('command', choices=['stats', 'train', 'recompress'])
+    parser.add_argument('--host', default=os.getenv('QDRANT_HOST', 'qdrant'))
+    parser.add_argument('--port', type=int, default=int(os.getenv('QDRANT_PORT', 6333)))
+    parser.add_argument('--samples', type=int, default=2000, help="content samples to train on")
+    parser.add_argument('--dict-kb', type=int, default=112, help="dictionary size in KB")
+    args = parser.parse_args(argv)
+
+    store = DocumentStore(args.host, args.port, embeddings=False)
+    if args.command == 'train':
+        dict_id = store.train_dictionary(samples=args.samples, dict_size=args.dict_kb * 1024)
+        print(f"Activated zstd dictionary {dict_id}")
+    elif args.command == 'recompress':
+        store.recompress()
+    else:
+        for encoding, totals in sorted(store.content_stats().items()):
+            ratio = totals['size'] / totals['stored_size'] if totals['stored_size'] else 0
+            print(f"{encoding}: {totals['documents']} documents, {totals['size']} bytes "
+                  f"stored as {totals['stored_size']} ({ratio:.1f}x)")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+import os
+from urllib.parse import unquote, urlsplit
+
+# Largest HTML body read for link extraction; longer pages are truncated
+CRAWL_MAX_HTML_BYTES = int(os.getenv('CRAWL_MAX_HTML_BYTES', 10 * 1024 * 1024))
+# HEAD URLs that look like binary files before (or instead of) downloading them
+CRAWL_HEAD_BINARIES = os.getenv('CRAWL_HEAD_BINARIES', 'true').lower() not in ('0', 'false', 'no')
+
+# What the crawl and the processing stage make of a response
+HTML = 'html'
+PDF = 'pdf'
+DOCUMENT = 'document'
+MEDIA = 'media'
+OTHER = 'other'
+
+# Kinds the processing stage can convert
+PROCESSABLE = (HTML, PDF)
+
+_HTML_TYPES = {'text/html', 'application/xhtml+xml'}
+_DOCUMENT_TYPES = {
+    'application/msword',
+    'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
+    'application/vnd.ms-excel',
+    'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    'application/vnd.ms-powerpoint',
+    'application/vnd.openxmlformats-officedocument.presentationml.presentation',
+    'application/vnd.oasis.opendocument.text',
+    'application/rtf'
+}
+# Content-Types that say nothing about the content, so the URL decides
+_GENERIC_TYPES = {'', 'application/octet-stream', 'binary/octet-stream', 'application/force-download',
+                  'application/download', 'application/x-download'}
+
+_EXTENSION_KINDS = {
+    '.pdf': PDF,
+    '.doc': DOCUMENT, '.docx': DOCUMENT, '.xls': DOCUMENT, '.xlsx': DOCUMENT, '.ppt': DOCUMENT,
+    '.pptx': DOCUMENT, '.odt': DOCUMENT, '.rtf': DOCUMENT,
+    '.jpg': MEDIA, '.jpeg': MEDIA, '.png': MEDIA, '.gif': MEDIA, '.webp': MEDIA, '.bmp': MEDIA,
+    '.svg': MEDIA, '.ico': MEDIA, '.tif': MEDIA, '.tiff': MEDIA, '.mp3': MEDIA, '.wav': MEDIA,
+    '.m4a': MEDIA, '.mp4': MEDIA, '.m4v': MEDIA, '.mov': MEDIA, '.avi': MEDIA, '.wmv': MEDIA,
+    '.mkv': MEDIA, '.webm': MEDIA, '.flv': MEDIA,
+    '.zip': OTHER, '.rar': OTHER, '.7z': OTHER, '.gz': OTHER, '.tgz': OTHER, '.tar': OTHER,
+    '.exe': OTHER, '.msi': OTHER, '.dmg': OTHER, '.apk': OTHER, '.iso': OTHER, '.csv': OTHER,
+    '.txt': OTHER, '.xml': OTHER, '.json': OTHER, '.css': OTHER, '.js': OTHER
+}
+
+def mime_type(content_type: str) -> str:
+    """The bare, lower-case media type of a Content-Type header value"""
+    return (content_type or '').split(';', 1)[0].strip().lower()
+
+def url_kind(url: str):
+    """The kind a URL's file extension suggests, or None for page-like URLs"""
+    path = unquote(urlsplit(url).path).lower()
+    name = path.rsplit('/', 1)[-1]
+    if '.' not in name:
+        return None
+    return _EXTENSION_KINDS.get(name[name.rindex('.'):])
+
+def document_type(url: str, content_type: str = None) -> str:
+    """Classify a response as html, pdf, document, media or other.
+
+    The Content-Type decides when there is a meaningful one, otherwise
+    the URL's extension; URLs without a known extension are pages.
+    """
+    mime = mime_type(content_type)
+    if mime in _GENERIC_TYPES:
+        return url_kind(url) or HTML
+    if mime in _HTML_TYPES:
+        return HTML
+    if mime == 'application/pdf':
+        return PDF
+    if mime in _DOCUMENT_TYPES:
+        return DOCUMENT
+    if mime.startswith(('image/', 'audio/', 'video/')):
+        return MEDIA
+    return OTHER
+
+def head_first(url: str) -> bool:
+    """Whether to ask for a URL's headers with HEAD before downloading it"""
+    return CRAWL_HEAD_BINARIES and url_kind(url) is not None
+
+def decode_body(body: bytes, charset: str = None) -> str:
+    """Decode a response body with its charset, falling back to UTF-8"""
+    try:
+        return body.decode(charset or 'utf-8', errors='replace')
+    except LookupError:
+        return body.decode('utf-8', errors='replace')
+
+def content_length(headers):
+    """Content-Length as an int, or None when missing or invalid"""
+    value = headers.get('Content-Length')
+    return int(value) if value and value.isdigit() else None
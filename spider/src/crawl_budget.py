@@ -0,0 +1,146 @@
+import math
+import os
+import threading
+import time
+from urllib.parse import unquote, urlsplit
+
+# Path and query keywords that mark admission pages, crawled ahead of the rest
+DEFAULT_PRIORITY_KEYWORDS = (
+    'admission', 'admissions', 'apply', 'application', 'enrol', 'enroll',
+    'undergraduate', 'graduate', 'freshman', 'transfer', 'scholarship', 'tuition',
+    '招生', '入學', '入学', '報名', '报名', '簡章', '简章', '甄選', '甄选',
+    '考試', '考试', '新生', '獎學金', '奖学金', '學雜費', '学杂费'
+)
+
+_env_keywords = os.getenv('CRAWL_PRIORITY_KEYWORDS')
+PRIORITY_KEYWORDS = tuple(
+    keyword.strip().lower() for keyword in _env_keywords.split(',') if keyword.strip()
+) if _env_keywords else DEFAULT_PRIORITY_KEYWORDS
+
+DOCUMENT_EXTENSIONS = ('.pdf', '.doc', '.docx')
+
+def url_priority(url: str) -> int:
+    """Crawl priority of a URL, higher first: 2 for an admission keyword, 1 for a document link"""
+    parts = urlsplit(url)
+    path = unquote(parts.path).lower()
+    text = path + '?' + unquote(parts.query).lower()
+    priority = 0
+    if any(keyword in text for keyword in PRIORITY_KEYWORDS):
+        priority += 2
+    if path.endswith(DOCUMENT_EXTENSIONS):
+        priority += 1
+    return priority
+
+def _env_number(name, cast):
+    value = os.getenv(name)
+    return cast(value) if value else None
+
+# Budget limits and the type each is converted to
+LIMITS = {'max_pages': int, 'max_depth': int, 'max_bytes': int, 'max_seconds': float}
+
+def _limit(name: str, value):
+    """A limit converted to its type, or ValueError unless it is a non-negative number"""
+    cast = LIMITS[name]
+    try:
+        number = cast(value)
+        # float() also rejects 2.5 pages, which int() would truncate
+        valid = not isinstance(value, bool) and math.isfinite(number) and number >= 0 and float(value) == number
+    except (TypeError, ValueError, OverflowError):
+        valid = False
+    if not valid:
+        kind = 'integer' if cast is int else 'number'
+        raise ValueError(f"{name} must be a non-negative {kind}, got {value!r}")
+    return number
+
+class CrawlBudget:
+    """Per-crawl limits on pages, link depth, downloaded bytes and wall-clock time.
+
+    A limit of None is unlimited. Pages are counted when a URL is claimed,
+    so concurrent fetches never overshoot max_pages; bytes are counted as
+    responses arrive, so max_bytes can be exceeded by what is in flight.
+    """
+
+    def __init__(self, max_pages: int = None, max_depth: int = None,
+                 max_bytes: int = None, max_seconds: float = None):
+        self.max_pages = max_pages
+        self.max_depth = max_depth
+        self.max_bytes = max_bytes
+        self.max_seconds = max_seconds
+        self.pages = 0
+        self.bytes = 0
+        self.deadline = None
+        self.exhausted_by = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> 'CrawlBudget':
+        return cls(
+            max_pages=_env_number('CRAWL_MAX_PAGES', int),
+            max_depth=_env_number('CRAWL_MAX_DEPTH', int),
+            max_bytes=_env_number('CRAWL_MAX_BYTES', int),
+            max_seconds=_env_number('CRAWL_MAX_SECONDS', float)
+        )
+
+    @classmethod
+    def from_dict(cls, data) -> 'CrawlBudget':
+        """Budget from a request body such as {"max_pages": 500, "max_seconds": 600}.
+
+        Raises ValueError for unknown limits and invalid values; null is unlimited.
+        """
+        if not isinstance(data, dict):
+            raise ValueError("budget must be an object")
+        unknown = sorted(set(data) - set(LIMITS))
+        if unknown:
+            raise ValueError(f"unknown limits {', '.join(unknown)}, choose from {', '.join(LIMITS)}")
+        return cls(**{name: _limit(name, value) for name, value in data.items() if value is not None})
+
+    def start(self):
+        """Start the wall-clock deadline"""
+        if self.max_seconds is not None:
+            self.deadline = time.monotonic() + self.max_seconds
+
+    def allows_depth(self, depth: int) -> bool:
+        return self.max_depth is None or depth <= self.max_depth
+
+    def _exhausted(self):
+        if self.max_pages is not None and self.pages >= self.max_pages:
+            return 'pages'
+        if self.max_bytes is not None and self.bytes >= self.max_bytes:
+            return 'bytes'
+        if self.deadline is not None and time.monotonic() >= self.deadline:
+            return 'deadline'
+        return None
+
+    def exhausted(self):
+        """The limit that has been reached ('pages', 'bytes' or 'deadline'), or None"""
+        with self._lock:
+            reason = self._exhausted()
+            if reason:
+                self.exhausted_by = self.exhausted_by or reason
+            return reason
+
+    def claim_page(self) -> bool:
+        """Count one more page to fetch, or return False once a limit is reached"""
+        with self._lock:
+            reason = self._exhausted()
+            if reason:
+                self.exhausted_by = self.exhausted_by or reason
+                return False
+            self.pages += 1
+            return True
+
+    def add_bytes(self, size: int):
+        with self._lock:
+            self.bytes += size
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            return {
+                'pages': self.pages,
+                'bytes': self.bytes,
+                'max_pages': self.max_pages,
+                'max_depth': self.max_depth,
+                'max_bytes': self.max_bytes,
+                'max_seconds': self.max_seconds,
+                'exhausted_by': self.exhausted_by
+            }
@@ -0,0 +1,313 @@
+import hashlib
+import heapq
+import itertools
+import math
+import os
+import sqlite3
+import threading
+from collections import deque
+from queue import Empty
+
+# frontier.claimed: waiting, popped by a running crawl, finished
+PENDING, CLAIMED, DONE = 0, 1, 2
+
+def url_fingerprint(url: str) -> int:
+    """64-bit fingerprint of a URL, signed so it fits an SQLite INTEGER"""
+    digest = hashlib.blake2b(url.encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'big', signed=True)
+
+class BloomFilter:
+    """Fixed-size Bloom filter over 64-bit fingerprints"""
+
+    def __init__(self, capacity: int, error_rate: float = 0.001):
+        self.size = max(8, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.hash_count = max(1, int(round(self.size / capacity * math.log(2))))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, fingerprint: int):
+        # Double hashing: derive k positions from the two 32-bit halves
+        value = fingerprint & 0xFFFFFFFFFFFFFFFF
+        h1 = value & 0xFFFFFFFF
+        h2 = (value >> 32) | 1
+        for i in range(self.hash_count):
+            yield (h1 + i * h2) % self.size
+
+    def add(self, fingerprint: int):
+        for pos in self._positions(fingerprint):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, fingerprint: int) -> bool:
+        return all(self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(fingerprint))
+
+class FingerprintSet:
+    """In-memory visited set that keeps 64-bit fingerprints instead of URL strings"""
+
+    def __init__(self):
+        self._fingerprints = set()
+
+    def add(self, url: str):
+        self._fingerprints.add(url_fingerprint(url))
+
+    def __contains__(self, url: str) -> bool:
+        return url_fingerprint(url) in self._fingerprints
+
+    def unseen(self, urls) -> list:
+        """The URLs that are not in the set, in order"""
+        fingerprints = self._fingerprints
+        return [url for url in urls if url_fingerprint(url) not in fingerprints]
+
+    def __len__(self):
+        return len(self._fingerprints)
+
+class MemoryFrontier:
+    """In-memory priority frontier: highest priority first, then FIFO (breadth first).
+
+    Entries carry the link depth, handed back by pop() as (url, depth).
+    """
+
+    def __init__(self):
+        self._heap = []
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+
+    def put(self, url: str, depth: int = 0, priority: int = 0):
+        with self._lock:
+            heapq.heappush(self._heap, (-priority, next(self._counter), url, depth))
+
+    def pop(self) -> tuple:
+        with self._lock:
+            if not self._heap:
+                raise Empty
+            _, _, url, depth = heapq.heappop(self._heap)
+            return url, depth
+
+    def get_nowait(self) -> str:
+        return self.pop()[0]
+
+    def get(self, block=True, timeout=None) -> str:
+        return self.get_nowait()
+
+    def qsize(self) -> int:
+        return len(self._heap)
+
+    def empty(self) -> bool:
+        return not self._heap
+
+class CrawlState:
+    """SQLite-backed crawl state: visited fingerprints, discovered links and frontier.
+
+    Everything lives on disk, with only a Bloom filter and a small frontier
+    read-ahead buffer held in memory, so memory stays roughly flat however
+    large the site is. Writes are committed in batches and on checkpoint(); an
+    interrupted crawl reopened from the same path resumes where it stopped.
+    """
+
+    def __init__(self, path: str, bloom_capacity: int = 1_000_000, commit_every: int = 500):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.commit_every = commit_every
+        self._pending_writes = 0
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.executescript('''
+            CREATE TABLE IF NOT EXISTS visited (fp INTEGER PRIMARY KEY);
+            CREATE TABLE IF NOT EXISTS links (fp INTEGER PRIMARY KEY, url TEXT NOT NULL);
+            CREATE TABLE IF NOT EXISTS frontier (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                fp INTEGER NOT NULL UNIQUE,
+                url TEXT NOT NULL,
+                claimed INTEGER NOT NULL DEFAULT 0
+            );
+        ''')
+        # Depth and priority columns, added to state files from older versions too
+        columns = {row[1] for row in self._conn.execute('PRAGMA table_info(frontier)')}
+        for column in ('depth', 'priority'):
+            if column not in columns:
+                self._conn.execute(f'ALTER TABLE frontier ADD COLUMN {column} INTEGER NOT NULL DEFAULT 0')
+        self._conn.execute('DROP INDEX IF EXISTS frontier_pending')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS frontier_next ON frontier (claimed, priority DESC, id)')
+        # URLs claimed by a previous run that never finished are fetched again
+        self._conn.execute('UPDATE frontier SET claimed = ? WHERE claimed = ?', (PENDING, CLAIMED))
+        self._conn.commit()
+
+        self.bloom = BloomFilter(bloom_capacity)
+        for (fp,) in self._conn.execute('SELECT fp FROM visited'):
+            self.bloom.add(fp)
+
+        self.visited = VisitedStore(self)
+        self.links = LinkStore(self)
+        self.frontier = DiskFrontier(self)
+
+    def _write(self, sql, params=()):
+        with self._lock:
+            cursor = self._conn.execute(sql, params)
+            self._pending_writes += 1
+            if self._pending_writes >= self.commit_every:
+                self._conn.commit()
+                self._pending_writes = 0
+            return cursor
+
+    def _read(self, sql, params=()):
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def is_resumed(self) -> bool:
+        """True when the database already holds progress from an earlier run"""
+        # Frontier rows count too: a crawl can stop before any visit is committed
+        return bool(self._read('SELECT 1 FROM visited LIMIT 1') or self._read('SELECT 1 FROM frontier LIMIT 1'))
+
+    def checkpoint(self):
+        """Flush pending writes so a crash can resume from here"""
+        with self._lock:
+            self._conn.commit()
+            self._pending_writes = 0
+
+    def close(self, remove: bool = False):
+        with self._lock:
+            self._conn.commit()
+            self._conn.close()
+        if remove:
+            for suffix in ('', '-wal', '-shm'):
+                if os.path.exists(self.path + suffix):
+                    os.remove(self.path + suffix)
+
+class VisitedStore:
+    """Set-like view of visited URL fingerprints, with a Bloom filter in front"""
+
+    def __init__(self, state: CrawlState):
+        self._state = state
+
+    def add(self, url: str):
+        fp = url_fingerprint(url)
+        with self._state._lock:
+            self._state.bloom.add(fp)
+            self._state._write('INSERT OR IGNORE INTO visited (fp) VALUES (?)', (fp,))
+
+    def __contains__(self, url: str) -> bool:
+        fp = url_fingerprint(url)
+        if fp not in self._state.bloom:
+            return False
+        return bool(self._state._read('SELECT 1 FROM visited WHERE fp = ?', (fp,)))
+
+    def unseen(self, urls) -> list:
+        """The URLs that were not visited, in order, with one query per 500 Bloom filter hits"""
+        keyed = [(url, url_fingerprint(url)) for url in urls]
+        candidates = [fp for _, fp in keyed if fp in self._state.bloom]
+        visited = set()
+        for i in range(0, len(candidates), 500):
+            chunk = candidates[i:i + 500]
+            rows = self._state._read(
+                f"SELECT fp FROM visited WHERE fp IN ({','.join('?' * len(chunk))})", chunk
+            )
+            visited.update(fp for fp, in rows)
+        return [url for url, fp in keyed if fp not in visited]
+
+    def __len__(self):
+        return self._state._read('SELECT COUNT(*) FROM visited')[0][0]
+
+class LinkStore:
+    """Set-like store of discovered links kept on disk"""
+
+    def __init__(self, state: CrawlState):
+        self._state = state
+
+    def add(self, url: str):
+        self._state._write('INSERT OR IGNORE INTO links (fp, url) VALUES (?, ?)',
+                           (url_fingerprint(url), url))
+
+    def __contains__(self, url: str) -> bool:
+        return bool(self._state._read('SELECT 1 FROM links WHERE fp = ?', (url_fingerprint(url),)))
+
+    def __len__(self):
+        return self._state._read('SELECT COUNT(*) FROM links')[0][0]
+
+    def __iter__(self):
+        # Keyset pagination so the lock is never held across a yield
+        batch = self._state._read('SELECT fp, url FROM links ORDER BY fp LIMIT 1000')
+        while batch:
+            for _, url in batch:
+                yield url
+            batch = self._state._read(
+                'SELECT fp, url FROM links WHERE fp > ? ORDER BY fp LIMIT 1000', (batch[-1][0],)
+            )
+
+class DiskFrontier:
+    """Priority URL frontier on disk with the same API as MemoryFrontier.
+
+    A URL is only ever enqueued once per crawl. pop() claims rows in small
+    batches, highest priority first, and done() marks them finished; rows
+    claimed but not finished are reset on reopen so they are not lost on
+    a crash.
+    """
+
+    def __init__(self, state: CrawlState, read_ahead: int = 256):
+        self._state = state
+        self._read_ahead = read_ahead
+        self._buffer = deque()
+
+    def put(self, url: str, depth: int = 0, priority: int = 0):
+        self._state._write('INSERT OR IGNORE INTO frontier (fp, url, depth, priority) VALUES (?, ?, ?, ?)',
+                           (url_fingerprint(url), url, depth, priority))
+
+    def done(self, url: str):
+        """Mark a popped URL finished, so a resumed crawl does not pop it again"""
+        self._state._write('UPDATE frontier SET claimed = ? WHERE fp = ?', (DONE, url_fingerprint(url)))
+
+    def _fill(self):
+        rows = self._state._read(
+            'SELECT id, url, depth, priority FROM frontier WHERE claimed = 0 '
+            'ORDER BY priority DESC, id LIMIT ?',
+            (self._read_ahead,)
+        )
+        if rows:
+            self._state._conn.executemany(
+                f'UPDATE frontier SET claimed = {CLAIMED} WHERE id = ?', [(row[0],) for row in rows]
+            )
+            self._buffer.extend(rows)
+
+    def pop(self) -> tuple:
+        with self._state._lock:
+            # Refill when the buffer runs dry, or when a link put since the last
+            # fill outranks what is buffered
+            if not self._buffer or self._outranked():
+                self._unclaim_buffer()
+                self._fill()
+            if not self._buffer:
+                raise Empty
+            _, url, depth, _ = self._buffer.popleft()
+            return url, depth
+
+    def _outranked(self) -> bool:
+        # Rows are buffered highest priority first
+        best = self._buffer[0][3]
+        return bool(self._state._read(
+            'SELECT 1 FROM frontier WHERE claimed = 0 AND priority > ? LIMIT 1', (best,)
+        ))
+
+    def _unclaim_buffer(self):
+        if self._buffer:
+            self._state._conn.executemany(
+                f'UPDATE frontier SET claimed = {PENDING} WHERE id = ?', [(row[0],) for row in self._buffer]
+            )
+            self._buffer.clear()
+
+    def get_nowait(self) -> str:
+        return self.pop()[0]
+
+    def get(self, block=True, timeout=None) -> str:
+        return self.get_nowait()
+
+    def qsize(self) -> int:
+        with self._state._lock:
+            pending = self._state._read('SELECT COUNT(*) FROM frontier WHERE claimed = 0')[0][0]
+            return pending + len(self._buffer)
+
+    def empty(self) -> bool:
+        with self._state._lock:
+            if self._buffer:
+                return False
+            return not self._state._read('SELECT 1 FROM frontier WHERE claimed = 0 LIMIT 1')
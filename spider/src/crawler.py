@@ -1,44 +1,101 @@
-import scrapy
-from scrapy.crawler import CrawlerProcess
-from urllib.parse import urlparse, urljoin, urldefrag
+from urllib.parse import urlparse
 import requests
 import json
 import os
+import hashlib
 from datetime import datetime
 import concurrent.futures
 import threading
 from flask import Flask, request, jsonify
-from concurrent.futures import ThreadPoolExecutor
-from queue import Queue
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from queue import Empty
 import time
+import asyncio
 import urllib3
-from mongodb_manager import MongoDBManager
+import logging
+from mongoDB_manager import MongoDBManager, CrawlResultsWriter
+from archive import get_archive
+from crawl_budget import CrawlBudget, url_priority
+from crawl_state import CrawlState, FingerprintSet, MemoryFrontier
+from async_crawler import AsyncCrawlEngine, DEFAULT_HEADERS
+from scheduler import RETRYABLE_STATUS, get_scheduler, parse_crawl_delay, parse_retry_after
+from sitemaps import CRAWL_SITEMAPS, SitemapDiscovery, freshness_bonus
+from content_types import (CRAWL_MAX_HTML_BYTES, HTML, content_length, decode_body, document_type,
+                           head_first, mime_type)
+from link_extractor import LinkExtractor
+from metrics import BODIES_SKIPPED, IN_FLIGHT, PAGES_FETCHED, RESPONSE_KINDS, stage
 from utils.helper import get_school_abbreviation
+from utils.urls import canonicalize_url
 
 # Disable SSL warnings
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
-# Thread-safe print function
-print_lock = threading.Lock()
-def safe_print(message):
-    with print_lock:
-        print(message)
+# Per-page and per-link messages are DEBUG; the crawl loggers default to INFO
+logging.getLogger('crawler').setLevel(os.getenv('CRAWLER_LOG_LEVEL', 'INFO').upper())
 
 class WebScraper:
-    def __init__(self, url):
+    def __init__(self, url, state_dir=None, incremental=False, tracer=None, frontier=None,
+                 budget=None, archive=None, sitemaps=None):
         self.url = url
-        parsed_url = urlparse(url)
-        self.domain = parsed_url.netloc
-        if self.domain.startswith('www.'):
-            self.domain = self.domain[4:]
+        self.incremental = incremental
+        # Seed the frontier from the site's sitemaps before following links
+        self.use_sitemaps = CRAWL_SITEMAPS if sitemaps is None else sitemaps
+        # Sitemap lastmod per page, used in incremental mode to skip unchanged pages
+        self.sitemap_lastmod = {}
+        self._robots = {}
+        # Page, depth, byte and time limits, unlimited unless set here or in CRAWL_MAX_*
+        self.budget = budget or CrawlBudget.from_env()
+        # Optional archive.CrawlArchive keeping every fetched page for replay
+        self.archive = archive or get_archive()
+        # Optional metrics.Tracer recording per-URL spans for this crawl
+        self.tracer = tracer
+        self.logger = logging.getLogger('crawler.WebScraper')
+        # Links are tracked in canonical form, so the seed and scope are too
+        self.start_url = canonicalize_url(url)
+        self.link_extractor = LinkExtractor(url)
+        self.domain = self.link_extractor.domain
         self.school_name = get_school_abbreviation(url)
-        self.links = set()
         self.links_lock = threading.Lock()
-        self.queue = Queue()
-        self.visited = set()
+        
+        # With a state directory the frontier, visited set and links live in
+        # SQLite and an interrupted crawl of the same URL resumes from there
+        state_dir = state_dir or os.getenv('CRAWLER_STATE_DIR')
+        self.state = None
+        self.frontier = frontier
+        if frontier is not None:
+            # Distributed crawl: the frontier is shared through MongoDB and
+            # deduplicates links for every worker, see distributed.py
+            self.links = set()
+            self.queue = frontier
+            self.visited = frontier.visited
+        elif state_dir:
+            state_file = hashlib.md5(url.encode()).hexdigest() + '.sqlite'
+            self.state = CrawlState(os.path.join(state_dir, state_file))
+            if self.state.is_resumed():
+                self.logger.info("Resuming crawl of %s: %d visited, %d queued",
+                                 url, len(self.state.visited), self.state.frontier.qsize())
+            self.links = self.state.links
+            self.queue = self.state.frontier
+            self.visited = self.state.visited
+        else:
+            self.links = set()
+            self.queue = MemoryFrontier()
+            self.visited = FingerprintSet()
+        # URLs claimed but not yet finished. A URL moves to visited when it is
+        # finished, so a resumed crawl refetches what was in flight
+        self.in_flight = set()
+        self.claim_lock = threading.Lock()
         self.max_workers = 8
-        self.last_save_count = 0
+        self.max_in_flight = int(os.getenv('CRAWLER_MAX_IN_FLIGHT', 32))
+        self.scheduler = get_scheduler()
         self.save_threshold = 100
+        # Callables receiving each batch of newly discovered links, and each
+        # fetched page as (url, body, content_type), e.g. a streaming pipeline
+        self.link_listeners = []
+        self.page_listeners = []
+        # Callables receiving each URL once it is finished with (fetched,
+        # failed or given up on), e.g. to release a frontier lease
+        self.done_listeners = []
         self.results_dir = "crawl_results"
         os.makedirs(self.results_dir, exist_ok=True)
         
@@ -46,117 +103,485 @@ class WebScraper:
         self.mongodb = MongoDBManager()
         try:
             self.mongodb.connect()
-            safe_print("Successfully connected to MongoDB")
+            self.logger.info("Successfully connected to MongoDB")
         except Exception as e:
-            safe_print(f"Error connecting to MongoDB: {str(e)}")
+            self.logger.error("Error connecting to MongoDB: %s", e)
             raise
+        
+        # A distributed crawl's results are reset once, by its coordinator
+        if frontier is None and not (self.state and self.state.is_resumed()):
+            self.mongodb.reset_crawl_results(self.url, self.school_name)
+        self.results_writer = CrawlResultsWriter(
+            self.mongodb, self.url, self.school_name,
+            flush_threshold=self.save_threshold
+        )
             
-        safe_print(f"[DEBUG] WebScraper initialized with URL: {url}, domain: {self.domain}")
+        self.logger.debug("WebScraper initialized with URL: %s, domain: %s", url, self.domain)
 
     def save_results(self):
+        """Flush pending link deltas to MongoDB and checkpoint the crawl state"""
+        if self.state:
+            self.state.checkpoint()
+        if self.archive:
+            self.archive.flush()
         try:
-            self.mongodb.save_crawl_results(
-                url=self.url,
-                school_name=self.school_name,
-                links=self.links
-            )
-            safe_print(f"Saved {len(self.links)} links to MongoDB")
+            self.results_writer.flush()
+            self.logger.info("Saved %d links to MongoDB", len(self.links))
         except Exception as e:
-            safe_print(f"Error saving to MongoDB: {str(e)}")
+            self.logger.error("Error saving to MongoDB: %s", e)
 
-    def process_url(self, url):
-        base_url, _ = urldefrag(url)
-        
-        if base_url in self.visited:
-            safe_print(f"DEBUG: Skipping already visited URL: {base_url}")
+    def extract_links(self, page_url, html, skip_visited=True):
+        """Return in-scope (and by default unvisited) links found on a page"""
+        with stage('parse', self.tracer, page_url):
+            return self.link_extractor.extract(page_url, html, self.visited if skip_visited else None)
+
+    def record_links(self, found_links):
+        """Add links to the result set and hand new ones to the results writer. Returns the links to enqueue"""
+        new_links = []
+        with self.links_lock:
+            for base_full_url in found_links:
+                if base_full_url not in self.links:
+                    self.links.add(base_full_url)
+                    new_links.append(base_full_url)
+        # Persisted by the writer's background thread, off the crawl hot path
+        self.results_writer.add(new_links)
+        for listener in self.link_listeners:
+            listener(new_links)
+        return new_links
+
+    def enqueue(self, links, depth):
+        """Queue links found at depth, admission pages and documents first"""
+        if not self.budget.allows_depth(depth):
             return
-        
+        for link in links:
+            self.queue.put(link, depth=depth, priority=url_priority(link))
+
+    def claim_next(self):
+        """Pop the next URL to fetch and claim it atomically. Returns (url, depth), or None
+        when the frontier is empty or the budget is spent"""
+        with self.claim_lock:
+            while True:
+                if self.budget.exhausted():
+                    return None
+                try:
+                    url, depth = self.queue.pop()
+                except Empty:
+                    return None
+                base_url = canonicalize_url(url)
+                if base_url in self.in_flight or base_url in self.visited:
+                    if self.state and base_url in self.visited:
+                        self.queue.done(url)
+                    continue
+                if not self.budget.claim_page():
+                    return None
+                self.in_flight.add(base_url)
+                return url, depth
+
+    def finish_url(self, url):
+        """Mark a claimed URL visited and notify the done listeners"""
+        base_url = canonicalize_url(url)
+        with self.claim_lock:
+            self.visited.add(base_url)
+            self.in_flight.discard(base_url)
+            if self.state:
+                self.queue.done(url)
+        for listener in self.done_listeners:
+            listener(url)
+
+    def robots_txt(self, url):
+        """The robots.txt of the URL's host, or None, fetched at most once per crawl"""
+        parsed = urlparse(url)
+        if parsed.netloc not in self._robots:
+            robots_txt = None
+            try:
+                response = requests.get(
+                    f"{parsed.scheme}://{parsed.netloc}/robots.txt",
+                    headers=DEFAULT_HEADERS,
+                    timeout=(5, 10),
+                    verify=False
+                )
+                if response.status_code == 200:
+                    robots_txt = response.text
+            except requests.exceptions.RequestException as e:
+                self.logger.debug("Could not load robots.txt for %s: %s", parsed.netloc, e)
+            self._robots[parsed.netloc] = robots_txt
+        return self._robots[parsed.netloc]
+
+    def _load_robots(self, url):
+        """Load robots.txt once per host and apply its Crawl-delay"""
+        parsed = urlparse(url)
+        if not self.scheduler.needs_robots(parsed.netloc):
+            return
+        robots_txt = self.robots_txt(url)
+        if robots_txt:
+            delay = parse_crawl_delay(robots_txt, DEFAULT_HEADERS["User-Agent"])
+            self.scheduler.set_crawl_delay(parsed.netloc, delay)
+
+    def fetch(self, url, extra_headers=None, stream=False, method='GET'):
+        """Request a URL under the politeness scheduler, retrying throttled or failed requests.
+
+        With stream=True the body is not read; the caller must close the response.
+        """
+        host = urlparse(url).netloc
+        self._load_robots(url)
+        attempt = 0
+        while True:
+            self.scheduler.acquire(host)
+            start_time = time.monotonic()
+            status = None
+            retry_after = None
+            error = None
+            try:
+                with stage('fetch', self.tracer, url, attempt=attempt):
+                    response = requests.request(
+                        method,
+                        url,
+                        headers={**DEFAULT_HEADERS, **(extra_headers or {})},
+                        timeout=(5, 10),
+                        verify=False,
+                        stream=stream
+                    )
+                status = response.status_code
+                PAGES_FETCHED.inc(engine='threaded', status=status)
+                retry_after = parse_retry_after(response.headers.get('Retry-After'))
+            except requests.exceptions.SSLError:
+                status = 0
+                raise
+            except (requests.exceptions.Timeout, requests.exceptions.ConnectionError) as e:
+                error = e
+            except Exception:
+                status = 0
+                raise
+            finally:
+                self.scheduler.release(host, status, time.monotonic() - start_time, retry_after)
+
+            if error is None and status not in RETRYABLE_STATUS:
+                return response
+            if not self.scheduler.should_retry(attempt, status):
+                if error is not None:
+                    raise error
+                return response
+
+            if stream and error is None:
+                response.close()
+            delay = self.scheduler.backoff(attempt, retry_after)
+            self.logger.debug("Retrying %s in %.1fs (attempt %d)", url, delay, attempt + 2)
+            time.sleep(delay)
+            attempt += 1
+
+    def fetch_page(self, url, extra_headers=None):
+        """Fetch a URL, downloading the body only when it is HTML.
+
+        URLs that look like binary files are checked with HEAD first. Other
+        responses are streamed and closed once their headers show they are
+        not HTML; HTML bodies are read up to CRAWL_MAX_HTML_BYTES.
+        Returns (response, body, truncated), body None when not downloaded.
+        """
+        if head_first(url):
+            response = self.fetch(url, extra_headers, method='HEAD')
+            if response.status_code in (304, 404, 410):
+                return response, None, False
+            if response.status_code == 200 and document_type(url, response.headers.get('Content-Type')) != HTML:
+                BODIES_SKIPPED.inc(reason='binary')
+                return response, None, False
+            # HEAD refused, or the URL is a page after all
+        # A body read to the end hands the connection back to the pool;
+        # close() drops it, so it is only used for bodies left unread
+        response = self.fetch(url, extra_headers, stream=True)
+        if response.status_code != 200:
+            response.close()
+            return response, None, False
+        if document_type(url, response.headers.get('Content-Type')) != HTML:
+            response.close()
+            BODIES_SKIPPED.inc(reason='binary')
+            return response, None, False
+        body = bytearray()
+        for chunk in response.iter_content(chunk_size=64 * 1024):
+            body.extend(chunk)
+            if len(body) > CRAWL_MAX_HTML_BYTES:
+                response.close()
+                BODIES_SKIPPED.inc(reason='truncated')
+                self.logger.info("Truncated %s at %d bytes", url, CRAWL_MAX_HTML_BYTES)
+                return response, bytes(body[:CRAWL_MAX_HTML_BYTES]), True
+        return response, bytes(body), False
+
+    def conditional_headers(self, url):
+        """Build If-None-Match/If-Modified-Since headers from the previous crawl of url"""
+        if not self.incremental:
+            return {}, None
+        record = self.mongodb.get_page_validators(url)
+        if not record:
+            return {}, None
+        headers = {}
+        if record.get('etag'):
+            headers['If-None-Match'] = record['etag']
+        if record.get('last_modified'):
+            headers['If-Modified-Since'] = record['last_modified']
+        return headers, record
+
+    def seed_from_sitemaps(self):
+        """Queue the in-scope pages listed in the site's sitemaps. Returns how many were new.
+
+        Pages are queued one link below the start URL, most recently
+        modified first, and recently modified ones get a priority bonus.
+        """
+        if not self.use_sitemaps or not self.budget.allows_depth(1):
+            return 0
         try:
-            safe_print(f"DEBUG: Starting to process URL: {base_url}")
-            response = requests.get(
-                url,
-                headers={
-                    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36"
-                },
-                timeout=(5, 10),
-                verify=False
+            with stage('sitemaps', self.tracer, self.start_url):
+                pages = SitemapDiscovery(self).discover()
+        except Exception as e:
+            self.logger.warning("Sitemap discovery failed for %s: %s (%s)", self.start_url, e, type(e).__name__)
+            return 0
+        pages.pop(self.start_url, None)
+        if self.incremental:
+            self.sitemap_lastmod.update((url, lastmod) for url, lastmod in pages.items() if lastmod)
+        ordered = sorted(pages, key=lambda url: pages[url] or datetime.min, reverse=True)
+        new_links = self.record_links(self.visited.unseen(ordered))
+        now = datetime.now()
+        for link in new_links:
+            self.queue.put(link, depth=1, priority=url_priority(link) + freshness_bonus(pages[link], now))
+        self.logger.info("Seeded %d pages from sitemaps", len(new_links))
+        return len(new_links)
+
+    def skip_unchanged(self, url, depth):
+        """In incremental mode, reuse the stored links of a page whose sitemap lastmod
+        is older than its last check instead of fetching it. Returns True when skipped"""
+        lastmod = self.sitemap_lastmod.get(canonicalize_url(url))
+        if not self.incremental or lastmod is None:
+            return False
+        record = self.mongodb.get_page_validators(url)
+        if not record or not record.get('checked_at') or lastmod > record['checked_at']:
+            return False
+        self.logger.debug("Unchanged since last crawl per sitemap lastmod: %s", url)
+        self.enqueue(self.handle_response(url, 304, {}, '', record), depth + 1)
+        return True
+
+    def archive_response(self, url, status, headers, body):
+        """Keep a fetched page in the archive, when there is one"""
+        if self.archive is None or status != 200:
+            return
+        try:
+            self.archive.append(url, status, headers, body, school=self.school_name)
+        except Exception as e:
+            self.logger.warning("Could not archive %s: %s", url, e)
+
+    def handle_response(self, url, status, headers, html, record=None):
+        """Extract links from a fetched page (or reuse them on 304). Returns links to enqueue"""
+        if status == 304 and record is not None:
+            self.logger.debug("Not modified since last crawl: %s", url)
+            self.mongodb.mark_page_unchanged(url)
+            return self.record_links(self.visited.unseen(record.get('links', [])))
+        
+        if status != 200:
+            return []
+        
+        content_type = headers.get('Content-Type', '')
+        doc_type = document_type(url, content_type)
+        RESPONSE_KINDS.inc(kind=doc_type)
+        if canonicalize_url(url) != self.start_url:
+            self.results_writer.add_type(url, doc_type, mime_type(content_type), content_length(headers))
+        if html is None:
+            # Not HTML, so there are no links and the body was never downloaded
+            if self.incremental:
+                self._save_document_validators(url, headers, record)
+            for listener in self.page_listeners:
+                listener(url, None, content_type)
+            return []
+        
+        if not self.incremental:
+            new_links = self.record_links(self.extract_links(url, html))
+        else:
+            scoped_links = self.extract_links(url, html, skip_visited=False)
+            content_hash = hashlib.md5(html.encode()).hexdigest()
+            changed = record is None or record.get('content_hash') != content_hash
+            self.mongodb.save_page_validators(
+                url=url,
+                etag=headers.get('ETag'),
+                last_modified=headers.get('Last-Modified'),
+                content_hash=content_hash,
+                links=scoped_links,
+                changed=changed
             )
-            self.visited.add(base_url)
+            new_links = self.record_links(self.visited.unseen(scoped_links))
+        
+        for listener in self.page_listeners:
+            listener(url, html, content_type)
+        return new_links
+
+    def _save_document_validators(self, url, headers, record):
+        # Without the body, a document counts as changed when its validators
+        # and length differ from the last crawl, or when it has none
+        signature = '|'.join(str(headers.get(name, '')) for name in ('ETag', 'Last-Modified', 'Content-Length'))
+        content_hash = hashlib.md5(signature.encode()).hexdigest() if signature.strip('|') else None
+        changed = content_hash is None or record is None or record.get('content_hash') != content_hash
+        self.mongodb.save_page_validators(
+            url=url,
+            etag=headers.get('ETag'),
+            last_modified=headers.get('Last-Modified'),
+            content_hash=content_hash,
+            links=[],
+            changed=changed
+        )
+
+    def process_url(self, url, depth=0):
+        """Fetch a URL claimed with claim_next() and queue the new links found on it"""
+        base_url = canonicalize_url(url)
+        IN_FLIGHT.inc(engine='threaded')
+        try:
+            self.logger.debug("Starting to process URL: %s", base_url)
+            if self.skip_unchanged(url, depth):
+                return
+            extra_headers, record = self.conditional_headers(url)
+            response, body, truncated = self.fetch_page(url, extra_headers)
+            html = None
+            if body is not None:
+                self.budget.add_bytes(len(body))
+                if not truncated:
+                    self.archive_response(url, response.status_code, response.headers, body)
+                html = decode_body(body, response.encoding)
             
-            safe_print(f"DEBUG: Response status code: {response.status_code} for {base_url}")
+            self.logger.debug("Response status code: %d for %s", response.status_code, base_url)
             
-            if response.status_code == 200:
-                selector = scrapy.Selector(text=response.text)
-                found_links = []
-                all_links = selector.css("a::attr(href)").getall()
-                safe_print(f"DEBUG: Found {len(all_links)} raw links on page {base_url}")
-                
-                for link in all_links:
-                    full_url = urljoin(url, link)
-
-                    base_full_url, _ = urldefrag(full_url)
-                    parsed_url = urlparse(base_full_url)
-                    initial_parsed = urlparse(self.url)
-                    
-                    if (parsed_url.netloc.replace('www.', '') == self.domain and 
-                        parsed_url.path.startswith(initial_parsed.path) and
-                        base_full_url not in self.visited):
-                        found_links.append(base_full_url)
-                
-                safe_print(f"DEBUG: Found {len(found_links)} valid links on page {base_url}")
-                
-                with self.links_lock:
-                    for base_full_url in found_links:
-                        self.links.add(base_full_url)
-                        self.queue.put(base_full_url)
-                        safe_print(f"DEBUG: Added to queue: {base_full_url}")
-                    
-                    if len(self.links) - self.last_save_count >= self.save_threshold:
-                        safe_print(f"DEBUG: Saving results - total links: {len(self.links)}")
-                        self.save_results()
-                        self.last_save_count = len(self.links)
+            new_links = self.handle_response(url, response.status_code, response.headers,
+                                             html, record)
+            self.enqueue(new_links, depth + 1)
                         
         except requests.exceptions.Timeout:
-            safe_print(f"DEBUG: Timeout while processing {url} (timeout=(5, 10))")
+            self.logger.warning("Timeout while processing %s (timeout=(5, 10))", url)
         except requests.exceptions.SSLError:
-            safe_print(f"DEBUG: SSL Error while processing {url}")
+            self.logger.warning("SSL Error while processing %s", url)
         except requests.exceptions.ConnectionError:
-            safe_print(f"DEBUG: Connection Error while processing {url}")
+            self.logger.warning("Connection Error while processing %s", url)
         except Exception as e:
-            safe_print(f"DEBUG: Unexpected error processing {url}: {str(e)}")
-            safe_print(f"DEBUG: Error type: {type(e).__name__}")
+            self.logger.warning("Unexpected error processing %s: %s (%s)", url, e, type(e).__name__)
         finally:
-            safe_print(f"DEBUG: Marking as visited: {base_url}")
-            self.visited.add(base_url)
+            IN_FLIGHT.dec(engine='threaded')
+            self.finish_url(url)
+
+    def _close_state(self, completed):
+        """Close the persistent crawl state, discarding it once the crawl has completed"""
+        if self.state:
+            self.state.close(remove=completed)
+            self.state = None
+
+    def _log_finished(self, elapsed):
+        self.logger.info("Crawling finished in %.2f seconds. Found %d links", elapsed, len(self.links))
+        if self.budget.exhausted_by:
+            self.logger.info("Stopped early, %s budget reached: %s", self.budget.exhausted_by,
+                             self.budget.to_dict())
 
     def scrape(self):
         try:
-            self.queue.put(self.url)
+            self.enqueue([self.start_url], 0)
+            self.budget.start()
             start_time = time.time()
+            self.seed_from_sitemaps()
             
+            # A new URL is started whenever a worker frees up. The crawl is
+            # over once nothing can be claimed and nothing is in flight, as
+            # only in-flight pages can add to the frontier
+            futures = set()
             with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
                 while True:
-                    try:
-                        current_urls = []
-                        while not self.queue.empty():
-                            url = self.queue.get()
-                            if url not in self.visited:
-                                current_urls.append(url)
-                        
-                        if not current_urls:
+                    while len(futures) < self.max_workers:
+                        claimed = self.claim_next()
+                        if claimed is None:
                             break
-                        
-                        futures = list(executor.map(self.process_url, current_urls))
-                        
-                    except Exception as e:
-                        safe_print(f"Error in scrape process: {str(e)}")
+                        futures.add(executor.submit(self.process_url, *claimed))
+                    
+                    if not futures:
                         break
+                    
+                    done, futures = wait(futures, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        if future.exception():
+                            self.logger.error("Error in scrape process: %s", future.exception())
+            
+            end_time = time.time()
+            self._log_finished(end_time - start_time)
+            
+            self.save_results()
+            links = sorted(list(self.links))
+            self._close_state(completed=True)
+            return links
+        finally:
+            self.results_writer.close()
+            self._close_state(completed=False)
+            self.mongodb.close()
+            self.logger.info("MongoDB connection closed")
+
+    def scrape_archived(self):
+        """Re-crawl from the archive instead of the network.
+
+        Follows links exactly as scrape() does, over the pages archived by
+        earlier crawls; pages missing from the archive are skipped. Link
+        and page listeners see the replayed pages, so a CrawlPipeline can
+        reconvert a whole site at local disk speed.
+        """
+        if self.archive is None:
+            raise ValueError("No archive to replay, pass one or set CRAWL_ARCHIVE_DIR")
+        archive, self.archive = self.archive, None
+        missing = 0
+        try:
+            self.enqueue([self.start_url], 0)
+            self.budget.start()
+            start_time = time.time()
+            while True:
+                claimed = self.claim_next()
+                if claimed is None:
+                    break
+                url, depth = claimed
+                try:
+                    response = archive.get(url)
+                    if response is None:
+                        missing += 1
+                        continue
+                    self.budget.add_bytes(len(response.body))
+                    html = response.text if document_type(url, response.content_type) == HTML else None
+                    new_links = self.handle_response(url, response.status, response.headers, html)
+                    self.enqueue(new_links, depth + 1)
+                except Exception as e:
+                    self.logger.warning("Error replaying %s: %s (%s)", url, e, type(e).__name__)
+                finally:
+                    self.finish_url(url)
+            
+            end_time = time.time()
+            self._log_finished(end_time - start_time)
+            if missing:
+                self.logger.info("%d linked pages were not in the archive", missing)
+            
+            self.save_results()
+            links = sorted(list(self.links))
+            self._close_state(completed=True)
+            return links
+        finally:
+            self.archive = archive
+            self.results_writer.close()
+            self._close_state(completed=False)
+            self.mongodb.close()
+            self.logger.info("MongoDB connection closed")
+
+    def scrape_async(self):
+        """Crawl with the asyncio engine. Same link scoping and return value as scrape()"""
+        try:
+            self.enqueue([self.start_url], 0)
+            self.budget.start()
+            start_time = time.time()
+            self.seed_from_sitemaps()
+            
+            engine = AsyncCrawlEngine(self, max_in_flight=self.max_in_flight)
+            asyncio.run(engine.run())
             
             end_time = time.time()
-            safe_print(f"[DEBUG] Crawling finished in {end_time - start_time:.2f} seconds. Found {len(self.links)} links")
+            self._log_finished(end_time - start_time)
             
             self.save_results()
-            return sorted(list(self.links))
+            links = sorted(list(self.links))
+            self._close_state(completed=True)
+            return links
         finally:
+            self.results_writer.close()
+            self._close_state(completed=False)
             self.mongodb.close()
-            safe_print("MongoDB connection closed")
\ No newline at end of file
+            self.logger.info("MongoDB connection closed")
@@ -0,0 +1,484 @@
+"""Crawl one site with several processes, on one machine or across nodes.
+
+The frontier lives in MongoDB (crawl_frontier), one document per discovered
+URL. Workers lease batches of pending URLs from the shards they own; a lease
+that is not completed or renewed within the visibility timeout (say, because
+the worker died) is handed out again, to any worker. Workers also register
+their shards with a heartbeat, and an idle worker adopts the shards of one
+whose registration expired. Every worker appends the links it discovered
+first to the same crawl_results document.
+
+    python distributed.py https://www.example.edu/ --processes 4
+
+To add another node to a running crawl, start it with --join, which never
+resets the crawl, and give it a --worker-id that is unique across nodes.
+"""
+import argparse
+import asyncio
+import hashlib
+import logging
+import multiprocessing
+import os
+import socket
+import threading
+import time
+import uuid
+from collections import deque
+from queue import Empty
+from urllib.parse import urlparse
+
+from pymongo import ASCENDING, DESCENDING, UpdateOne
+
+from async_crawler import AsyncCrawlEngine
+from crawl_budget import url_priority
+from crawl_state import url_fingerprint
+from mongoDB_manager import MongoDBManager
+from utils.helper import get_school_abbreviation
+from utils.urls import canonicalize_url
+
+PENDING, LEASED, DONE, FAILED = 0, 1, 2, 3
+
+# 'host' keeps every URL of a host on one worker, so per-host politeness
+# holds exactly; 'url' spreads a single-host site over all workers
+CRAWL_SHARD_BY = os.getenv('CRAWL_SHARD_BY', 'url')
+CRAWL_LEASE_SECONDS = float(os.getenv('CRAWL_LEASE_SECONDS', 120))
+CRAWL_LEASE_BATCH = int(os.getenv('CRAWL_LEASE_BATCH', 32))
+CRAWL_MAX_ATTEMPTS = int(os.getenv('CRAWL_MAX_ATTEMPTS', 3))
+CRAWL_IDLE_POLL = float(os.getenv('CRAWL_IDLE_POLL', 2.0))
+# A worker that has found nothing to crawl for this long, while the crawl is
+# not finished, gives up; rerunning the crawl resumes it
+CRAWL_IDLE_TIMEOUT = float(os.getenv('CRAWL_IDLE_TIMEOUT', 900))
+
+logger = logging.getLogger('crawler.distributed')
+
+def shard_of(url: str, num_shards: int, by: str = CRAWL_SHARD_BY) -> int:
+    key = urlparse(url).netloc if by == 'host' else url
+    digest = hashlib.blake2b(key.encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'big') % num_shards
+
+class DistributedVisited:
+    """Stand-in for the scraper's visited set when the frontier is in MongoDB.
+
+    A URL is handed to exactly one worker by its lease, so nothing needs to
+    be filtered at claim time; unseen() is where links are deduplicated,
+    globally, by inserting them into the frontier.
+    """
+
+    def __init__(self, frontier: 'MongoFrontier'):
+        self._frontier = frontier
+        self._count = 0
+
+    def add(self, url: str):
+        self._count += 1
+
+    def __contains__(self, url: str) -> bool:
+        return False
+
+    def unseen(self, urls) -> list:
+        return self._frontier.discover(urls)
+
+    def __len__(self):
+        return self._count
+
+class MongoFrontier:
+    """Lease-based URL frontier in MongoDB with the MemoryFrontier API the crawl engines use.
+
+    discover() inserts links with one unordered bulk upsert and returns the
+    ones this worker inserted first. pop() leases up to lease_batch URLs at
+    a time from the owned shards, by url_priority and then discovery order,
+    or expired leases from any shard; leases are renewed by a heartbeat
+    thread and released as DONE through complete(), in batches. A worker
+    owning some of the shards registers them; when it runs dry it adopts
+    the shards of workers whose registration was not renewed. Links are inserted before the page they were
+    found on knows their depth, so every URL is popped with depth 0 and a
+    depth budget does not apply.
+    """
+
+    def __init__(self, url: str, worker_id: str = None, shards=None, num_shards: int = None,
+                 shard_by: str = CRAWL_SHARD_BY, lease_seconds: float = CRAWL_LEASE_SECONDS,
+                 lease_batch: int = CRAWL_LEASE_BATCH, max_attempts: int = CRAWL_MAX_ATTEMPTS):
+        self.crawl_id = canonicalize_url(url)
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}"
+        self.shards = list(shards) if shards is not None else None
+        self.shard_by = shard_by
+        self.lease_seconds = lease_seconds
+        self.lease_batch = lease_batch
+        self.max_attempts = max_attempts
+        self.visited = DistributedVisited(self)
+
+        self.mongodb = MongoDBManager()
+        self.mongodb.connect()
+        self.collection = self.mongodb.db[os.getenv('MONGODB_FRONTIER_COLLECTION', 'crawl_frontier')]
+        self.collection.create_index([('crawl', ASCENDING), ('state', ASCENDING), ('shard', ASCENDING),
+                                      ('priority', DESCENDING), ('seq', ASCENDING)])
+        self.collection.create_index([('crawl', ASCENDING), ('owner', ASCENDING), ('state', ASCENDING)])
+        # Joining workers take the shard count the crawl was started with
+        if num_shards is None:
+            meta = self.collection.find_one({'_id': self._meta_id()}) or {}
+            num_shards = meta.get('num_shards', 1)
+        self.num_shards = num_shards
+        if self.shards is not None:
+            self.register(self.worker_id, self.shards)
+
+        # Reentrant: _fill() flushes completions while get_nowait() holds it
+        self._lock = threading.RLock()
+        self._buffer = deque()
+        self._completed = []
+        # Fingerprints this worker already sent to the frontier, to skip the
+        # round trip for links found again on later pages
+        self._known = set()
+        self._stop = threading.Event()
+        self._heartbeat = threading.Thread(target=self._renew_leases, name='frontier-heartbeat',
+                                           daemon=True)
+        self._heartbeat.start()
+
+    def _id(self, fp: int) -> str:
+        return f"{self.crawl_id} {fp:x}"
+
+    def _meta_id(self) -> str:
+        return f"{self.crawl_id} meta"
+
+    def _worker_doc_id(self, worker_id: str) -> str:
+        return f"{self.crawl_id} worker {worker_id}"
+
+    def _owned(self) -> dict:
+        query = {'crawl': self.crawl_id}
+        if self.shards is not None:
+            query['shard'] = {'$in': self.shards}
+        return query
+
+    def register(self, worker_id: str, shards, alive_seconds: float = None):
+        """Record that worker_id owns shards, until alive_seconds (the lease time) from now"""
+        self.collection.update_one(
+            {'_id': self._worker_doc_id(worker_id)},
+            {'$set': {'crawl': self.crawl_id, 'worker': worker_id, 'shards': list(shards),
+                      'alive_until': time.time() + (alive_seconds or self.lease_seconds)}},
+            upsert=True
+        )
+
+    def unregister_all(self):
+        """Forget the workers of an earlier run; live ones register again with their heartbeat"""
+        self.collection.delete_many({'crawl': self.crawl_id, 'worker': {'$exists': True}})
+
+    def _adopt_orphans(self) -> bool:
+        """Take over the shards of workers whose registration expired. Returns True if any were adopted"""
+        adopted = []
+        for doc in self.collection.find({'crawl': self.crawl_id, 'worker': {'$ne': self.worker_id},
+                                         'alive_until': {'$lt': time.time()}}):
+            # Deleting the registration decides which of the idle workers adopts it
+            if self.collection.find_one_and_delete({'_id': doc['_id'], 'alive_until': doc['alive_until']}):
+                adopted.extend(shard for shard in doc['shards'] if shard not in self.shards)
+                logger.warning("Worker %s adopted shards %s of unresponsive worker %s",
+                               self.worker_id, doc['shards'], doc['worker'])
+        if not adopted:
+            return False
+        self.shards.extend(adopted)
+        self.register(self.worker_id, self.shards)
+        return True
+
+    def discover(self, urls) -> list:
+        """Add URLs to the frontier. Returns, in order, those no worker had added before"""
+        keyed = []
+        with self._lock:
+            for url in urls:
+                fp = url_fingerprint(url)
+                if fp not in self._known:
+                    self._known.add(fp)
+                    keyed.append((url, fp))
+        if not keyed:
+            return []
+
+        now = time.time()
+        operations = [
+            UpdateOne({'_id': self._id(fp)}, {'$setOnInsert': {
+                'crawl': self.crawl_id,
+                'url': url,
+                'shard': shard_of(url, self.num_shards, self.shard_by),
+                'state': PENDING,
+                'attempts': 0,
+                'priority': url_priority(url),
+                'seq': now,
+                'discovered_by': self.worker_id
+            }}, upsert=True)
+            for url, fp in keyed
+        ]
+        result = self.collection.bulk_write(operations, ordered=False)
+        inserted = set(result.upserted_ids.values())
+        return [url for url, fp in keyed if self._id(fp) in inserted]
+
+    def put(self, url: str, depth: int = 0, priority: int = 0):
+        self.discover([url])
+
+    def _claimable(self, now: float) -> dict:
+        # Pending URLs of the owned shards, and expired leases of any shard,
+        # which a dead worker would otherwise keep
+        return {'crawl': self.crawl_id, '$or': [
+            {**self._owned(), 'state': PENDING},
+            {'state': LEASED, 'lease_until': {'$lt': now}, 'attempts': {'$lt': self.max_attempts}}
+        ]}
+
+    def _candidates(self, now: float) -> list:
+        return [doc['_id'] for doc in self.collection.find(
+            self._claimable(now), {'_id': 1}
+        ).sort([('priority', DESCENDING), ('seq', ASCENDING)]).limit(self.lease_batch)]
+
+    def _fill(self):
+        """Lease the next batch: pick candidates, claim them with a token, read back what was won"""
+        self.flush()
+        now = time.time()
+        candidates = self._candidates(now)
+        if not candidates and self.shards is not None and self._adopt_orphans():
+            candidates = self._candidates(now)
+        if not candidates:
+            return
+        token = uuid.uuid4().hex
+        query = self._claimable(now)
+        query['_id'] = {'$in': candidates}
+        # The filter is re-checked per document, so two workers racing for
+        # the same candidates each win a disjoint subset
+        self.collection.update_many(query, {
+            '$set': {'state': LEASED, 'owner': self.worker_id, 'token': token,
+                     'lease_until': now + self.lease_seconds},
+            '$inc': {'attempts': 1}
+        })
+        leased = self.collection.find({'crawl': self.crawl_id, 'token': token}, {'url': 1})
+        self._buffer.extend(doc['url'] for doc in leased)
+
+    def pop(self) -> tuple:
+        with self._lock:
+            if not self._buffer:
+                self._fill()
+            if not self._buffer:
+                raise Empty
+            return self._buffer.popleft(), 0
+
+    def get_nowait(self) -> str:
+        return self.pop()[0]
+
+    def get(self, block=True, timeout=None) -> str:
+        return self.get_nowait()
+
+    def empty(self) -> bool:
+        with self._lock:
+            if not self._buffer:
+                self._fill()
+            return not self._buffer
+
+    def qsize(self) -> int:
+        with self._lock:
+            buffered = len(self._buffer)
+        return buffered + self.collection.count_documents({**self._owned(), 'state': PENDING})
+
+    def complete(self, url: str):
+        """Mark a leased URL finished, written with the next lease or heartbeat"""
+        with self._lock:
+            self._completed.append(url)
+
+    def flush(self):
+        with self._lock:
+            completed, self._completed = self._completed, []
+        if completed:
+            self.collection.bulk_write([
+                UpdateOne({'_id': self._id(url_fingerprint(url)), 'owner': self.worker_id},
+                          {'$set': {'state': DONE}, '$unset': {'token': ''}})
+                for url in completed
+            ], ordered=False)
+
+    def _renew_leases(self):
+        while not self._stop.wait(self.lease_seconds / 3):
+            try:
+                self.flush()
+                if self.shards is not None:
+                    self.register(self.worker_id, self.shards)
+                self.collection.update_many(
+                    {'crawl': self.crawl_id, 'owner': self.worker_id, 'state': LEASED},
+                    {'$set': {'lease_until': time.time() + self.lease_seconds}}
+                )
+            except Exception as e:
+                logger.warning("Could not renew frontier leases: %s", e)
+
+    def finished(self) -> bool:
+        """True once no URL of the crawl, in any shard, is pending or leased"""
+        self.flush()
+        # URLs whose lease ran out max_attempts times are given up on
+        self.collection.update_many(
+            {'crawl': self.crawl_id, 'state': LEASED, 'lease_until': {'$lt': time.time()},
+             'attempts': {'$gte': self.max_attempts}},
+            {'$set': {'state': FAILED}}
+        )
+        return not self.collection.find_one({'crawl': self.crawl_id, 'state': {'$in': [PENDING, LEASED]}},
+                                            {'_id': 1})
+
+    def is_resumed(self) -> bool:
+        """True when an unfinished crawl of this URL is already in the frontier"""
+        return bool(self.collection.find_one({'crawl': self.crawl_id, 'state': {'$in': [PENDING, LEASED]}},
+                                             {'_id': 1}))
+
+    def reset(self):
+        """Drop everything left from an earlier crawl of this URL"""
+        self.collection.delete_many({'crawl': self.crawl_id})
+        self.collection.insert_one({'_id': self._meta_id(), 'crawl': self.crawl_id,
+                                    'num_shards': self.num_shards, 'shard_by': self.shard_by})
+        with self._lock:
+            self._known.clear()
+            self._buffer.clear()
+
+    def close(self, remove: bool = False):
+        self._stop.set()
+        self._heartbeat.join()
+        self.flush()
+        if remove:
+            self.collection.delete_many({'crawl': self.crawl_id})
+        self.mongodb.close()
+
+def prepare_crawl(url: str, num_shards: int, workers: dict = None) -> tuple:
+    """Reset and seed the frontier and crawl_results for a new crawl, and
+    register workers (worker id -> shards) so their shards are adopted if
+    one never starts.
+
+    Returns (resumed, num_shards): a resumed crawl keeps the shard count
+    it was started with, whatever num_shards is.
+    """
+    # Without num_shards, the frontier reads the stored one
+    frontier = MongoFrontier(url, worker_id='coordinator')
+    try:
+        resumed = frontier.is_resumed()
+        if resumed:
+            logger.info("Resuming distributed crawl of %s with its %d shards", url, frontier.num_shards)
+            frontier.unregister_all()
+        else:
+            frontier.num_shards = num_shards
+            frontier.reset()
+            frontier.mongodb.reset_crawl_results(url, get_school_abbreviation(url))
+            frontier.put(canonicalize_url(url))
+        for worker_id, shards in (workers(frontier.num_shards) if workers else {}).items():
+            # Longer than a lease, so spawned processes have time to start
+            frontier.register(worker_id, shards, alive_seconds=2 * frontier.lease_seconds)
+        return resumed, frontier.num_shards
+    finally:
+        frontier.close()
+
+def run_worker(url: str, worker_id: str = None, shards=None, num_shards: int = None,
+               max_in_flight: int = None, incremental: bool = False):
+    """Crawl leased URLs until the whole crawl, in every shard, is finished,
+    or until nothing was claimable for CRAWL_IDLE_TIMEOUT seconds"""
+    from crawler import WebScraper
+
+    frontier = MongoFrontier(url, worker_id, shards, num_shards)
+    scraper = WebScraper(url, frontier=frontier, incremental=incremental)
+    scraper.done_listeners.append(frontier.complete)
+    try:
+        engine = AsyncCrawlEngine(scraper, max_in_flight=max_in_flight or scraper.max_in_flight)
+        idle_since = time.monotonic()
+        while True:
+            # Returns once nothing is claimable; other workers may still
+            # be discovering links for our shards
+            visited = len(scraper.visited)
+            asyncio.run(engine.run())
+            if frontier.finished():
+                break
+            if len(scraper.visited) > visited:
+                idle_since = time.monotonic()
+            elif time.monotonic() - idle_since > CRAWL_IDLE_TIMEOUT:
+                logger.warning("Worker %s found nothing to crawl for %.0f seconds, giving up on an "
+                               "unfinished crawl", frontier.worker_id, CRAWL_IDLE_TIMEOUT)
+                break
+            time.sleep(CRAWL_IDLE_POLL)
+        scraper.save_results()
+        logger.info("Worker %s finished: %d pages, %d links found first",
+                    frontier.worker_id, len(scraper.visited), len(scraper.links))
+    finally:
+        scraper.results_writer.close()
+        frontier.close()
+        scraper.mongodb.close()
+
+def _worker_main(url, worker_id, shards, num_shards, environment, incremental):
+    os.environ.update(environment)
+    logging.basicConfig(level=os.getenv('LOG_LEVEL', 'INFO').upper(),
+                        format='%(asctime)s %(levelname)s %(processName)s %(name)s: %(message)s')
+    run_worker(url, worker_id, shards, num_shards, incremental=incremental)
+
+def crawl_distributed(url: str, processes: int = 4, num_shards: int = None, incremental: bool = False) -> list:
+    """
+    Crawl url with several local worker processes and return the merged links
+
+    Args:
+        url (str): Start URL
+        processes (int): Worker processes, each owning num_shards / processes shards
+        num_shards (int): Frontier shards, fixed for the life of the crawl (a
+            resumed crawl keeps its own). More shards than processes lets
+            nodes that --join later take some over
+        incremental (bool): Skip pages unchanged since the last crawl, see WebScraper.
+            Crawl budgets are not supported: pages and bytes are counted per
+            process and the shared frontier does not track link depth
+
+    Returns:
+        list: Sorted links from the crawl_results document
+    """
+    prefix = f"{socket.gethostname()}:{os.getpid()}"
+
+    def assign(shard_count):
+        # A worker per shard at most; a worker that owns none would only wait
+        count = min(processes, shard_count)
+        return {f"{prefix}:{index}": list(range(index, shard_count, count)) for index in range(count)}
+
+    resumed, num_shards = prepare_crawl(url, num_shards or processes, assign)
+    assignments = assign(num_shards)
+    processes = len(assignments)
+    environment = {}
+    if CRAWL_SHARD_BY == 'url':
+        # Every process crawls the same hosts, so split the per-host rate
+        rate = float(os.getenv('CRAWLER_HOST_RATE', 4.0)) / processes
+        environment['CRAWLER_HOST_RATE'] = str(rate)
+        environment['CRAWLER_HOST_BURST'] = str(max(1, int(os.getenv('CRAWLER_HOST_BURST', 8)) // processes))
+
+    start_time = time.time()
+    context = multiprocessing.get_context('spawn')
+    workers = []
+    for index, (worker_id, shards) in enumerate(assignments.items()):
+        worker = context.Process(
+            target=_worker_main, name=f"crawl-worker-{index}",
+            args=(url, worker_id, shards, num_shards, environment, incremental)
+        )
+        worker.start()
+        workers.append(worker)
+    for worker in workers:
+        worker.join()
+
+    frontier = MongoFrontier(url, worker_id='coordinator', num_shards=num_shards)
+    try:
+        finished = frontier.finished()
+        document = frontier.mongodb.collection.find_one({'url': url}, {'links': 1}) or {}
+        links = sorted(document.get('links', []))
+    finally:
+        frontier.close(remove=finished)
+    if not finished:
+        raise RuntimeError(f"Distributed crawl of {url} stopped before finishing, rerun to resume")
+    logger.info("Distributed crawl of %s%s finished in %.2f seconds with %d processes: %d links",
+                url, ' (resumed)' if resumed else '', time.time() - start_time, processes, len(links))
+    return links
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('url')
+    parser.add_argument('--processes', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--shards', type=int, help='frontier shards, defaults to --processes')
+    parser.add_argument('--join', action='store_true',
+                        help='work on an existing crawl instead of starting one')
+    parser.add_argument('--owned-shards', help='comma separated shards for --join, default all')
+    parser.add_argument('--worker-id')
+    parser.add_argument('--incremental', action='store_true', help='skip pages unchanged since the last crawl')
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=os.getenv('LOG_LEVEL', 'INFO').upper(),
+                        format='%(asctime)s %(levelname)s %(processName)s %(name)s: %(message)s')
+
+    if args.join:
+        owned = [int(shard) for shard in args.owned_shards.split(',')] if args.owned_shards else None
+        run_worker(args.url, args.worker_id, owned, args.shards, incremental=args.incremental)
+        return
+    links = crawl_distributed(args.url, args.processes, args.shards, incremental=args.incremental)
+    print(f"{len(links)} links")
+
+if __name__ == '__main__':
+    main()
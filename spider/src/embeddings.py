@@ -0,0 +1,179 @@
+import hashlib
+import logging
+import os
+import re
+import threading
+
+import numpy as np
+
+# 'auto' tries fastembed, then sentence-transformers, then the hashing embedder
+EMBEDDER = os.getenv('EMBEDDER', 'auto')
+# Multilingual, since most admission pages are in Chinese; both backends support it
+EMBEDDING_MODEL = os.getenv('EMBEDDING_MODEL', 'sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2')
+EMBEDDING_BATCH_SIZE = int(os.getenv('EMBEDDING_BATCH_SIZE', 64))
+CHUNK_MAX_CHARS = int(os.getenv('CHUNK_MAX_CHARS', 1500))
+CHUNK_OVERLAP = int(os.getenv('CHUNK_OVERLAP', 200))
+
+logger = logging.getLogger('embeddings')
+
+_HEADING = re.compile(r'^(#{1,6})\s+(.*\S)\s*$')
+_CJK = '\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff'
+# Words, but each CJK character on its own: CJK text has no spaces to split on
+_TOKEN = re.compile(f'[{_CJK}]|[^\\W{_CJK}]+')
+
+class FastEmbedEmbedder:
+    """ONNX sentence embeddings on CPU with fastembed"""
+
+    def __init__(self, model_name: str = EMBEDDING_MODEL, batch_size: int = EMBEDDING_BATCH_SIZE):
+        from fastembed import TextEmbedding
+
+        self.name = f"fastembed:{model_name}"
+        self.batch_size = batch_size
+        self._model = TextEmbedding(model_name=model_name)
+        self.dimension = len(next(iter(self._model.embed(['dimension probe']))))
+
+    def embed(self, texts) -> list:
+        return [vector.tolist() for vector in self._model.embed(list(texts), batch_size=self.batch_size)]
+
+class SentenceTransformerEmbedder:
+    """sentence-transformers models, for when torch is already installed"""
+
+    def __init__(self, model_name: str = EMBEDDING_MODEL, batch_size: int = EMBEDDING_BATCH_SIZE):
+        from sentence_transformers import SentenceTransformer
+
+        self.name = f"sentence-transformers:{model_name}"
+        self.batch_size = batch_size
+        self._model = SentenceTransformer(model_name, device='cpu')
+        self.dimension = self._model.get_sentence_embedding_dimension()
+
+    def embed(self, texts) -> list:
+        vectors = self._model.encode(list(texts), batch_size=self.batch_size,
+                                     normalize_embeddings=True, show_progress_bar=False)
+        return vectors.tolist()
+
+class HashingEmbedder:
+    """Dependency-free fallback: hashed word and bigram counts, L2 normalised.
+
+    CJK text is split into characters, so its bigrams are character bigrams.
+
+    Only captures lexical overlap, but needs no model download and is
+    deterministic, so search keeps working where no model is installed.
+    """
+
+    def __init__(self, dimension: int = 512):
+        self.name = f"hashing:{dimension}"
+        self.dimension = dimension
+
+    def _bucket(self, token: str) -> int:
+        digest = hashlib.blake2b(token.encode('utf-8'), digest_size=8).digest()
+        return int.from_bytes(digest, 'little')
+
+    def embed(self, texts) -> list:
+        texts = list(texts)
+        vectors = np.zeros((len(texts), self.dimension), dtype=np.float32)
+        for row, text in enumerate(texts):
+            tokens = _TOKEN.findall(text.lower())
+            for token in tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]:
+                bucket = self._bucket(token)
+                # The top bit picks the sign so collisions cancel out on average
+                vectors[row, bucket % self.dimension] += 1.0 if bucket >> 63 else -1.0
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return (vectors / norms).tolist()
+
+_embedder = None
+_embedder_lock = threading.Lock()
+
+def get_embedder(kind: str = None):
+    """Process-wide embedder, loaded once. kind is fastembed, sentence-transformers, hashing or auto"""
+    global _embedder
+    with _embedder_lock:
+        if _embedder is not None and kind is None:
+            return _embedder
+
+        kind = kind or EMBEDDER
+        factories = {
+            'fastembed': FastEmbedEmbedder,
+            'sentence-transformers': SentenceTransformerEmbedder,
+            'hashing': HashingEmbedder
+        }
+        if kind == 'auto':
+            candidates = ['fastembed', 'sentence-transformers']
+        else:
+            candidates = [kind]
+
+        embedder = None
+        for candidate in candidates:
+            try:
+                embedder = factories[candidate]()
+                break
+            except ImportError:
+                continue
+            except Exception as e:
+                # Installed but unusable, e.g. the model could not be downloaded
+                if kind != 'auto':
+                    raise
+                logger.warning("Could not load %s embedder: %s", candidate, e)
+        if embedder is None:
+            if kind not in ('auto', 'hashing'):
+                raise ImportError(f"Embedder '{kind}' is not installed")
+            if kind == 'auto':
+                logger.warning("No embedding model available, falling back to the hashing embedder")
+            embedder = HashingEmbedder()
+
+        _embedder = embedder
+        logger.info("Using %s embeddings (%d dimensions)", embedder.name, embedder.dimension)
+        return embedder
+
+def chunk_markdown(text: str, max_chars: int = CHUNK_MAX_CHARS, overlap: int = CHUNK_OVERLAP) -> list:
+    """
+    Split markdown into retrieval chunks along headings and paragraphs
+
+    Paragraphs are packed into chunks of up to max_chars under the heading
+    they belong to; a paragraph longer than that is cut with overlap
+    characters repeated between the pieces.
+
+    Args:
+        text (str): Markdown content
+        max_chars (int): Upper bound on the chunk text length
+        overlap (int): Characters shared by consecutive pieces of a long paragraph
+
+    Returns:
+        list: (heading, chunk_text) tuples in document order
+    """
+    chunks = []
+    heading = ''
+    parts = []
+    size = 0
+
+    def flush():
+        nonlocal parts, size
+        if parts:
+            chunks.append((heading, '\n\n'.join(parts)))
+        parts = []
+        size = 0
+
+    for block in re.split(r'\n\s*\n', text):
+        block = block.strip()
+        if not block:
+            continue
+        match = _HEADING.match(block.split('\n', 1)[0])
+        if match:
+            flush()
+            heading = match.group(2)
+
+        if len(block) > max_chars:
+            flush()
+            step = max(1, max_chars - overlap)
+            for start in range(0, len(block), step):
+                chunks.append((heading, block[start:start + max_chars]))
+                if start + max_chars >= len(block):
+                    break
+            continue
+
+        if size and size + len(block) + 2 > max_chars:
+            flush()
+        parts.append(block)
+        size += len(block) + 2
+    flush()
+    return chunks
@@ -0,0 +1,69 @@
+import io
+import re
+import threading
+
+from markitdown import MarkItDown, StreamInfo
+
+# Below this much visible text a page is probably rendered client side
+MIN_VISIBLE_TEXT = 200
+
+_SCRIPT_OR_STYLE = re.compile(r'<(script|style|noscript|template)\b.*?</\1\s*>', re.I | re.S)
+_TAG = re.compile(r'<[^>]+>')
+_WHITESPACE = re.compile(r'\s+')
+_EMPTY_APP_ROOT = re.compile(
+    r'<div[^>]+id\s*=\s*["\']?(root|app|__next|__nuxt)["\']?[^>]*>\s*</div>', re.I
+)
+_JS_REQUIRED = re.compile(
+    r'<noscript[^>]*>[^<]*(enable|requires?|turn on)\s+javascript', re.I
+)
+_SCRIPT_TAG = re.compile(r'<script\b', re.I)
+_FRAMEWORK_MARKERS = re.compile(r'\bng-app\b|\bdata-reactroot\b|\bdata-server-rendered\b', re.I)
+
+def visible_text_length(html: str) -> int:
+    """Rough length of the text a reader would see, without scripts, styles and tags"""
+    text = _SCRIPT_OR_STYLE.sub(' ', html)
+    text = _TAG.sub(' ', text)
+    return len(_WHITESPACE.sub(' ', text).strip())
+
+def needs_rendering(html: str) -> bool:
+    """Heuristic: does this page need a browser to produce its content?
+
+    True for single-page-app shells (an empty root/app mount point or a
+    "please enable JavaScript" notice) and for pages with almost no static
+    text. Server-rendered framework pages with real text are converted
+    in process.
+    """
+    text_length = visible_text_length(html)
+    if text_length >= MIN_VISIBLE_TEXT:
+        return False
+    if _EMPTY_APP_ROOT.search(html) or _JS_REQUIRED.search(html):
+        return True
+    if _FRAMEWORK_MARKERS.search(html):
+        return True
+    # Script-driven page with next to no static text
+    return text_length < MIN_VISIBLE_TEXT // 4 and _SCRIPT_TAG.search(html) is not None
+
+class HTMLConverter:
+    """Converts already-fetched HTML to markdown in process with MarkItDown"""
+
+    def __init__(self):
+        self._local = threading.local()
+
+    def _markitdown(self) -> MarkItDown:
+        # One instance per thread, conversion workers don't share state
+        converter = getattr(self._local, 'markitdown', None)
+        if converter is None:
+            converter = MarkItDown()
+            self._local.markitdown = converter
+        return converter
+
+    def convert(self, html, url: str = None) -> str:
+        """Convert HTML (str, or bytes in UTF-8) to markdown"""
+        if isinstance(html, str):
+            html = html.encode('utf-8')
+        result = self._markitdown().convert_stream(
+            io.BytesIO(html),
+            stream_info=StreamInfo(extension='.html', mimetype='text/html',
+                                   charset='utf-8', url=url)
+        )
+        return result.text_content
@@ -0,0 +1,147 @@
+import queue
+import threading
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+
+from utils import safe_print
+
+class QueueFullError(Exception):
+    """Raised when the job queue has no room for another request"""
+
+class Job:
+    def __init__(self, url: str, options: dict = None):
+        self.id = uuid.uuid4().hex
+        self.url = url
+        self.options = options or {}
+        self.status = 'queued'
+        self.error = None
+        self.result = None
+        self.created_at = datetime.now()
+        self.started_at = None
+        self.finished_at = None
+        # Set by the handler so progress can be read while the job runs
+        self.scraper = None
+        self.pipeline = None
+        # Optional metrics.Tracer / SamplingProfiler, kept after the job finishes
+        self.tracer = None
+        self.profiler = None
+
+    def progress(self) -> dict:
+        """Live crawl (and pipeline) counters, read from the job's scraper"""
+        scraper = self.scraper
+        if scraper is None:
+            return {}
+        try:
+            progress = {
+                'pages_visited': len(scraper.visited),
+                'links_found': len(scraper.links),
+                'queued': scraper.queue.qsize(),
+                'in_flight': len(scraper.in_flight),
+                'budget': scraper.budget.to_dict()
+            }
+        except Exception:
+            # The crawl state may already be closed
+            return {}
+        if self.pipeline is not None:
+            progress.update(self.pipeline.stats())
+        return progress
+
+    def to_dict(self) -> dict:
+        return {
+            'job_id': self.id,
+            'url': self.url,
+            'status': self.status,
+            'error': self.error,
+            'result': self.result,
+            'progress': self.progress(),
+            'trace_spans': len(self.tracer.spans) if self.tracer else None,
+            'profile_samples': self.profiler.samples if self.profiler else None,
+            'created_at': self.created_at.isoformat(),
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None
+        }
+
+class JobManager:
+    """Bounded job queue served by a fixed pool of worker threads.
+
+    submit() deduplicates requests for a URL that is already queued or
+    running and raises QueueFullError when max_queue jobs are waiting, so
+    callers can push back instead of spawning unbounded work. Finished jobs
+    are kept (up to max_history) for status lookups.
+    """
+
+    def __init__(self, handler, max_workers: int = 2, max_queue: int = 20,
+                 max_history: int = 1000):
+        self.handler = handler
+        self.max_history = max_history
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._jobs = OrderedDict()
+        self._active = {}
+        self._lock = threading.Lock()
+        self._workers = []
+        for i in range(max_workers):
+            worker = threading.Thread(target=self._run, name=f"scrape-worker-{i}", daemon=True)
+            worker.start()
+            self._workers.append(worker)
+
+    def submit(self, url: str, options: dict = None):
+        """Queue a job for url. Returns (job, created); created is False for a duplicate"""
+        with self._lock:
+            active = self._active.get(url)
+            if active is not None:
+                return active, False
+
+            job = Job(url, options)
+            try:
+                self._queue.put_nowait(job)
+            except queue.Full:
+                raise QueueFullError(f"Job queue is full ({self._queue.maxsize} pending)")
+
+            self._active[url] = job
+            self._jobs[job.id] = job
+            self._prune()
+            return job, True
+
+    def get(self, job_id: str):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def running_jobs(self) -> list:
+        with self._lock:
+            return [job for job in self._active.values() if job.status == 'running']
+
+    def stats(self) -> dict:
+        with self._lock:
+            running = sum(1 for job in self._active.values() if job.status == 'running')
+            return {
+                'queued': self._queue.qsize(),
+                'running': running,
+                'workers': len(self._workers)
+            }
+
+    def _prune(self):
+        finished = [job_id for job_id, job in self._jobs.items()
+                    if job.status in ('succeeded', 'failed')]
+        for job_id in finished[:max(0, len(self._jobs) - self.max_history)]:
+            del self._jobs[job_id]
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            job.status = 'running'
+            job.started_at = datetime.now()
+            try:
+                job.result = self.handler(job)
+                job.status = 'succeeded'
+            except Exception as e:
+                safe_print(f"Job {job.id} for {job.url} failed: {str(e)}")
+                job.error = str(e)
+                job.status = 'failed'
+            finally:
+                job.finished_at = datetime.now()
+                job.scraper = None
+                job.pipeline = None
+                with self._lock:
+                    self._active.pop(job.url, None)
+                self._queue.task_done()
@@ -0,0 +1,78 @@
+import html as html_lib
+import logging
+import re
+from urllib.parse import urljoin, urlsplit
+
+from utils.urls import canonicalize_url
+
+# Anchor hrefs (double, single or unquoted); comments are matched so their
+# contents can be skipped. href must follow whitespace, so data-href and
+# ng-href attributes are not taken for it
+_ANCHOR_HREF = re.compile(
+    r'<!--.*?-->|<a\s(?:[^>]*?\s)?href\s*=\s*(?:"([^"]*)"|\'([^\']*)\'|([^\s"\'>]+))',
+    re.I | re.S
+)
+_BASE_HREF = re.compile(r'<base\s(?:[^>]*?\s)?href\s*=\s*["\']?([^"\'\s>]+)', re.I)
+_NON_PAGE_SCHEMES = ('javascript:', 'mailto:', 'tel:', 'data:', 'ftp:', '#')
+
+class LinkExtractor:
+    """Extracts in-scope links from a page without building a DOM.
+
+    hrefs are pulled out with a single regex pass, deduplicated before they
+    are resolved and canonicalized, and matched against a scope pattern
+    compiled once per crawl (same domain with or without www., under the
+    start URL's path). Visited filtering is done for the whole page at once.
+    """
+
+    def __init__(self, start_url: str):
+        parsed = urlsplit(canonicalize_url(start_url))
+        self.domain = parsed.netloc[4:] if parsed.netloc.startswith('www.') else parsed.netloc
+        self.scope_path = parsed.path
+        self._in_scope = re.compile(
+            r'https?://(?:www\.)?' + re.escape(self.domain) + re.escape(self.scope_path)
+        ).match
+        self.logger = logging.getLogger('crawler.LinkExtractor')
+
+    def hrefs(self, html: str) -> list:
+        """Distinct raw href values of the page's anchors, in document order"""
+        found = {}
+        for match in _ANCHOR_HREF.finditer(html):
+            href = match.group(1) or match.group(2) or match.group(3)
+            if href:
+                found[href.strip()] = None
+        return list(found)
+
+    def in_scope(self, url: str) -> bool:
+        """True for canonical URLs on the crawl's domain and under its start path"""
+        return self._in_scope(url) is not None
+
+    def extract(self, page_url: str, html: str, visited=None) -> list:
+        """Return canonical in-scope links found on a page, without those in visited"""
+        base_match = _BASE_HREF.search(html)
+        base_url = urljoin(page_url, base_match.group(1)) if base_match else page_url
+        base_parts = urlsplit(base_url)
+        origin = f"{base_parts.scheme}://{base_parts.netloc}"
+
+        raw_links = self.hrefs(html)
+        found = {}
+        for href in raw_links:
+            if href.lower().startswith(_NON_PAGE_SCHEMES):
+                continue
+            if '&' in href:
+                href = html_lib.unescape(href)
+            # Absolute and root-relative hrefs (the common case) need no urljoin
+            if href.startswith(('http://', 'https://')) and '/.' not in href:
+                absolute = href
+            elif href.startswith('/') and not href.startswith('//') and '/.' not in href:
+                absolute = origin + href
+            else:
+                absolute = urljoin(base_url, href)
+            url = canonicalize_url(absolute)
+            if self._in_scope(url):
+                found[url] = None
+
+        links = list(found)
+        if visited is not None and links:
+            links = visited.unseen(links)
+        self.logger.debug("%d raw, %d in-scope new links on %s", len(raw_links), len(links), page_url)
+        return links
@@ -0,0 +1,360 @@
+import bisect
+import contextlib
+import math
+import os
+import sys
+import threading
+import time
+from collections import Counter as _Counter, deque
+
+from pymongo import monitoring
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+def _format_labels(names, values, extra=()) -> str:
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+               for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name: str, documentation: str, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict) -> tuple:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._samples())
+        return lines
+
+class Counter(_Metric):
+    """Monotonically increasing count"""
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._values = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def _samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+                for key, value in items]
+
+class Gauge(_Metric):
+    """Value that goes up and down, set directly or read from callbacks at scrape time"""
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._values = {}
+        self._callbacks = []
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def set_function(self, callback):
+        """Read values from callback() on every scrape.
+
+        The callback returns a number (for a gauge without labels) or a dict
+        mapping label value tuples to numbers; callback values are added to
+        directly set ones.
+        """
+        with self._lock:
+            self._callbacks.append(callback)
+
+    def _samples(self):
+        with self._lock:
+            values = dict(self._values)
+            callbacks = list(self._callbacks)
+        for callback in callbacks:
+            try:
+                result = callback()
+            except Exception:
+                continue
+            if not isinstance(result, dict):
+                result = {(): result}
+            for key, value in result.items():
+                key = key if isinstance(key, tuple) else (key,)
+                values[key] = values.get(key, 0) + value
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+                for key, value in sorted(values.items())]
+
+class Histogram(_Metric):
+    """Bucketed observations with sum and count"""
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    @contextlib.contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def _samples(self):
+        with self._lock:
+            items = sorted((key, (list(state[0]), state[1], state[2])) for key, state in self._values.items())
+        lines = []
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (math.inf,), counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.labelnames, key, [('le', _format_value(bound))])
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {count}")
+        return lines
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labelnames=()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()) -> Gauge:
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text exposition format"""
+        with self._lock:
+            metrics = list(self._metrics)
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+REGISTRY = Registry()
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+STAGE_SECONDS = REGISTRY.histogram(
+    'spider_stage_seconds', 'Time spent per processing stage', ('stage',))
+STAGE_TOTAL = REGISTRY.counter(
+    'spider_stage_total', 'Stage executions by outcome', ('stage', 'outcome'))
+PAGES_FETCHED = REGISTRY.counter(
+    'spider_pages_fetched_total', 'HTTP responses received by the crawler', ('engine', 'status'))
+IN_FLIGHT = REGISTRY.gauge(
+    'spider_in_flight_requests', 'Crawler requests currently in flight', ('engine',))
+QUEUE_DEPTH = REGISTRY.gauge(
+    'spider_queue_depth', 'Items waiting in internal queues', ('queue',))
+DB_ROUND_TRIPS = REGISTRY.counter(
+    'spider_db_round_trips_total', 'MongoDB commands and Qdrant requests', ('db', 'operation', 'outcome'))
+DB_SECONDS = REGISTRY.histogram(
+    'spider_db_seconds', 'MongoDB command and Qdrant request latency', ('db',))
+RESPONSE_KINDS = REGISTRY.counter(
+    'spider_response_kinds_total', 'Fetched responses by detected content kind', ('kind',))
+BODIES_SKIPPED = REGISTRY.counter(
+    'spider_bodies_skipped_total', 'Response bodies not downloaded, or cut short, by the crawler', ('reason',))
+WEBHOOK_DELIVERIES = REGISTRY.counter(
+    'spider_webhook_deliveries_total', 'Webhook delivery attempts by outcome', ('outcome',))
+
+@contextlib.contextmanager
+def stage(name: str, tracer=None, url: str = None, **attributes):
+    """Time a stage into STAGE_SECONDS/STAGE_TOTAL, and into a trace span when a tracer is given"""
+    start = time.perf_counter()
+    outcome = 'ok'
+    span = tracer.span(name, url, **attributes) if tracer is not None else contextlib.nullcontext()
+    try:
+        with span:
+            yield
+    except BaseException:
+        outcome = 'error'
+        raise
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - start, stage=name)
+        STAGE_TOTAL.inc(stage=name, outcome=outcome)
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    """pymongo command listener counting round trips and their latency"""
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        DB_ROUND_TRIPS.inc(db='mongo', operation=event.command_name, outcome='ok')
+        DB_SECONDS.observe(event.duration_micros / 1e6, db='mongo')
+
+    def failed(self, event):
+        DB_ROUND_TRIPS.inc(db='mongo', operation=event.command_name, outcome='error')
+        DB_SECONDS.observe(event.duration_micros / 1e6, db='mongo')
+
+class InstrumentedClient:
+    """Wraps a client object, counting and timing every method call as a round trip"""
+
+    def __init__(self, client, db: str):
+        self._client = client
+        self._db = db
+
+    def __getattr__(self, name):
+        attribute = getattr(self._client, name)
+        if not callable(attribute):
+            return attribute
+
+        def call(*args, **kwargs):
+            start = time.perf_counter()
+            outcome = 'ok'
+            try:
+                return attribute(*args, **kwargs)
+            except Exception:
+                outcome = 'error'
+                raise
+            finally:
+                DB_ROUND_TRIPS.inc(db=self._db, operation=name, outcome=outcome)
+                DB_SECONDS.observe(time.perf_counter() - start, db=self._db)
+        return call
+
+class Tracer:
+    """Per-job trace spans, kept in a bounded buffer"""
+
+    def __init__(self, max_spans: int = 20000):
+        self.spans = deque(maxlen=max_spans)
+        self._origin = time.time() - time.perf_counter()
+
+    @contextlib.contextmanager
+    def span(self, name: str, url: str = None, **attributes):
+        start = time.perf_counter()
+        error = None
+        try:
+            yield
+        except BaseException as e:
+            error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            record = {
+                'name': name,
+                'url': url,
+                'start': round(self._origin + start, 6),
+                'duration_ms': round((time.perf_counter() - start) * 1000, 3),
+                'thread': threading.current_thread().name
+            }
+            if attributes:
+                record['attributes'] = attributes
+            if error:
+                record['error'] = error
+            self.spans.append(record)
+
+    def to_list(self) -> list:
+        return list(self.spans)
+
+class SamplingProfiler:
+    """Samples every thread's stack at a fixed interval, collecting collapsed stacks.
+
+    The output (`frame;frame;frame count` lines) can be fed to flamegraph
+    tools. Samples cover all threads in the process, not only those of the
+    job that turned profiling on.
+    """
+
+    def __init__(self, interval: float = float(os.getenv('PROFILER_INTERVAL', 0.01)), max_depth: int = 64):
+        self.interval = interval
+        self.max_depth = max_depth
+        self.samples = 0
+        self._stacks = _Counter()
+        # Held while the sampler adds stacks, so readers can copy them
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _collapse(self, frame) -> str:
+        frames = []
+        while frame is not None and len(frames) < self.max_depth:
+            code = frame.f_code
+            frames.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+            frame = frame.f_back
+        return ';'.join(reversed(frames))
+
+    def _run(self):
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            stacks = [self._collapse(frame) for thread_id, frame in sys._current_frames().items()
+                      if thread_id != own_id]
+            with self._lock:
+                self._stacks.update(stacks)
+                self.samples += 1
+
+    def start(self) -> 'SamplingProfiler':
+        self._thread = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _snapshot(self) -> _Counter:
+        with self._lock:
+            return _Counter(self._stacks)
+
+    def collapsed(self) -> str:
+        return '\n'.join(f"{stack} {count}" for stack, count in self._snapshot().most_common()) + '\n'
+
+    def top(self, limit: int = 20) -> list:
+        """Functions most often on top of a stack, as (frame, share of samples)"""
+        leaves = _Counter()
+        for stack, count in self._snapshot().items():
+            leaves[stack.rsplit(';', 1)[-1]] += count
+        total = sum(leaves.values()) or 1
+        return [(frame, round(count / total, 4)) for frame, count in leaves.most_common(limit)]
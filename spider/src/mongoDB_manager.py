@@ -1,42 +1,90 @@
-from pymongo import MongoClient
+from pymongo import MongoClient, UpdateOne, ASCENDING
 from pymongo.errors import ConnectionFailure
 import time
 import os
+import threading
 from datetime import datetime
 import logging
+from metrics import MongoCommandMetrics
 
 class MongoDBManager:
+    # One pooled MongoClient per URI, shared by every manager in the process
+    _clients = {}
+    _clients_lock = threading.Lock()
+    _indexed = set()
+
     def __init__(self):
         self.client = None
         self.db = None
         self.collection = None
         self.max_retries = 5
-        self.retry_delay = 5
+        self.retry_delay = 1
+        self.max_retry_delay = 30
         self.mongodb_uri = os.getenv('MONGODB_URI', 'mongodb://mongodb:27017/')
         self.db_name = os.getenv('MONGODB_DB', 'crawler_db')
         self.collection_name = os.getenv('MONGODB_COLLECTION', 'crawl_results')
+        self.pages_collection_name = os.getenv('MONGODB_PAGES_COLLECTION', 'page_validators')
+        self.links_collection_name = os.getenv('MONGODB_LINKS_COLLECTION', 'school_links')
+        self.pages = None
+        self.school_links = None
         
-        # Setup logging
-        logging.basicConfig(level=logging.DEBUG)
+        # Handlers and levels are configured by the application, not here
         self.logger = logging.getLogger('MongoDBManager')
+
+    @staticmethod
+    def _client_options():
+        """Pool sizes and timeouts for the shared client, from the environment"""
+        return {
+            'maxPoolSize': int(os.getenv('MONGODB_MAX_POOL_SIZE', 50)),
+            'minPoolSize': int(os.getenv('MONGODB_MIN_POOL_SIZE', 0)),
+            'maxIdleTimeMS': int(os.getenv('MONGODB_MAX_IDLE_TIME_MS', 60000)),
+            'waitQueueTimeoutMS': int(os.getenv('MONGODB_WAIT_QUEUE_TIMEOUT_MS', 10000)),
+            'serverSelectionTimeoutMS': int(os.getenv('MONGODB_SERVER_SELECTION_TIMEOUT_MS', 5000)),
+            'connectTimeoutMS': int(os.getenv('MONGODB_CONNECT_TIMEOUT_MS', 5000)),
+            'socketTimeoutMS': int(os.getenv('MONGODB_SOCKET_TIMEOUT_MS', 30000)),
+            # Round trips and command latency for /metrics
+            'event_listeners': [MongoCommandMetrics()],
+        }
+
+    def _shared_client(self):
+        with MongoDBManager._clients_lock:
+            client = MongoDBManager._clients.get(self.mongodb_uri)
+            if client is None:
+                client = MongoClient(self.mongodb_uri, **self._client_options())
+                # Test the connection before sharing it
+                client.admin.command('ping')
+                MongoDBManager._clients[self.mongodb_uri] = client
+            return client
+
+    def _ensure_indexes(self):
+        key = (self.mongodb_uri, self.db_name)
+        with MongoDBManager._clients_lock:
+            if key in MongoDBManager._indexed:
+                return
+            MongoDBManager._indexed.add(key)
+        self.school_links.create_index(
+            [('school', ASCENDING), ('url', ASCENDING)], unique=True
+        )
         
     def connect(self):
-        """Establish connection to MongoDB with retry logic"""
+        """Attach to the process-wide MongoDB client, retrying with exponential backoff"""
         for attempt in range(self.max_retries):
             try:
                 self.logger.debug(f"Attempting to connect to MongoDB at {self.mongodb_uri} (attempt {attempt + 1}/{self.max_retries})")
-                self.client = MongoClient(self.mongodb_uri)
-                # Test the connection
-                self.client.admin.command('ping')
+                self.client = self._shared_client()
                 self.db = self.client[self.db_name]
                 self.collection = self.db[self.collection_name]
+                self.pages = self.db[self.pages_collection_name]
+                self.school_links = self.db[self.links_collection_name]
+                self._ensure_indexes()
                 self.logger.info("Successfully connected to MongoDB")
                 return True
             except ConnectionFailure as e:
                 self.logger.error(f"Failed to connect to MongoDB: {str(e)}")
                 if attempt < self.max_retries - 1:
-                    self.logger.info(f"Retrying in {self.retry_delay} seconds...")
-                    time.sleep(self.retry_delay)
+                    delay = min(self.max_retry_delay, self.retry_delay * (2 ** attempt))
+                    self.logger.info(f"Retrying in {delay} seconds...")
+                    time.sleep(delay)
                 else:
                     self.logger.error("Max retries reached. Could not connect to MongoDB")
                     raise
@@ -57,14 +105,198 @@ class MongoDBManager:
                 {'$set': document},  # update/document
                 upsert=True  # create if doesn't exist
             )
-            self.logger.info(f"Successfully saved crawl results with ID: {result.inserted_id}")
-            return result.inserted_id
+            self.logger.info(f"Successfully saved crawl results with ID: {result.upserted_id}")
+            return result.upserted_id
         except Exception as e:
             self.logger.error(f"Error saving crawl results: {str(e)}")
             raise
     
+    def reset_crawl_results(self, url, school_name):
+        """Start a fresh crawl_results document with an empty link list"""
+        self.collection.update_one(
+            {'url': url},
+            {'$set': {
+                'url': url,
+                'school_name': school_name,
+                'total_links': 0,
+                'timestamp': datetime.now(),
+                'links': []
+            }},
+            upsert=True
+        )
+
+    def append_crawl_links(self, url, school_name, new_links):
+        """Append newly discovered links without rewriting the stored list.
+
+        total_links is then set to the size of the stored list rather than
+        incremented, so a retried batch cannot count its links twice.
+        """
+        new_links = list(dict.fromkeys(new_links))
+        if not new_links:
+            return
+        self.logger.debug(f"Appending {len(new_links)} links to crawl results for {url}")
+        self.collection.update_one(
+            {'url': url},
+            {
+                '$addToSet': {'links': {'$each': new_links}},
+                '$set': {'school_name': school_name, 'timestamp': datetime.now()}
+            },
+            upsert=True
+        )
+        self.collection.update_one({'url': url}, [{'$set': {'total_links': {'$size': '$links'}}}])
+
+    def get_page_validators(self, url):
+        """Return the stored ETag/Last-Modified/content hash record for a page, if any"""
+        return self.pages.find_one({'_id': url})
+
+    def save_page_validators(self, url, etag, last_modified, content_hash, links, changed):
+        """Record a page's HTTP validators, content hash and outgoing links"""
+        update = {
+            'etag': etag,
+            'last_modified': last_modified,
+            'content_hash': content_hash,
+            'links': links,
+            'changed': changed,
+            'checked_at': datetime.now()
+        }
+        if changed:
+            update['changed_at'] = update['checked_at']
+        self.pages.update_one({'_id': url}, {'$set': update}, upsert=True)
+
+    def mark_page_unchanged(self, url):
+        """Record that a conditional request confirmed the page has not changed"""
+        self.pages.update_one(
+            {'_id': url},
+            {'$set': {'changed': False, 'checked_at': datetime.now()}}
+        )
+
+    def is_page_unchanged(self, url):
+        """True when the last crawl found the page unchanged"""
+        record = self.pages.find_one({'_id': url}, {'changed': 1})
+        return bool(record) and record.get('changed') is False
+
+    def bulk_upsert_school_links(self, school_name, links, batch_size=1000):
+        """Upsert per-link records into school_links with unordered bulk writes.
+
+        links may be URLs or dicts with a 'url' key plus extra fields to store.
+        Returns the number of records inserted or modified.
+        """
+        written = 0
+        operations = []
+        now = datetime.now()
+        for link in links:
+            record = {'url': link} if isinstance(link, str) else dict(link)
+            record['school'] = school_name
+            record['updated_at'] = now
+            operations.append(UpdateOne(
+                {'school': school_name, 'url': record['url']},
+                {'$set': record},
+                upsert=True
+            ))
+            if len(operations) >= batch_size:
+                written += self._bulk_write_links(operations)
+                operations = []
+        if operations:
+            written += self._bulk_write_links(operations)
+        return written
+
+    def _bulk_write_links(self, operations):
+        result = self.school_links.bulk_write(operations, ordered=False)
+        return result.upserted_count + result.modified_count
+
     def close(self):
-        """Close MongoDB connection"""
+        """Release this manager. The shared client stays open for other users"""
         if self.client:
-            self.client.close()
-            self.logger.info("MongoDB connection closed") 
\ No newline at end of file
+            self.client = None
+            self.db = None
+            self.logger.info("MongoDB connection closed")
+
+    @classmethod
+    def close_all(cls):
+        """Close every shared client, e.g. at process shutdown"""
+        with cls._clients_lock:
+            for client in cls._clients.values():
+                client.close()
+            cls._clients.clear()
+            cls._indexed.clear() 
+
+class CrawlResultsWriter:
+    """Appends newly found links to crawl_results from a background thread.
+
+    The crawler hands links over with add(), which never touches the
+    database. Pending links are written as one $addToSet delta (followed by
+    a $size recount of total_links), and as per-link school_links records, once flush_threshold have accumulated or
+    every flush_interval seconds.
+    """
+
+    def __init__(self, manager, url, school_name, flush_threshold=100, flush_interval=5.0):
+        self.manager = manager
+        self.url = url
+        self.school_name = school_name
+        self.flush_threshold = flush_threshold
+        self.flush_interval = flush_interval
+        self.logger = logging.getLogger('CrawlResultsWriter')
+        self._pending = []
+        self._pending_types = []
+        self._unsynced_links = []
+        self._cond = threading.Condition()
+        self._write_lock = threading.Lock()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def add(self, links):
+        with self._cond:
+            self._pending.extend(links)
+            if len(self._pending) >= self.flush_threshold:
+                self._cond.notify()
+
+    def add_type(self, url, doc_type, content_type, content_length=None):
+        """Record the detected type of a fetched link on its school_links record"""
+        record = {'url': url, 'doc_type': doc_type, 'content_type': content_type}
+        if content_length is not None:
+            record['content_length'] = content_length
+        with self._cond:
+            self._pending_types.append(record)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if not self._closed and len(self._pending) < self.flush_threshold:
+                    self._cond.wait(self.flush_interval)
+                if self._closed:
+                    return
+            self.flush()
+
+    def flush(self):
+        """Write all pending links now"""
+        with self._write_lock:
+            with self._cond:
+                batch, self._pending = self._pending, []
+                types, self._pending_types = self._pending_types, []
+            self._unsynced_links.extend(types)
+            if batch:
+                try:
+                    self.manager.append_crawl_links(self.url, self.school_name, batch)
+                except Exception as e:
+                    self.logger.error(f"Error appending crawl results: {str(e)}")
+                    with self._cond:
+                        self._pending[:0] = batch
+                    return
+                self._unsynced_links.extend(batch)
+            
+            # school_links upserts are idempotent, so a failed batch is simply retried
+            if self._unsynced_links:
+                try:
+                    self.manager.bulk_upsert_school_links(self.school_name, self._unsynced_links)
+                    self._unsynced_links = []
+                except Exception as e:
+                    self.logger.error(f"Error writing school links: {str(e)}")
+
+    def close(self):
+        """Stop the background thread and write what is left"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self._thread.join()
+        self.flush()
@@ -1,66 +1,183 @@
 import requests
 import os
-import threading
 import concurrent.futures
 from bs4 import BeautifulSoup
-from markitdown import MarkItDown
-from Qdrant_manager import DocumentStore
+from Qdrant_manager import DocumentStore, hash_content
 from utils import safe_print
-from MongoDB_manager import MongoDBManager
+from mongoDB_manager import MongoDBManager
+from async_crawler import DEFAULT_HEADERS
+from html_converter import HTMLConverter, needs_rendering
+from pdf_converter import PDFConverter
+from metrics import stage
+from archive import get_archive
+from content_types import HTML, PDF, PROCESSABLE, document_type
+from dotenv import load_dotenv
+
+load_dotenv()
+PAGE_PROCESSOR_URL = os.getenv('PAGE_PROCESSOR_URL', 'http://html-to-markdown:3000/convert')
+# 'inprocess' converts fetched HTML locally, 'service' always uses the rendering service
+HTML_CONVERTER = os.getenv('HTML_CONVERTER', 'inprocess')
+
+def convert_html_to_markdown(url):
+    try:
+        response = requests.post(
+            PAGE_PROCESSOR_URL,
+            json={'url': url}
+        )
+        response.raise_for_status()
+        return response.json()['markdown']
+    except requests.RequestException as e:
+        raise Exception(f"Failed to convert using local service: {str(e)}")
 
 class DocumentProcessor:
-    def __init__(self):
-        self.document_store = DocumentStore()
+    def __init__(self, incremental: bool = False, buffered: bool = True, archive=None):
+        self.document_store = DocumentStore(buffered=buffered)
+        # Documents are read from the crawl archive when it has them, and
+        # downloads are added to it
+        self.archive = archive or get_archive()
         self.mongodb_manager = MongoDBManager()
         self.mongodb_manager.connect()
+        self.incremental = incremental
+        self.html_converter = HTMLConverter()
+        self.pdf_converter = PDFConverter()
+        # Optional metrics.Tracer for per-URL spans, set by the pipeline
+        self.tracer = None
 
-    def process_html(self, url: str) -> str:
-        """Process HTML documents by converting them to markdown"""
-        return convert_html_to_markdown(url)
+    def is_unchanged(self, url: str) -> bool:
+        """True when the last crawl found the page unchanged and it is already stored"""
+        return (self.mongodb_manager.is_page_unchanged(url) and
+                self.document_store.has_document(url))
 
-    def process_pdf(self, url: str, output_dir: str) -> str:
-        """Process PDF documents by downloading and converting to markdown"""
-        response = requests.get(url, stream=True)
-        response.raise_for_status()
-        
-        temp_pdf_path = os.path.join(output_dir, f"temp_{threading.get_ident()}.pdf")
-        
-        try:
-            with open(temp_pdf_path, 'wb') as pdf_file:
-                for chunk in response.iter_content(chunk_size=8192):
-                    if chunk:
-                        pdf_file.write(chunk)
-            
-            converter = MarkItDown()
-            markdown_content = converter.convert_markdown(temp_pdf_path)
-            return markdown_content.text_content
-        finally:
-            if os.path.exists(temp_pdf_path):
-                os.remove(temp_pdf_path)
+    def process_html(self, url: str, html: str = None) -> str:
+        """Process HTML documents by converting them to markdown.
 
-    def process_single_document(self, url: str, output_dir: str) -> bool:
-        """Process a single document of any supported type"""
-        try:
-            if url.lower().endswith('.pdf'):
-                content = self.process_pdf(url, output_dir)
-                doc_type = 'pdf'
+        Converts in process, reusing the HTML the crawler already fetched when
+        given. Only pages that need JavaScript go to the rendering service.
+        """
+        if HTML_CONVERTER == 'service':
+            return convert_html_to_markdown(url)
+
+        if html is None:
+            response = requests.get(url, headers=DEFAULT_HEADERS, timeout=(5, 30), verify=False)
+            response.raise_for_status()
+            html = response.text
+
+        if needs_rendering(html):
+            safe_print(f"Page needs JavaScript, using rendering service: {url}")
+            return convert_html_to_markdown(url)
+        return self.html_converter.convert(html, url)
+
+    def process_pdf(self, url: str, output_dir: str = None) -> str:
+        """Process PDF documents by downloading into memory and converting in a worker process"""
+        return self.pdf_converter.convert_url(url)
+
+    def convert_document(self, url: str, output_dir: str, html: str = None, doc_type: str = None):
+        """Convert a document to markdown, reusing already fetched HTML if given. Returns (content, doc_type)"""
+        if (doc_type or document_type(url)) == PDF:
+            return self.process_pdf(url, output_dir), PDF
+        return self.process_html(url, html), HTML
+
+    def _archived(self, url: str):
+        """The archived 200 response for url, or None"""
+        if self.archive is None:
+            return None
+        archived = self.archive.get(url)
+        return archived if archived is not None and archived.status == 200 else None
+
+    def ingest_document(self, url: str, school_name: str = None, html: str = None,
+                        doc_type: str = None):
+        """Convert a document and queue it for storage, converting each distinct body only once.
+
+        doc_type is the type the crawler detected (see content_types), and
+        is guessed from the URL when not given. The fetched body is hashed
+        first; when the same bytes were already converted under another URL
+        the stored content is referenced instead of converting again. Pages
+        that go to the rendering service are not deduplicated by body, since
+        one JavaScript shell renders many pages.
+        Returns (future, content_hash), the future resolves to success.
+        """
+        doc_type = doc_type or document_type(url)
+        if doc_type not in PROCESSABLE:
+            raise ValueError(f"No converter for {doc_type} documents: {url}")
+        if doc_type == PDF:
+            archived = self._archived(url)
+            if archived is not None:
+                body = archived.body
+            else:
+                with stage('download', self.tracer, url):
+                    body = self.pdf_converter.download(url)
+                if self.archive is not None:
+                    self.archive.append(url, 200, {'Content-Type': 'application/pdf'}, body, school_name)
+        else:
+            if HTML_CONVERTER != 'service' and html is None:
+                archived = self._archived(url)
+                if archived is not None:
+                    html = archived.text
+                else:
+                    with stage('download', self.tracer, url):
+                        response = requests.get(url, headers=DEFAULT_HEADERS, timeout=(5, 30), verify=False)
+                        response.raise_for_status()
+                    if self.archive is not None:
+                        self.archive.append(url, response.status_code, response.headers,
+                                            response.content, school_name)
+                    html = response.text
+            if HTML_CONVERTER == 'service' or needs_rendering(html):
+                with stage('render', self.tracer, url):
+                    content = self.process_html(url, html)
+                future = self.document_store.submit_document(url, content, doc_type, school_name)
+                return future, hash_content(content)
+            body = html.encode('utf-8')
+
+        raw_hash = hash_content(body)
+        content_hash = self.document_store.lookup_raw(raw_hash)
+        if content_hash:
+            safe_print(f"Already converted identical {doc_type.upper()}, referencing it: {url}")
+            future = self.document_store.submit_reference(url, content_hash, doc_type, school_name)
+            return future, content_hash
+
+        with stage('convert', self.tracer, url, doc_type=doc_type):
+            if doc_type == PDF:
+                content = self.pdf_converter.convert_bytes(body)
             else:
-                content = self.process_html(url)
-                doc_type = 'html'
-
-            return self.document_store.store_document(
-                url=url,
-                content=content,
-                doc_type=doc_type
-            )
+                content = self.html_converter.convert(body, url)
+        future = self.document_store.submit_document(url, content, doc_type, school_name,
+                                                     raw_hash=raw_hash)
+        return future, hash_content(content)
+
+    def submit_single_document(self, url: str, output_dir: str, school_name: str = None,
+                               doc_type: str = None) -> concurrent.futures.Future:
+        """Convert a document and queue it for storage. The future resolves to success"""
+        try:
+            if self.incremental and self.is_unchanged(url):
+                safe_print(f"Skipping unchanged document: {url}")
+                future = concurrent.futures.Future()
+                future.set_result(True)
+                return future
+
+            future, _ = self.ingest_document(url, school_name, doc_type=doc_type)
+            return future
         except Exception as e:
             safe_print(f"Failed to process {url}: {e}")
-            return False
+            future = concurrent.futures.Future()
+            future.set_result(False)
+            return future
+
+    def process_single_document(self, url: str, output_dir: str, school_name: str = None) -> bool:
+        """Process a single document of any supported type"""
+        return self.submit_single_document(url, output_dir, school_name).result()
 
     def process_school_documents(self, school_name: str, max_workers: int = 5) -> None:
         """Process all documents for a given school"""
         links_collection = self.mongodb_manager.db['school_links']
-        links = [doc['url'] for doc in links_collection.find({'school': school_name})]
+        # Media and other types there is no converter for are skipped. The
+        # type is the one the crawler detected, guessed from the URL for
+        # links recorded before types were
+        doc_types = {}
+        for doc in links_collection.find({'school': school_name}, {'url': 1, 'doc_type': 1}):
+            doc_type = doc.get('doc_type') or document_type(doc['url'])
+            if doc_type in PROCESSABLE:
+                doc_types[doc['url']] = doc_type
+        links = list(doc_types)
 
         output_dir = os.path.join(f'../data/{school_name}', f'{school_name}_temp')
         os.makedirs(output_dir, exist_ok=True)
@@ -68,19 +185,34 @@ class DocumentProcessor:
         try:
             with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
                 future_to_link = {
-                    executor.submit(self.process_single_document, link, output_dir): link 
+                    executor.submit(self.submit_single_document, link, output_dir, school_name,
+                                    doc_types[link]): link
                     for link in links
                 }
 
                 completed = 0
                 total = len(links)
+                store_futures = {}
                 for future in concurrent.futures.as_completed(future_to_link):
                     completed += 1
+                    store_futures[future.result()] = future_to_link[future]
                     safe_print(f"Progress: {completed}/{total} links processed")
+
+            # Converted documents are written in batches; wait for the outcome of each
+            self.document_store.flush()
+            failed = [store_futures[f] for f in store_futures if not f.result()]
+            safe_print(f"Stored {total - len(failed)}/{total} documents for {school_name}")
+            for link in failed:
+                safe_print(f"Failed to store: {link}")
         finally:
             if os.path.exists(output_dir):
                 os.rmdir(output_dir)
 
+    def close(self):
+        """Flush pending document writes and stop the PDF workers"""
+        self.document_store.close()
+        self.pdf_converter.close()
+
     def merge_school_documents(self, school_name: str) -> bool:
         """Merge all documents with school metadata"""
         return self.document_store.store_school_documents(school_name) 
\ No newline at end of file
@@ -0,0 +1,118 @@
+import io
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+import requests
+
+from async_crawler import DEFAULT_HEADERS
+
+MAX_PDF_BYTES = int(os.getenv('MAX_PDF_BYTES', 100 * 1024 * 1024))
+PDF_WORKERS = int(os.getenv('PDF_WORKERS', max(1, (os.cpu_count() or 2) - 1)))
+PDF_TIMEOUT = float(os.getenv('PDF_CONVERT_TIMEOUT', 300))
+
+class PDFTooLargeError(Exception):
+    """Raised when a PDF exceeds the configured size limit"""
+
+_worker_markitdown = None
+
+def convert_pdf_bytes(data: bytes) -> str:
+    """Convert an in-memory PDF to markdown. Runs inside a pool worker process"""
+    global _worker_markitdown
+    from markitdown import MarkItDown, StreamInfo
+
+    if _worker_markitdown is None:
+        _worker_markitdown = MarkItDown()
+    result = _worker_markitdown.convert_stream(
+        io.BytesIO(data),
+        stream_info=StreamInfo(extension='.pdf', mimetype='application/pdf')
+    )
+    return result.text_content
+
+class PDFConverter:
+    """Downloads PDFs into memory and converts them in a process pool.
+
+    Text extraction is CPU bound, so it runs in separate processes instead of
+    the GIL-bound conversion threads. Downloads are streamed with a hard size
+    limit and never touch the disk.
+    """
+
+    def __init__(self, max_workers: int = PDF_WORKERS, max_bytes: int = MAX_PDF_BYTES,
+                 timeout: float = PDF_TIMEOUT):
+        self.max_workers = max_workers
+        self.max_bytes = max_bytes
+        self.timeout = timeout
+        self._pool = None
+        self._lock = threading.Lock()
+
+    def _executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._pool is None:
+                # spawn: forking a process that runs crawler threads is not safe
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    mp_context=multiprocessing.get_context('spawn')
+                )
+            return self._pool
+
+    def _replace(self, pool: ProcessPoolExecutor) -> bool:
+        """Kill the workers of a stuck or broken pool so the next conversion starts
+        a new one. Returns False when another thread already replaced it"""
+        with self._lock:
+            if self._pool is not pool:
+                return False
+            self._pool = None
+        # A worker cannot be interrupted mid-conversion, only terminated
+        for process in list((getattr(pool, '_processes', None) or {}).values()):
+            process.terminate()
+        pool.shutdown(wait=False, cancel_futures=True)
+        return True
+
+    def download(self, url: str) -> bytes:
+        """Stream a PDF into memory, aborting once it exceeds max_bytes"""
+        with requests.get(url, headers=DEFAULT_HEADERS, stream=True,
+                          timeout=(5, 30), verify=False) as response:
+            response.raise_for_status()
+
+            content_length = response.headers.get('Content-Length')
+            if content_length and content_length.isdigit() and int(content_length) > self.max_bytes:
+                raise PDFTooLargeError(f"{url} is {content_length} bytes (limit {self.max_bytes})")
+
+            buffer = bytearray()
+            for chunk in response.iter_content(chunk_size=64 * 1024):
+                buffer.extend(chunk)
+                if len(buffer) > self.max_bytes:
+                    raise PDFTooLargeError(f"{url} exceeds {self.max_bytes} bytes")
+            return bytes(buffer)
+
+    def convert_bytes(self, data: bytes) -> str:
+        """Convert PDF bytes in a worker process.
+
+        A conversion that times out would keep its worker busy forever, so
+        the pool is replaced; conversions running in the replaced pool are
+        retried once in the new one.
+        """
+        if len(data) > self.max_bytes:
+            raise PDFTooLargeError(f"PDF is {len(data)} bytes (limit {self.max_bytes})")
+        for attempt in range(2):
+            pool = self._executor()
+            try:
+                return pool.submit(convert_pdf_bytes, data).result(timeout=self.timeout)
+            except FutureTimeoutError:
+                self._replace(pool)
+                raise
+            except BrokenProcessPool:
+                # Replaced here when this conversion broke the pool itself
+                if self._replace(pool) or attempt:
+                    raise
+
+    def convert_url(self, url: str) -> str:
+        return self.convert_bytes(self.download(url))
+
+    def close(self):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=True)
+                self._pool = None
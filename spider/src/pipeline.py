@@ -0,0 +1,129 @@
+import os
+import queue
+import threading
+import time
+
+from content_types import HTML, PROCESSABLE, document_type
+from crawler import WebScraper
+from page_processor import DocumentProcessor
+from utils import safe_print
+
+_STOP = object()
+
+class CrawlPipeline:
+    """Streams a crawl straight into conversion and storage.
+
+    Pages fetched by the WebScraper are pushed onto a bounded conversion
+    queue together with their HTML, so conversion never downloads a page a
+    second time. A fixed pool of conversion workers turns them into markdown
+    (once per distinct body) and hands the results to the buffered
+    DocumentStore, which writes the content, the document and its merged
+    school reference in batches.
+    Every hand-off is bounded (convert_queue_size, the store's max_pending),
+    so a slow stage pushes back on the one before it instead of piling up
+    work in memory.
+    """
+
+    def __init__(self, url: str, incremental: bool = False, convert_workers: int = 4,
+                 convert_queue_size: int = 256, tracer=None, budget=None, archive=None,
+                 replay: bool = False):
+        self.scraper = WebScraper(url, incremental=incremental, tracer=tracer, budget=budget,
+                                  archive=archive)
+        self.processor = DocumentProcessor(incremental=incremental, archive=archive)
+        # Replay the crawl from the archive instead of fetching, see WebScraper.scrape_archived
+        self.replay = replay
+        self.processor.tracer = tracer
+        self.school_name = self.scraper.school_name
+        self.convert_workers = convert_workers
+        self.convert_queue = queue.Queue(maxsize=convert_queue_size)
+        self.output_dir = os.path.join(f'../data/{self.school_name}', f'{self.school_name}_temp')
+
+        self._lock = threading.Lock()
+        self._store_futures = {}
+        self.converted = 0
+        self.conversion_failures = 0
+
+        self.scraper.page_listeners.append(self._enqueue_page)
+
+    def _enqueue_page(self, url, body, content_type):
+        # Only HTML bodies are reused, other types are fetched by their converter,
+        # and types there is no converter for are skipped.
+        # Blocks when conversion falls behind, which slows the crawl down
+        doc_type = document_type(url, content_type)
+        if doc_type not in PROCESSABLE:
+            return
+        html = body if doc_type == HTML else None
+        self.convert_queue.put((url, html, doc_type))
+
+    def _convert_worker(self):
+        while True:
+            item = self.convert_queue.get()
+            if item is _STOP:
+                return
+            url, html, doc_type = item
+            try:
+                if self.processor.incremental and self.processor.is_unchanged(url):
+                    continue
+                document_future, content_hash = self.processor.ingest_document(
+                    url, self.school_name, html, doc_type
+                )
+                merged_future = self.processor.document_store.submit_merged_document(
+                    self.school_name, url, content_hash
+                )
+                with self._lock:
+                    self.converted += 1
+                    self._store_futures[url] = (document_future, merged_future)
+            except Exception as e:
+                safe_print(f"Failed to process {url}: {e}")
+                with self._lock:
+                    self.conversion_failures += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'convert_queue': self.convert_queue.qsize(),
+                'store_buffer': self.processor.document_store.pending(),
+                'converted': self.converted,
+                'conversion_failures': self.conversion_failures
+            }
+
+    def run(self) -> dict:
+        """Run crawl, conversion and storage concurrently until all stages drain"""
+        start_time = time.time()
+        os.makedirs(self.output_dir, exist_ok=True)
+        workers = [
+            threading.Thread(target=self._convert_worker, name=f"convert-worker-{i}", daemon=True)
+            for i in range(self.convert_workers)
+        ]
+        for worker in workers:
+            worker.start()
+
+        try:
+            if self.replay:
+                links = self.scraper.scrape_archived()
+            else:
+                links = self.scraper.scrape_async()
+        finally:
+            for _ in workers:
+                self.convert_queue.put(_STOP)
+            for worker in workers:
+                worker.join()
+
+        try:
+            self.processor.document_store.flush()
+            failed = [url for url, futures in self._store_futures.items()
+                      if not all(future.result() for future in futures)]
+        finally:
+            self.processor.close()
+            if os.path.exists(self.output_dir):
+                os.rmdir(self.output_dir)
+
+        stored = len(self._store_futures) - len(failed)
+        safe_print(f"Pipeline for {self.scraper.url} finished in {time.time() - start_time:.2f} seconds: "
+                   f"{len(links)} links, {stored} stored, "
+                   f"{self.conversion_failures + len(failed)} failed")
+        return {
+            'links': links,
+            'stored': stored,
+            'failed': failed
+        }
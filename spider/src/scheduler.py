@@ -0,0 +1,184 @@
+import os
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from urllib.robotparser import RobotFileParser
+
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+THROTTLE_STATUS = {429, 503}
+
+class TokenBucket:
+    """Classic token bucket: `rate` tokens per second, up to `burst` stored"""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, now):
+        """Take a token if one is available, otherwise return seconds until one is"""
+        self._refill(now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+class HostState:
+    def __init__(self, rate, burst, concurrency):
+        self.bucket = TokenBucket(rate, burst)
+        self.concurrency = concurrency
+        self.in_flight = 0
+        self.crawl_delay = None
+        self.blocked_until = 0.0
+        self.robots_loaded = False
+
+class PolitenessScheduler:
+    """Per-host politeness: token-bucket rate limits plus AIMD concurrency.
+
+    Every host gets its own bucket and a concurrency window. Fast successful
+    responses grow the window additively, while timeouts and 429/503 responses
+    halve it and pause the host. The scheduler is thread safe, so the threaded
+    and asyncio crawl engines (and several concurrent crawls) can share one
+    instance.
+    """
+
+    def __init__(self, rate=2.0, burst=4, initial_concurrency=2,
+                 min_concurrency=1, max_concurrency=8, slow_response=2.0,
+                 max_retries=3, backoff_base=1.0, backoff_cap=60.0):
+        self.rate = rate
+        self.burst = burst
+        self.initial_concurrency = initial_concurrency
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max_concurrency
+        self.slow_response = slow_response
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self._hosts = {}
+        self._lock = threading.Lock()
+
+    def _host(self, host):
+        state = self._hosts.get(host)
+        if state is None:
+            state = HostState(self.rate, self.burst, self.initial_concurrency)
+            self._hosts[host] = state
+        return state
+
+    def needs_robots(self, host):
+        """True the first time a host is seen, so the caller can load robots.txt once"""
+        with self._lock:
+            state = self._host(host)
+            if state.robots_loaded:
+                return False
+            state.robots_loaded = True
+            return True
+
+    def set_crawl_delay(self, host, delay):
+        """Apply a robots.txt Crawl-delay by capping the host's request rate"""
+        if not delay or delay <= 0:
+            return
+        with self._lock:
+            state = self._host(host)
+            state.crawl_delay = delay
+            state.bucket.rate = min(state.bucket.rate, 1.0 / delay)
+            state.bucket.burst = 1
+            state.bucket.tokens = min(state.bucket.tokens, 1)
+
+    def try_acquire(self, host):
+        """Claim a request slot for host. Returns 0 on success, else seconds to wait"""
+        with self._lock:
+            state = self._host(host)
+            now = time.monotonic()
+            if now < state.blocked_until:
+                return state.blocked_until - now
+            if state.in_flight >= int(state.concurrency):
+                return 0.05
+            wait = state.bucket.reserve(now)
+            if wait > 0:
+                return wait
+            state.in_flight += 1
+            return 0.0
+
+    def acquire(self, host):
+        """Blocking variant of try_acquire for thread-based callers"""
+        while True:
+            wait = self.try_acquire(host)
+            if wait <= 0:
+                return
+            time.sleep(wait)
+
+    def release(self, host, status=None, elapsed=None, retry_after=None):
+        """Return a slot and adapt the host's limits to the outcome.
+
+        status is the HTTP status, or None when the request failed with a
+        timeout or connection error.
+        """
+        with self._lock:
+            state = self._host(host)
+            state.in_flight = max(0, state.in_flight - 1)
+
+            if status is None or status in THROTTLE_STATUS:
+                # Multiplicative decrease, and let the host cool down
+                state.concurrency = max(self.min_concurrency, state.concurrency / 2)
+                pause = retry_after if retry_after is not None else self.backoff_base
+                state.blocked_until = max(state.blocked_until, time.monotonic() + pause)
+            elif status in (200, 304) and elapsed is not None and elapsed < self.slow_response:
+                # Additive increase: roughly +1 per window of fast responses
+                state.concurrency = min(self.max_concurrency,
+                                        state.concurrency + 1.0 / state.concurrency)
+
+    def should_retry(self, attempt, status=None):
+        """Whether a failed request (status None = network error) should be retried"""
+        if attempt >= self.max_retries:
+            return False
+        return status is None or status in RETRYABLE_STATUS
+
+    def backoff(self, attempt, retry_after=None):
+        """Full-jitter exponential backoff, never shorter than Retry-After"""
+        delay = random.uniform(0, min(self.backoff_cap, self.backoff_base * (2 ** attempt)))
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        return delay
+
+def parse_retry_after(value):
+    """Parse a Retry-After header (delta-seconds or HTTP date) into seconds"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+        return max(0.0, retry_at.timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+def parse_crawl_delay(robots_txt, user_agent):
+    """Extract the Crawl-delay that applies to user_agent from robots.txt content"""
+    parser = RobotFileParser()
+    parser.parse(robots_txt.splitlines())
+    delay = parser.crawl_delay(user_agent)
+    return float(delay) if delay is not None else None
+
+_shared_scheduler = None
+_shared_lock = threading.Lock()
+
+def get_scheduler():
+    """Process-wide scheduler so concurrent crawls of one host share its limits"""
+    global _shared_scheduler
+    with _shared_lock:
+        if _shared_scheduler is None:
+            _shared_scheduler = PolitenessScheduler(
+                rate=float(os.getenv('CRAWLER_HOST_RATE', 4.0)),
+                burst=int(os.getenv('CRAWLER_HOST_BURST', 8)),
+                max_concurrency=int(os.getenv('CRAWLER_HOST_MAX_CONCURRENCY', 8)),
+                max_retries=int(os.getenv('CRAWLER_MAX_RETRIES', 3))
+            )
+        return _shared_scheduler
@@ -0,0 +1,201 @@
+"""Sitemap discovery: seeds a crawl's frontier from robots.txt Sitemap lines,
+sitemap indexes and (optionally gzipped) sitemaps.
+
+Sitemaps are parsed incrementally as they download, so large sitemaps never
+have to be held in memory as a whole.
+"""
+import logging
+import os
+import re
+import zlib
+from datetime import datetime, timedelta
+from urllib.parse import urljoin, urlsplit
+from xml.etree.ElementTree import ParseError, XMLPullParser
+
+from utils.urls import canonicalize_url
+
+CRAWL_SITEMAPS = os.getenv('CRAWL_SITEMAPS', 'true').lower() not in ('0', 'false', 'no')
+SITEMAP_MAX_FILES = int(os.getenv('SITEMAP_MAX_FILES', 200))
+SITEMAP_MAX_URLS = int(os.getenv('SITEMAP_MAX_URLS', 200000))
+# The sitemap protocol caps a sitemap at 50MB uncompressed
+SITEMAP_MAX_BYTES = int(os.getenv('SITEMAP_MAX_BYTES', 50 * 1024 * 1024))
+# Pages whose lastmod is this recent are crawled ahead of others of the same priority
+SITEMAP_FRESH_DAYS = float(os.getenv('SITEMAP_FRESH_DAYS', 30))
+
+_SITEMAP_LINE = re.compile(r'^\s*sitemap\s*:\s*(\S+)', re.I | re.M)
+_FRACTION = re.compile(r'(\.\d+)')
+
+def sitemaps_from_robots(robots_txt: str, base_url: str) -> list:
+    """Sitemap URLs listed in robots.txt, in order"""
+    found = {}
+    for match in _SITEMAP_LINE.finditer(robots_txt or ''):
+        found[urljoin(base_url, match.group(1))] = None
+    return list(found)
+
+def parse_lastmod(value: str):
+    """Parse a W3C datetime lastmod (YYYY, YYYY-MM, YYYY-MM-DD or a full timestamp)
+    into a naive local datetime, or None"""
+    value = (value or '').strip()
+    if not value:
+        return None
+    try:
+        if len(value) == 4:
+            return datetime(int(value), 1, 1)
+        if len(value) == 7:
+            return datetime(int(value[:4]), int(value[5:7]), 1)
+        value = value.replace('Z', '+00:00').replace('z', '+00:00')
+        # fromisoformat only takes 3 or 6 fractional digits
+        value = _FRACTION.sub(lambda m: (m.group(1) + '000000')[:7], value, count=1)
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        return None
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone().replace(tzinfo=None)
+    return parsed
+
+def freshness_bonus(lastmod, now: datetime = None) -> int:
+    """1 for pages modified within SITEMAP_FRESH_DAYS, else 0"""
+    if lastmod is None:
+        return 0
+    now = now or datetime.now()
+    return 1 if now - lastmod <= timedelta(days=SITEMAP_FRESH_DAYS) else 0
+
+def _local_name(tag: str) -> str:
+    return tag.rsplit('}', 1)[-1]
+
+class SitemapParser:
+    """Incremental parser for sitemaps and sitemap indexes.
+
+    feed() takes raw chunks, gzipped or not, and returns the entries
+    completed so far as (kind, loc, lastmod) tuples, kind being 'url' or
+    'sitemap'. Finished elements are dropped as soon as they are read.
+    """
+
+    def __init__(self, max_bytes: int = SITEMAP_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._parser = XMLPullParser(events=('start', 'end'))
+        self._root = None
+        self._inflate = None
+        self._sniffed = False
+
+    def feed(self, chunk: bytes) -> list:
+        if not self._sniffed:
+            self._sniffed = True
+            if chunk[:2] == b'\x1f\x8b':
+                self._inflate = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        if self._inflate is not None:
+            # Bounded so a small gzip bomb cannot blow past max_bytes in one call
+            chunk = self._inflate.decompress(chunk, self.max_bytes - self.size + 1)
+        self.size += len(chunk)
+        if self.size > self.max_bytes:
+            raise ValueError(f"Sitemap larger than {self.max_bytes} bytes")
+        self._parser.feed(chunk)
+        return self._entries()
+
+    def close(self) -> list:
+        if self._inflate is not None:
+            self._parser.feed(self._inflate.flush())
+        self._parser.close()
+        return self._entries()
+
+    def _entries(self) -> list:
+        entries = []
+        for event, element in self._parser.read_events():
+            if event == 'start':
+                if self._root is None:
+                    self._root = element
+                continue
+            kind = _local_name(element.tag)
+            if kind not in ('url', 'sitemap'):
+                continue
+            loc = lastmod = None
+            for child in element:
+                name = _local_name(child.tag)
+                if name == 'loc':
+                    loc = (child.text or '').strip()
+                elif name == 'lastmod':
+                    lastmod = parse_lastmod(child.text)
+            if loc:
+                entries.append((kind, loc, lastmod))
+            # Entries are direct children of the root, so this frees them
+            self._root.clear()
+        return entries
+
+class SitemapDiscovery:
+    """Finds the in-scope pages a site lists in its sitemaps.
+
+    Sitemaps come from the robots.txt Sitemap lines, falling back to
+    /sitemap.xml (and sitemap.xml under the crawl's start path). Indexes
+    are followed up to max_files sitemaps in all; page URLs are
+    canonicalized and kept only when they are in the crawl's scope.
+    """
+
+    def __init__(self, scraper, max_files: int = SITEMAP_MAX_FILES, max_urls: int = SITEMAP_MAX_URLS):
+        self.scraper = scraper
+        self.max_files = max_files
+        self.max_urls = max_urls
+        self.files = 0
+        self.logger = logging.getLogger('crawler.SitemapDiscovery')
+
+    def sitemap_urls(self) -> list:
+        parts = urlsplit(self.scraper.start_url)
+        origin = f"{parts.scheme}://{parts.netloc}"
+        listed = sitemaps_from_robots(self.scraper.robots_txt(self.scraper.start_url), origin + '/')
+        if listed:
+            return listed
+        candidates = [origin + '/sitemap.xml']
+        scope_path = self.scraper.link_extractor.scope_path
+        if scope_path.rstrip('/'):
+            candidates.append(origin + scope_path.rstrip('/') + '/sitemap.xml')
+        return candidates
+
+    def discover(self) -> dict:
+        """In-scope page URLs listed in the site's sitemaps, mapped to their lastmod (or None)"""
+        pages = {}
+        pending = self.sitemap_urls()
+        seen = set(pending)
+        while pending and self.files < self.max_files and len(pages) < self.max_urls:
+            sitemap_url = pending.pop(0)
+            self.files += 1
+            try:
+                for kind, loc, lastmod in self._read(sitemap_url):
+                    if kind == 'sitemap':
+                        loc = urljoin(sitemap_url, loc)
+                        if loc not in seen:
+                            seen.add(loc)
+                            pending.append(loc)
+                        continue
+                    url = canonicalize_url(urljoin(sitemap_url, loc))
+                    if not self.scraper.link_extractor.in_scope(url):
+                        continue
+                    if url not in pages or (lastmod and (pages[url] is None or lastmod > pages[url])):
+                        pages[url] = lastmod
+                    if len(pages) >= self.max_urls:
+                        self.logger.info("Stopping sitemap discovery at %d URLs", self.max_urls)
+                        break
+            except (ParseError, ValueError, zlib.error) as e:
+                self.logger.warning("Could not parse sitemap %s: %s", sitemap_url, e)
+            except Exception as e:
+                self.logger.warning("Could not read sitemap %s: %s (%s)", sitemap_url, e, type(e).__name__)
+        self.logger.info("Read %d sitemaps for %s: %d in-scope pages",
+                         self.files, self.scraper.start_url, len(pages))
+        return pages
+
+    def _read(self, sitemap_url: str):
+        """Stream a sitemap, yielding its entries as they are parsed"""
+        response = self.scraper.fetch(sitemap_url, stream=True)
+        try:
+            if response.status_code != 200:
+                self.logger.debug("No sitemap at %s (HTTP %d)", sitemap_url, response.status_code)
+                return
+            # Many sites answer a missing /sitemap.xml with an HTML page
+            if 'html' in response.headers.get('Content-Type', '').lower():
+                self.logger.debug("No sitemap at %s (got an HTML page)", sitemap_url)
+                return
+            parser = SitemapParser()
+            for chunk in response.iter_content(chunk_size=64 * 1024):
+                yield from parser.feed(chunk)
+            yield from parser.close()
+        finally:
+            response.close()
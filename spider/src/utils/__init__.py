@@ -0,0 +1,7 @@
+import threading
+
+# Thread-safe print function
+print_lock = threading.Lock()
+def safe_print(message):
+    with print_lock:
+        print(message)
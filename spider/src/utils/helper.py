@@ -1,17 +1,106 @@
 import requests
+import json
+import os
+import threading
+import time
+from urllib.parse import urlparse
 
-def get_school_abbreviation(url: str) -> str:
+# Second-level labels used under country-code TLDs, e.g. ntu.edu.tw or ox.ac.uk
+SECOND_LEVEL_LABELS = {'edu', 'ac', 'gov', 'org', 'com', 'net', 'co', 'or', 'go', 'ne', 'sch'}
+
+SCHOOL_NAME_CACHE_PATH = os.getenv('SCHOOL_NAME_CACHE', 'data/school_names.json')
+SCHOOL_NAME_TTL = float(os.getenv('SCHOOL_NAME_TTL', 30 * 24 * 3600))
+# Fallback answers are cached briefly so a recovered model gets asked again
+SCHOOL_NAME_FALLBACK_TTL = float(os.getenv('SCHOOL_NAME_FALLBACK_TTL', 3600))
+SCHOOL_NAME_TIMEOUT = (
+    float(os.getenv('SCHOOL_NAME_CONNECT_TIMEOUT', 2)),
+    float(os.getenv('SCHOOL_NAME_READ_TIMEOUT', 5))
+)
+
+def registered_domain(url: str) -> str:
+    """
+    Reduce a URL to its registered domain, e.g. politics.ntu.edu.tw -> ntu.edu.tw
+
+    Args:
+        url (str): URL or bare hostname
+
+    Returns:
+        str: Registered domain in lower case
+    """
+    hostname = urlparse(url if '//' in url else f'//{url}').hostname or url
+    labels = hostname.lower().strip('.').split('.')
+    if len(labels) >= 3 and len(labels[-1]) == 2 and labels[-2] in SECOND_LEVEL_LABELS:
+        return '.'.join(labels[-3:])
+    return '.'.join(labels[-2:])
+
+def fallback_abbreviation(url: str) -> str:
+    """
+    Deterministic school abbreviation from hostname rules, used when the model is unavailable
+
+    Args:
+        url (str): URL of the school's website
+
+    Returns:
+        str: The registered domain's leading label, e.g. ntu for www.ntu.edu.tw
+    """
+    return registered_domain(url).split('.')[0]
+
+class SchoolNameCache:
+    """Persistent JSON cache of school abbreviations keyed by registered domain"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._entries = None
+
+    def _load(self):
+        if self._entries is None:
+            try:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    self._entries = json.load(f)
+            except (OSError, ValueError):
+                self._entries = {}
+        return self._entries
+
+    def get(self, key: str):
+        with self._lock:
+            entry = self._load().get(key)
+        if not entry or entry['expires_at'] < time.time():
+            return None
+        return entry['name']
+
+    def set(self, key: str, name: str, ttl: float):
+        with self._lock:
+            entries = self._load()
+            entries[key] = {'name': name, 'expires_at': time.time() + ttl}
+            try:
+                directory = os.path.dirname(self.path)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                tmp_path = f"{self.path}.tmp"
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    json.dump(entries, f, ensure_ascii=False)
+                os.replace(tmp_path, self.path)
+            except OSError as e:
+                print(f"error writing school name cache: {e}")
+
+school_name_cache = SchoolNameCache(SCHOOL_NAME_CACHE_PATH)
+
+def ask_school_abbreviation(url: str) -> str:
     """
-    Get school name abbreviation by sending request to AI service
-    
+    Ask the AI service for the school name abbreviation in a URL
+
     Args:
         url (str): URL of the school's website
-        
+
     Returns:
-        str: Abbreviated school name or empty string if request fails
+        str: Abbreviated school name
+
+    Raises:
+        requests.RequestException: If the service is slow, down or returns an error
     """
     api_endpoint = "http://host.docker.internal:11435/v1/chat/completions"
-    
+
     payload = {
         "model": "llama3.2",
         "messages": [
@@ -26,20 +115,42 @@ def get_school_abbreviation(url: str) -> str:
         ],
         "temperature": 0.7,
         "top_p": 1.0,
-        "max_tokens": 1000,
+        "max_tokens": 16,
     }
-    
+
+    response = requests.post(api_endpoint, json=payload, timeout=SCHOOL_NAME_TIMEOUT)
+
+    if response.status_code == 500:
+        print(f"Server error response: {response.text}")
+
+    response.raise_for_status()
+    result = response.json()
+    return result["choices"][0]["message"]["content"].strip()
+
+def get_school_abbreviation(url: str) -> str:
+    """
+    Get school name abbreviation, cached per registered domain
+
+    Args:
+        url (str): URL of the school's website
+
+    Returns:
+        str: Abbreviated school name. Falls back to hostname rules when the
+        AI service is slow or unavailable
+    """
+    key = registered_domain(url)
+    cached = school_name_cache.get(key)
+    if cached:
+        return cached
+
     try:
-        response = requests.post(api_endpoint, json=payload)
-        
-        if response.status_code == 500:
-            print(f"Server error response: {response.text}")
-            raise "server error"
-            
-        response.raise_for_status()
-        result = response.json()
-        return result["choices"][0]["message"]["content"].strip()
-        
-    except requests.RequestException as e:
+        name = ask_school_abbreviation(url)
+        if name:
+            school_name_cache.set(key, name, SCHOOL_NAME_TTL)
+            return name
+    except (requests.RequestException, KeyError, IndexError, ValueError) as e:
         print(f"error getting school abbreviation: {e}")
-        return "error school name"
\ No newline at end of file
+
+    name = fallback_abbreviation(url)
+    school_name_cache.set(key, name, SCHOOL_NAME_FALLBACK_TTL)
+    return name
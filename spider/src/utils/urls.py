@@ -0,0 +1,69 @@
+import functools
+import os
+import re
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+# Query parameters that only identify a campaign, click or session. Names
+# some sites use for content too (sid, spm) are left to CRAWLER_TRACKING_PARAMS
+TRACKING_PARAMS = {
+    'gclid', 'dclid', 'fbclid', 'msclkid', 'yclid', 'igshid', 'mc_cid', 'mc_eid',
+    '_ga', '_gl', '_hsenc', '_hsmi', 'jsessionid', 'phpsessid'
+}
+TRACKING_PREFIXES = ('utm_',)
+TRACKING_PARAMS.update(p.strip().lower() for p in os.getenv('CRAWLER_TRACKING_PARAMS', '').split(',') if p.strip())
+
+INDEX_PAGES = {'index.html', 'index.htm', 'index.php', 'index.asp', 'index.aspx',
+               'index.jsp', 'default.htm', 'default.html', 'default.asp', 'default.aspx'}
+
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+_REPEATED_SLASHES = re.compile(r'/{2,}')
+# Matrix-style session ids, e.g. /page;jsessionid=ABC123
+_PATH_SESSION = re.compile(r';(jsessionid|phpsessid|sid)=[^/?#]*', re.I)
+
+def is_tracking_param(name: str) -> bool:
+    name = name.lower()
+    return name in TRACKING_PARAMS or name.startswith(TRACKING_PREFIXES)
+
+# Navigation links repeat on every page of a site
+@functools.lru_cache(maxsize=65536)
+def canonicalize_url(url: str) -> str:
+    """
+    Reduce the URL variants of one page to a single form
+
+    Lower-cases scheme and host, drops default ports, fragments, session ids
+    and tracking parameters, sorts the remaining query, collapses repeated
+    slashes and maps index pages (index.html, default.aspx, ...) to their
+    directory. A trailing slash is kept as given, /a and /a/ can be
+    different resources and forcing one form would cost a redirect per page.
+
+    Args:
+        url (str): Absolute URL
+
+    Returns:
+        str: Canonical URL
+    """
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or '').rstrip('.')
+    if ':' in host:
+        host = f'[{host}]'
+    try:
+        port = parts.port
+    except ValueError:
+        port = None
+    if port == DEFAULT_PORTS.get(scheme):
+        port = None
+    netloc = host if port is None else f'{host}:{port}'
+    if parts.username:
+        netloc = f'{parts.username}@{netloc}'
+
+    path = _PATH_SESSION.sub('', parts.path)
+    path = _REPEATED_SLASHES.sub('/', path) or '/'
+    head, _, last = path.rpartition('/')
+    if last.lower() in INDEX_PAGES:
+        path = head + '/'
+
+    query = sorted((name, value) for name, value in parse_qsl(parts.query, keep_blank_values=True)
+                   if not is_tracking_param(name))
+    return urlunsplit((scheme, netloc, path, urlencode(query), ''))
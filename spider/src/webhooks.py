@@ -0,0 +1,319 @@
+import asyncio
+import json
+import logging
+import os
+import random
+import sqlite3
+import threading
+import time
+
+import aiohttp
+
+from crawl_state import url_fingerprint
+from metrics import QUEUE_DEPTH, WEBHOOK_DELIVERIES
+from scheduler import parse_retry_after
+
+# full: every link, delta: links added/removed since the last notification
+# for the same URL, counts: only the totals
+PAYLOAD_MODES = ('full', 'delta', 'counts')
+
+WEBHOOK_PAYLOAD = os.getenv('WEBHOOK_PAYLOAD', 'full')
+# Under data/, which is a volume in docker-compose, so the outbox survives the container
+WEBHOOK_OUTBOX = os.getenv('WEBHOOK_OUTBOX', os.path.join('data', 'webhooks.sqlite'))
+WEBHOOK_TIMEOUT = float(os.getenv('WEBHOOK_TIMEOUT', 30))
+WEBHOOK_MAX_ATTEMPTS = int(os.getenv('WEBHOOK_MAX_ATTEMPTS', 10))
+WEBHOOK_BACKOFF_BASE = float(os.getenv('WEBHOOK_BACKOFF_BASE', 2.0))
+WEBHOOK_BACKOFF_MAX = float(os.getenv('WEBHOOK_BACKOFF_MAX', 600.0))
+WEBHOOK_BATCH_SIZE = int(os.getenv('WEBHOOK_BATCH_SIZE', 16))
+
+# Client errors worth retrying; any other 4xx is dropped as undeliverable
+_RETRYABLE_CLIENT_ERRORS = {408, 409, 425, 429}
+
+class WebhookOutbox:
+    """SQLite outbox of undelivered notifications, plus the last link set
+    delivered per crawled URL for delta payloads.
+
+    A notification stays in the outbox until it is delivered, so anything
+    not yet sent when the process stops goes out after the next start.
+    Notifications keep their links and get their payload when they are
+    sent; the link snapshot only advances when a delivery succeeds.
+    """
+
+    def __init__(self, path: str):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.executescript('''
+            CREATE TABLE IF NOT EXISTS outbox (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                crawl_url TEXT NOT NULL,
+                target TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                next_attempt_at REAL NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending',
+                last_error TEXT,
+                created_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS outbox_pending ON outbox (status, crawl_url, id);
+            CREATE TABLE IF NOT EXISTS link_snapshots (
+                crawl_url TEXT NOT NULL,
+                fp INTEGER NOT NULL,
+                url TEXT NOT NULL,
+                PRIMARY KEY (crawl_url, fp)
+            );
+        ''')
+        # Outboxes written before payloads were built at delivery have no links column
+        columns = {row[1] for row in self._conn.execute('PRAGMA table_info(outbox)')}
+        if 'links' not in columns:
+            self._conn.execute('ALTER TABLE outbox ADD COLUMN links TEXT')
+        self._conn.commit()
+
+    def add(self, crawl_url: str, target: str, payload: dict, links=None) -> int:
+        """Queue a notification. With links, payload is the spec its payload is built from"""
+        now = time.time()
+        with self._lock:
+            cursor = self._conn.execute(
+                'INSERT INTO outbox (crawl_url, target, payload, links, next_attempt_at, created_at) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                (crawl_url, target, json.dumps(payload),
+                 None if links is None else json.dumps(sorted(links)), now, now)
+            )
+            self._conn.commit()
+            return cursor.lastrowid
+
+    def due(self, limit: int) -> list:
+        """Oldest pending notification per crawled URL whose retry time has come.
+
+        Later notifications for a URL wait for earlier ones, so receivers
+        applying deltas see them in order.
+        """
+        with self._lock:
+            return self._conn.execute('''
+                SELECT id, crawl_url, target, payload, links, attempts FROM outbox o
+                WHERE status = 'pending' AND next_attempt_at <= ?
+                  AND id = (SELECT MIN(id) FROM outbox
+                            WHERE status = 'pending' AND crawl_url = o.crawl_url)
+                ORDER BY id LIMIT ?
+            ''', (time.time(), limit)).fetchall()
+
+    def next_due_at(self):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT MIN(next_attempt_at) FROM outbox WHERE status = 'pending'"
+            ).fetchone()
+        return row[0]
+
+    def delivered(self, notification_id: int, crawl_url: str = None, links=None):
+        """Remove a delivered notification, making its links crawl_url's snapshot"""
+        with self._lock:
+            self._conn.execute('DELETE FROM outbox WHERE id = ?', (notification_id,))
+            if links is not None:
+                current = {url_fingerprint(link): link for link in links}
+                self._conn.execute('DELETE FROM link_snapshots WHERE crawl_url = ?', (crawl_url,))
+                self._conn.executemany(
+                    'INSERT INTO link_snapshots (crawl_url, fp, url) VALUES (?, ?, ?)',
+                    ((crawl_url, fp, link) for fp, link in current.items())
+                )
+            self._conn.commit()
+
+    def retry(self, notification_id: int, attempts: int, next_attempt_at: float, error: str):
+        with self._lock:
+            self._conn.execute(
+                'UPDATE outbox SET attempts = ?, next_attempt_at = ?, last_error = ? WHERE id = ?',
+                (attempts, next_attempt_at, error, notification_id)
+            )
+            self._conn.commit()
+
+    def dead(self, notification_id: int, attempts: int, error: str):
+        """Give up on a notification, keeping it in the table for inspection"""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE outbox SET status = 'dead', attempts = ?, last_error = ? WHERE id = ?",
+                (attempts, error, notification_id)
+            )
+            self._conn.commit()
+
+    def pending(self) -> int:
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM outbox WHERE status = 'pending'"
+            ).fetchone()[0]
+
+    def diff_snapshot(self, crawl_url: str, links) -> tuple:
+        """Compare links with the last set delivered for crawl_url. Returns (added, removed, first)"""
+        current = {url_fingerprint(link): link for link in links}
+        with self._lock:
+            previous = dict(self._conn.execute(
+                'SELECT fp, url FROM link_snapshots WHERE crawl_url = ?', (crawl_url,)
+            ).fetchall())
+        added = [current[fp] for fp in current.keys() - previous.keys()]
+        removed = [previous[fp] for fp in previous.keys() - current.keys()]
+        return sorted(added), sorted(removed), not previous
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+class WebhookDispatcher:
+    """Delivers crawl notifications from a background thread.
+
+    One event loop and one aiohttp session live for the life of the
+    dispatcher. notify() only writes to the outbox and returns; deliveries
+    run up to batch_size at a time and failures are retried with
+    exponential backoff (honouring Retry-After) until max_attempts.
+    """
+
+    def __init__(self, webhook_url: str = None, outbox_path: str = WEBHOOK_OUTBOX,
+                 payload_mode: str = WEBHOOK_PAYLOAD, max_attempts: int = WEBHOOK_MAX_ATTEMPTS,
+                 batch_size: int = WEBHOOK_BATCH_SIZE, timeout: float = WEBHOOK_TIMEOUT):
+        if payload_mode not in PAYLOAD_MODES:
+            raise ValueError(f"Unknown webhook payload mode {payload_mode}, choose from {PAYLOAD_MODES}")
+        self.webhook_url = webhook_url or os.getenv('WEBHOOK_URL')
+        self.payload_mode = payload_mode
+        self.max_attempts = max_attempts
+        self.batch_size = batch_size
+        self.timeout = timeout
+        self.outbox = WebhookOutbox(outbox_path)
+        self.logger = logging.getLogger('webhooks')
+        self._loop = None
+        self._wake = None
+        self._stopping = False
+        self._started = threading.Event()
+        self._thread = None
+        QUEUE_DEPTH.set_function(lambda: {('webhooks',): self.outbox.pending()})
+
+    def start(self) -> 'WebhookDispatcher':
+        self._thread = threading.Thread(target=self._run, name='webhook-dispatcher', daemon=True)
+        self._thread.start()
+        self._started.wait()
+        return self
+
+    def _mode(self, mode: str = None) -> str:
+        mode = mode or self.payload_mode
+        if mode not in PAYLOAD_MODES:
+            raise ValueError(f"Unknown webhook payload mode {mode}, choose from {PAYLOAD_MODES}")
+        return mode
+
+    def build_payload(self, crawl_url: str, links, mode: str = None, job_id: str = None) -> dict:
+        """The payload for links, relative to the last notification delivered for crawl_url"""
+        mode = self._mode(mode)
+        payload = {'status': 'success', 'url': crawl_url, 'job_id': job_id,
+                   'mode': mode, 'total_links': len(links)}
+        if mode == 'full':
+            payload['links'] = sorted(links)
+            return payload
+
+        # The snapshot advances on every delivery, whatever its mode, so a
+        # delta is always relative to what the receiver last got
+        added, removed, first = self.outbox.diff_snapshot(crawl_url, links)
+
+        # On the first notification for a URL every link counts as added
+        payload['baseline'] = first
+        if mode == 'delta':
+            payload['added'] = added
+            payload['removed'] = removed
+        else:
+            payload['added'] = len(added)
+            payload['removed'] = len(removed)
+        return payload
+
+    def notify(self, crawl_url: str, links, mode: str = None, job_id: str = None):
+        """Queue a notification for a finished crawl. Returns the outbox id, or None without a webhook URL"""
+        if not self.webhook_url:
+            self.logger.warning("WEBHOOK_URL is not set, not notifying for %s", crawl_url)
+            return None
+        # The payload is built when the notification is sent, after the ones
+        # queued before it for the same URL have been delivered (or dropped)
+        spec = {'mode': self._mode(mode), 'job_id': job_id}
+        notification_id = self.outbox.add(crawl_url, self.webhook_url, spec, links=links)
+        self._signal()
+        return notification_id
+
+    def _signal(self):
+        if self._loop is not None and not self._loop.is_closed():
+            try:
+                self._loop.call_soon_threadsafe(self._wake.set)
+            except RuntimeError:
+                # The loop stopped between the check and the call
+                pass
+
+    def _run(self):
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        try:
+            self._loop.run_until_complete(self._main())
+        finally:
+            self._loop.close()
+
+    async def _main(self):
+        self._wake = asyncio.Event()
+        self._started.set()
+        timeout = aiohttp.ClientTimeout(total=self.timeout)
+        async with aiohttp.ClientSession(timeout=timeout) as session:
+            while not self._stopping:
+                batch = self.outbox.due(self.batch_size)
+                if batch:
+                    await asyncio.gather(*(self._deliver(session, *row) for row in batch))
+                    continue
+
+                next_due = self.outbox.next_due_at()
+                wait = None if next_due is None else max(0.0, next_due - time.time())
+                self._wake.clear()
+                try:
+                    await asyncio.wait_for(self._wake.wait(), timeout=wait)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def _deliver(self, session, notification_id, crawl_url, target, payload, links, attempts):
+        attempts += 1
+        retry_after = None
+        if links is not None:
+            links = json.loads(links)
+            payload = json.dumps(self.build_payload(crawl_url, links, **json.loads(payload)))
+        try:
+            async with session.post(target, data=payload,
+                                    headers={'Content-Type': 'application/json'}) as response:
+                await response.read()
+                if response.status < 300:
+                    self.outbox.delivered(notification_id, crawl_url, links)
+                    WEBHOOK_DELIVERIES.inc(outcome='delivered')
+                    return
+                error = f"HTTP {response.status}"
+                retry_after = parse_retry_after(response.headers.get('Retry-After'))
+                if 400 <= response.status < 500 and response.status not in _RETRYABLE_CLIENT_ERRORS:
+                    self._give_up(notification_id, attempts, error)
+                    return
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            error = f"{type(e).__name__}: {e}"
+
+        if attempts >= self.max_attempts:
+            self._give_up(notification_id, attempts, error)
+            return
+        delay = min(WEBHOOK_BACKOFF_MAX, WEBHOOK_BACKOFF_BASE * (2 ** (attempts - 1)))
+        delay = max(retry_after or 0, delay * random.uniform(0.5, 1.0))
+        self.outbox.retry(notification_id, attempts, time.time() + delay, error)
+        WEBHOOK_DELIVERIES.inc(outcome='retried')
+        self.logger.info("Webhook delivery %d failed (%s), retrying in %.1fs",
+                         notification_id, error, delay)
+
+    def _give_up(self, notification_id, attempts, error):
+        self.outbox.dead(notification_id, attempts, error)
+        WEBHOOK_DELIVERIES.inc(outcome='dropped')
+        self.logger.error("Giving up on webhook delivery %d after %d attempts: %s",
+                          notification_id, attempts, error)
+
+    def stop(self, timeout: float = 5.0):
+        """Stop the delivery loop; undelivered notifications stay in the outbox"""
+        self._stopping = True
+        self._signal()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            if self._thread.is_alive():
+                return
+        self.outbox.close()